@@ -0,0 +1,10 @@
+"""Configuration of the tests of the gi-free webbrowser2 modules."""
+
+import sys
+import pathlib
+
+# Import webbrowser2 from this tree.
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+# The other scripts in this directory are manual GTK and WebKit demos.
+collect_ignore_glob = ['*_test.py', 'webkit*.py', 'simple_webkit*.py']
@@ -0,0 +1,181 @@
+"""Tests of the Adblock Plus filter list compiler."""
+
+import re
+import json
+
+import pytest
+
+from webbrowser2 import abp
+from webbrowser2.abp import convert_filter, compile_filters, chunk_filters
+
+
+def url_filter_matches(rules: list, uri: str) -> bool:
+    return any(re.search(rule['trigger']['url-filter'], uri)
+               for rule in rules)
+
+
+@pytest.mark.parametrize('line', ['', '! comment', '[Adblock Plus 2.0]'])
+def test_comments(line):
+    assert convert_filter(line) == []
+
+
+def test_domain_anchor():
+    rules = convert_filter('||ads.example.com^')
+    assert all(rule['action']['type'] == 'block' for rule in rules)
+    assert url_filter_matches(rules, 'https://ads.example.com/x.js')
+    assert url_filter_matches(rules, 'https://cdn.ads.example.com')
+    assert not url_filter_matches(rules, 'https://ads.example.community/')
+    assert not url_filter_matches(rules, 'https://example.org/?ads.example.com')
+
+
+def test_options():
+    rule, = convert_filter('/banner/*$image,third-party,domain=a.com')
+    assert rule['trigger'] == {
+        'url-filter': '/banner/', 'resource-type': ['image'],
+        'load-type': ['third-party'], 'if-domain': ['*a.com'],
+    }
+
+
+def test_unsupported_option():
+    with pytest.raises(ValueError):
+        convert_filter('||x.com^$csp=script-src')
+
+
+def test_element_hiding():
+    rule, = convert_filter('example.com,~m.example.com##.ad')
+    assert rule['action'] == {'type': 'css-display-none', 'selector': '.ad'}
+    assert rule['trigger']['if-domain'] == ['*example.com']
+    with pytest.raises(ValueError):
+        convert_filter('##div:-abp-has(.ad)')
+
+
+def test_document_exception():
+    rule, = convert_filter('@@||good.com^$document')
+    assert rule == {
+        'trigger': {'url-filter': '.*', 'if-domain': ['*good.com']},
+        'action': {'type': 'ignore-previous-rules'},
+    }
+
+
+def test_subdocument_exception():
+    # Only frames from the domain are allowed, not the whole page.
+    rules = convert_filter('@@||good.com^$subdocument')
+    for rule in rules:
+        assert rule['trigger']['resource-type'] == ['document']
+        assert 'if-domain' not in rule['trigger']
+    assert url_filter_matches(rules, 'https://good.com/frame')
+
+
+@pytest.mark.parametrize('line', [
+    '@@||good.com^$document,domain=foo.com',
+    '@@||good.com^$document,domain=~foo.com',
+])
+def test_document_exception_with_domain_rejected(line):
+    # The exception must not be widened to every page on good.com.
+    with pytest.raises(ValueError):
+        convert_filter(line)
+
+
+def test_is_filter_list():
+    assert abp.is_filter_list(b'[Adblock Plus 2.0]\n||a.com^')
+    assert abp.is_filter_list(b'||a.com^')
+    assert not abp.is_filter_list(b' [{"trigger": {}}]')
+    assert not abp.is_filter_list(b'[]')
+
+
+def test_filter_ids():
+    id_list = ['list', 'list.1', 'list.2', 'list2.1', 'other']
+    assert abp.filter_ids('list', id_list) == ['list', 'list.1', 'list.2']
+
+
+def make_lines(count: int) -> list:
+    lines = []
+    for number in range(count):
+        if number % 50 == 7:
+            lines.append(f'@@||good{number}.example.com^$document')
+        elif number % 2:
+            lines.append(f'||ads{number}.example.com^')
+        else:
+            lines.append(f'example{number}.com##.ad-{number}')
+
+    return lines
+
+
+def chunk_ids(lines: list, cache: dict = None) -> tuple:
+    chunks, cache = compile_filters('\n'.join(lines), cache or {})
+    return {chunk_id for chunk_id, _ in chunk_filters('l', chunks)}, cache
+
+
+def test_compile_keeps_every_rule():
+    lines = make_lines(2000)
+    chunks, cache = compile_filters('\n'.join(lines))
+    exceptions = [json.dumps(rule) for line in lines if line.startswith('@@')
+                  for rule in convert_filter(line)]
+    blocks = sorted(json.dumps(rule) for line in lines
+                    if not line.startswith('@@')
+                    for rule in convert_filter(line))
+
+    seen = []
+    for chunk in chunks:
+        rules = [json.dumps(rule) for rule in json.loads(chunk)]
+        # Every chunk ends with all the exceptions.
+        assert sorted(rules[-len(exceptions):]) == sorted(exceptions)
+        seen += rules[:-len(exceptions)]
+    assert sorted(seen) == blocks
+    assert len(chunks) <= abp.CHUNK_COUNT
+
+
+def test_compile_uses_cache():
+    lines = make_lines(200)
+    _, cache = compile_filters('\n'.join(lines))
+    # A cached entry is used instead of compiling the filter again.
+    key = abp._filter_hash(lines[1])
+    cache[key] = ['block', 1, '{"trigger":{"url-filter":"cached"},'
+                              '"action":{"type":"block"}}']
+    chunks, new_cache = compile_filters('\n'.join(lines), cache)
+    assert any('"cached"' in chunk for chunk in chunks)
+    assert new_cache[key] == cache[key]
+
+
+def test_chunks_stable(monkeypatch):
+    lines = [line for line in make_lines(4000) if not line.startswith('@@')]
+    old_ids, cache = chunk_ids(lines)
+
+    # Adding filters only changes the chunks they go in.
+    new_ids, _ = chunk_ids(lines + ['||added1.com^', '||added2.com^'], cache)
+    assert len(new_ids - old_ids) <= 2
+    assert len(old_ids - new_ids) <= 2
+
+    # A changed filter changes at most its old and new chunk.
+    changed = list(lines)
+    changed[10] = '||changed.com^'
+    changed_ids, _ = chunk_ids(changed, cache)
+    assert len(changed_ids - old_ids) <= 2
+
+    # Removing filters from a list big enough to split its buckets only
+    # changes their chunks.
+    monkeypatch.setattr(abp, 'MAX_RULES', 500)
+    grown = lines + [f'||more{number}.com^' for number in range(10000)]
+    grown_ids, cache = chunk_ids(grown, cache)
+    assert len(grown_ids) > abp.CHUNK_COUNT
+    shrunk_ids, _ = chunk_ids(grown[:-3], cache)
+    assert len(grown_ids - shrunk_ids) <= 3
+
+
+def test_big_bucket_split(monkeypatch):
+    monkeypatch.setattr(abp, 'MAX_RULES', 300)
+    lines = [f'||ads{number}.example.com^' for number in range(2000)]
+    chunks, _ = compile_filters('\n'.join(lines))
+    assert all(len(json.loads(chunk)) <= 300 for chunk in chunks)
+    assert sum(len(json.loads(chunk)) for chunk in chunks) == 4000
+
+
+def test_cache_file(tmp_path):
+    path = abp.cache_path(tmp_path, 'list')
+    assert abp.load_cache(path) == {}
+    _, cache = compile_filters('||a.com^\n##.ad')
+    abp.save_cache(path, cache)
+    assert abp.load_cache(path) == cache
+
+    path.write_text(json.dumps({'version': abp.VERSION - 1, 'filters': cache}))
+    assert abp.load_cache(path) == {}
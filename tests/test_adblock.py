@@ -0,0 +1,98 @@
+"""Tests of the adblock regex matcher."""
+
+import re
+import random
+
+import pytest
+
+from webbrowser2.adblock import AdBlockMatcher, required_literals
+from webbrowser2.adblock import content_rules
+
+
+@pytest.mark.parametrize('pattern, literals', [
+    (r'doubleclick\.net', ['doubleclick.net']),
+    (r'\/ads\/', ['/ads/']),
+    (r'ad\x2dserver', ['ad-server']),
+    (r'aAbc', ['aAbc']),
+    (r'a\101bcd', ['aAbcd']),
+    (r'a\0b', ['a\x00b']),
+    (r'(a)\1xyz', ['xyz']),
+    (r'x\N{HYPHEN-MINUS}yz', ['x', 'yz']),
+    (r'\d+banner', ['banner']),
+    (r'ads?x', ['ad', 'x']),
+    (r'ad{0,2}', ['a']),
+    (r'[?&]utm_[a-z]+=', ['utm_', '=']),
+    (r'foo|bar', []),
+    (r'(?i)ads', []),
+])
+def test_required_literals(pattern, literals):
+    assert required_literals(pattern) == literals
+
+
+def make_filters():
+    filters = {
+        'ads': r'\/ads\/',
+        'doubleclick': r'doubleclick\.net',
+        'hex escape': r'ad\x2dserver',
+        'octal escape': r'a\101bcd',
+        'tracker': r'[?&]utm_[a-z]+=',
+        'alternatives': r'(^|\.)adhost\d\.(com|net)\/',
+        'short': r'\.gif$',
+        'no literal': r'^https?:\/\/\d+\.\d+',
+    }
+    for number in range(50):
+        filters[f'banner {number}'] = rf'\/banner{number}[_-]\d+x\d+\.'
+
+    return filters
+
+
+def make_uris():
+    random.seed(0)
+    uris = [
+        'https://ad-server.example.com/', 'https://a.org/aAbcd',
+        'https://adx2dserver.org/', 'https://a.org/a101bcd',
+        'https://x.adhost3.net/a', 'https://adhost3.net.evil/',
+        'http://10.0.0.1/', 'https://a.org/pixel.gif',
+    ]
+    for _ in range(500):
+        host = random.choice(('www.example.org', 'cdn.adhost4.com',
+                              'ad.doubleclick.net'))
+        path = random.choice(('ads/x.js', f'banner{random.randrange(80)}_'
+                              '300x250.png', 'page', 'pixel.gif'))
+        query = random.choice(('', '?utm_source=x', '?id=1'))
+        uris.append(f'https://{host}/{path}{query}')
+
+    return uris
+
+
+def test_matcher_agrees_with_search():
+    filters = make_filters()
+    matcher = AdBlockMatcher(filters)
+    for uri in make_uris():
+        expected = any(re.search(regex, uri) for regex in filters.values())
+        name = matcher.match(uri)
+        assert bool(name) == expected, uri
+        if name: assert re.search(filters[name], uri)
+
+
+def test_matcher_add_remove():
+    matcher = AdBlockMatcher({'ads': r'\/ads\/'})
+    assert matcher.match('https://a.org/ads/1')
+    matcher.remove('ads')
+    assert not matcher.match('https://a.org/ads/1')
+    assert not matcher.add('bad', '(')
+    assert len(matcher) == 0
+
+
+def test_content_rules_agree_with_search():
+    filters = make_filters()
+    rules, skipped = content_rules(filters)
+    url_filters = [re.compile(rule['trigger']['url-filter'])
+                   for rule in rules]
+    skipped_matcher = AdBlockMatcher({name: filters[name]
+                                      for name in skipped})
+    for uri in make_uris():
+        expected = any(re.search(regex, uri) for regex in filters.values())
+        blocked = (any(url_filter.search(uri) for url_filter in url_filters)
+                   or bool(skipped_matcher.match(uri)))
+        assert blocked == expected, uri
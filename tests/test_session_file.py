@@ -0,0 +1,65 @@
+"""Tests of the session file format."""
+
+import json
+import base64
+
+import pytest
+
+from webbrowser2 import session_file
+
+
+def make_sessions():
+    return [
+        {'session-data': bytes(range(256)) * 3, 'uri': 'https://a.org/',
+         'title': 'A', 'index': 0, 'pid': 10},
+        {'session-data': b'', 'uri': 'about:blank', 'title': '', 'index': 1,
+         'pid': 11},
+    ]
+
+
+def test_round_trip():
+    sessions = make_sessions()
+    assert session_file.loads(session_file.dumps(sessions)) == sessions
+
+
+def test_empty_sessions_dropped():
+    sessions = make_sessions()
+    data = session_file.dumps([{}, *sessions, None])
+    assert session_file.loads(data) == sessions
+
+
+def test_legacy_json_migrated():
+    sessions = make_sessions()
+    legacy = json.dumps([
+        {**session, 'session-data': base64.encodebytes(
+            session['session-data']).decode()}
+        for session in sessions
+    ]).encode()
+
+    loaded = session_file.loads(legacy)
+    assert loaded == sessions
+
+    # Saving again writes the new format.
+    data = session_file.dumps(loaded)
+    assert data.startswith(session_file.MAGIC)
+    assert session_file.loads(data) == sessions
+
+
+def test_legacy_bad_base64():
+    with pytest.raises(ValueError):
+        session_file.loads(b'[{"session-data": "a"}]')
+
+
+def test_truncated():
+    data = session_file.dumps(make_sessions())
+    with pytest.raises(ValueError):
+        session_file.loads(data[:-1])
+    with pytest.raises(ValueError):
+        session_file.loads(session_file.MAGIC + b'\x01')
+
+
+def test_unknown_version():
+    data = bytearray(session_file.dumps(make_sessions()))
+    data[len(session_file.MAGIC)] = session_file.VERSION + 1
+    with pytest.raises(ValueError):
+        session_file.loads(bytes(data))
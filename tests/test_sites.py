@@ -0,0 +1,68 @@
+"""Tests of finding the site of a uri."""
+
+import pytest
+
+from webbrowser2 import sites
+from webbrowser2.sites import site_for_uri
+
+
+@pytest.fixture
+def suffix_list(tmp_path, monkeypatch):
+    path = tmp_path / 'public_suffix_list.dat'
+    path.write_text(
+        '// comment\n'
+        'com\nuk\nco.uk\nio\ngithub.io\njp\n*.kawasaki.jp\n'
+        '!city.kawasaki.jp\n'
+        '公司.cn\ncn\n',
+        encoding='utf-8'
+    )
+    monkeypatch.setattr(sites, 'PUBLIC_SUFFIX_LIST', path)
+    sites._public_suffixes.cache_clear()
+    yield
+    sites._public_suffixes.cache_clear()
+
+
+@pytest.fixture
+def no_suffix_list(tmp_path, monkeypatch):
+    monkeypatch.setattr(sites, 'PUBLIC_SUFFIX_LIST', tmp_path / 'missing')
+    sites._public_suffixes.cache_clear()
+    yield
+    sites._public_suffixes.cache_clear()
+
+
+@pytest.mark.parametrize('uri, site', [
+    ('https://www.example.com/page', 'example.com'),
+    ('https://images.example.com', 'example.com'),
+    ('https://example.com./', 'example.com'),
+    ('https://news.bbc.co.uk/', 'bbc.co.uk'),
+    ('https://foo.github.io/', 'foo.github.io'),
+    ('https://bar.github.io/', 'bar.github.io'),
+    ('https://a.b.kawasaki.jp/', 'a.b.kawasaki.jp'),
+    ('https://www.city.kawasaki.jp/', 'city.kawasaki.jp'),
+    ('https://a.example.xn--55qx5d.cn/', 'example.xn--55qx5d.cn'),
+    ('https://unknown.tld/', 'unknown.tld'),
+])
+def test_public_suffix(suffix_list, uri, site):
+    assert site_for_uri(uri) == site
+
+
+@pytest.mark.parametrize('uri, site', [
+    ('https://www.example.com/', 'example.com'),
+    ('https://news.bbc.co.uk/', 'bbc.co.uk'),
+    ('https://www.example.com.au/', 'example.com.au'),
+    ('https://foo.example.de/', 'example.de'),
+])
+def test_fallback(no_suffix_list, uri, site):
+    assert site_for_uri(uri) == site
+
+
+@pytest.mark.parametrize('uri, site', [
+    ('http://127.0.0.1:8080/', '127.0.0.1'),
+    ('http://10.1.2.3/', '10.1.2.3'),
+    ('http://[::1]/', '::1'),
+    ('about:blank', ''),
+    ('file:///tmp/x.html', ''),
+    ('http://[', ''),
+])
+def test_no_domain(uri, site):
+    assert site_for_uri(uri) == site
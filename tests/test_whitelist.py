@@ -0,0 +1,59 @@
+"""Tests of the content filter whitelist index."""
+
+import pytest
+
+from webbrowser2.whitelist import WhitelistIndex, split_entry
+
+
+@pytest.mark.parametrize('entry, expected', [
+    ('example.com', ('example.com', '')),
+    (' example.com/forum/ ', ('example.com', '/forum')),
+    ('https://*.example.com/a', ('example.com', '/a')),
+    ('http://[', ('', '')),
+])
+def test_split_entry(entry, expected):
+    assert split_entry(entry) == expected
+
+
+@pytest.fixture
+def index():
+    return WhitelistIndex({
+        'host': 'example.com',
+        'forum': 'example.org/forum',
+        'deep': 'a.example.net/x/y',
+    })
+
+
+@pytest.mark.parametrize('uri, name', [
+    ('https://example.com/', 'host'),
+    ('https://www.example.com/any/path', 'host'),
+    ('https://example.com.evil.net/', ''),
+    ('https://notexample.com/', ''),
+    ('https://ads.net/?ref=example.com', ''),
+    ('https://example.org/forum', 'forum'),
+    ('https://example.org/forum/', 'forum'),
+    ('https://www.example.org/forum/thread?id=1', 'forum'),
+    ('https://example.org/forums', ''),
+    ('https://example.org/forumthread', ''),
+    ('https://example.org/', ''),
+    ('https://a.example.net/x/y/z', 'deep'),
+    ('https://a.example.net/x/yz', ''),
+    ('https://b.example.net/x/y', ''),
+    ('about:blank', ''),
+    ('not a uri', ''),
+])
+def test_match(index, uri, name):
+    assert index.match(uri) == name
+
+
+def test_add_remove(index):
+    assert len(index) == 3
+    index.add('host', 'example.com/only')
+    assert index.match('https://example.com/only/page') == 'host'
+    assert index.match('https://example.com/') == ''
+    index.remove('host')
+    assert index.match('https://example.com/only') == ''
+    assert len(index) == 2
+    index.remove('missing')
+    index.add('bad', '')
+    assert len(index) == 2
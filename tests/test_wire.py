@@ -0,0 +1,57 @@
+"""Tests of the tab message wire format."""
+
+from multiprocessing import Pipe
+
+import pytest
+
+from webbrowser2 import wire
+
+
+@pytest.mark.parametrize('signal, data', [
+    ('estimated-load-progress', 0.5),
+    ('load-status', 3),
+    ('hover-link', {'uri': 'https://example.com/', 'title': None}),
+    ('is-loading', False),
+    ('title', 'Café 😀'),
+    ('uri', None),
+    ('icon-bytes', b'\x89PNG'),
+    ('session-data', b''),
+    ('back-forward-ops', [('truncate', 0), ('current', 2)]),
+    ('tab-info', {'pid': 1, 'uri': 'about:blank'}),
+    ('not-a-signal', [1, 2, 3]),
+])
+def test_round_trip(signal, data):
+    assert wire.decode(wire.encode(signal, data)) == (signal, data)
+    assert wire.decode_tab(wire.encode_tab(-3, signal, data)) == (
+        -3, signal, data)
+
+
+def test_fixed_layout_used():
+    _, encoding, _ = wire._header.unpack_from(wire.encode('is-loading', True))
+    assert encoding == wire.FIXED
+
+
+def test_bad_data_is_pickled():
+    # Data that doesn't fit the layout of its signal is still sent.
+    message = wire.encode('load-status', 1000)
+    _, encoding, _ = wire._header.unpack_from(message)
+    assert encoding == wire.PICKLE
+    assert wire.decode(message) == ('load-status', 1000)
+
+
+def test_other_version_rejected():
+    message = bytearray(wire.encode('title', 'x'))
+    message[0] = wire.VERSION + 1
+    with pytest.raises(ValueError):
+        wire.decode(bytes(message))
+
+
+def test_signal_ids_unique():
+    assert len(set(wire.SIGNALS)) == len(wire.SIGNALS)
+    assert set(wire.LAYOUTS) <= set(wire.SIGNALS)
+
+
+def test_pipe_round_trip():
+    recv_pipe, send_pipe = Pipe(duplex=False)
+    wire.send_message(send_pipe, 'title', 'Example')
+    assert wire.recv_message(recv_pipe) == ('title', 'Example')
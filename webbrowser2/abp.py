@@ -0,0 +1,466 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:sts=4:fdm=indent:fdl=0:
+# -*- coding: UTF8 -*-
+#
+# Adblock Plus filter list compiler
+# Copyright (C) 2016 Josiah Gordon <josiahg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Compile Adblock Plus filter lists into WebKit content blocker rules.
+
+Network filters with the $domain, $third-party, $match-case and resource
+type options, exceptions, and element hiding filters are compiled.  Other
+filters are skipped.
+
+The JSON of the rules of every filter is kept by the hash of the filter,
+so only the filters that changed since the last compile are compiled
+again.  Lists are split into CHUNK_COUNT chunks by the hash of each
+filter, so a changed filter only changes its own chunk for WebKit to
+compile, and adding or removing filters never moves the others.  A
+changed exception changes every chunk, since all of them have the
+exceptions.
+"""
+
+import re
+import json
+import math
+import hashlib
+import logging
+import pathlib
+
+from .adblock import url_filters
+
+# Bump this when the rules of a filter change, so the caches of older
+# versions aren't used.
+VERSION = 3
+
+# The most rules in one content filter, and how many chunks the filters
+# are split into.  A chunk with too many rules is split again.
+MAX_RULES = 50000
+CHUNK_COUNT = 32
+
+# What url-filters start with for || and ^ in filters.
+_DOMAIN_START = r'^[a-z][a-z0-9.+-]*://([^/:]+\.)?'
+_SEPARATOR = '[^a-zA-Z0-9_.%-]'
+
+_SPECIAL = frozenset('.+?^${}()[]|\\')
+
+# The WebKit resource types of the Adblock Plus ones.
+_TYPES = {
+    'script': 'script',
+    'image': 'image',
+    'stylesheet': 'style-sheet',
+    'font': 'font',
+    'media': 'media',
+    'object': 'media',
+    'subdocument': 'document',
+    'document': 'document',
+    'popup': 'popup',
+    'xmlhttprequest': 'raw',
+    'websocket': 'raw',
+    'ping': 'raw',
+    'other': 'raw',
+}
+_ALL_TYPES = frozenset(_TYPES.values()) - {'popup'}
+
+# Options that don't change what is blocked.
+_IGNORED_OPTIONS = frozenset(('collapse', '~collapse', 'important'))
+
+# Selectors only Adblock Plus understands.
+_EXTENDED_SELECTOR = re.compile(r':-abp-|:has\(|:xpath\(|:style\(|:contains\(')
+
+
+def is_filter_list(data: bytes) -> bool:
+    """Return True if data is an Adblock Plus list and not WebKit JSON."""
+    data = data.lstrip()
+    if not data.startswith(b'['): return True
+
+    return data[1:].lstrip()[:1] not in (b'{', b']')
+
+
+def filter_ids(filter_id: str, id_list: list) -> list:
+    """Return the ids in id_list of filter_id and of its chunks."""
+    return [
+        other_id for other_id in id_list
+        if other_id == filter_id or other_id.startswith(f'{filter_id}.')
+    ]
+
+
+def _pattern_filters(pattern: str) -> list:
+    """Return the url-filters of the pattern of a network filter."""
+    if len(pattern) > 2 and pattern[0] == pattern[-1] == '/':
+        return url_filters(pattern[1:-1])
+
+    start = end = ''
+    if pattern.startswith('||'):
+        start, pattern = _DOMAIN_START, pattern[2:]
+    elif pattern.startswith('|'):
+        start, pattern = '^', pattern[1:]
+    if pattern.endswith('|'):
+        end, pattern = '$', pattern[:-1]
+
+    # A separator at the end also matches the end of the uri.
+    ends = [end]
+    if not end and pattern.endswith('^'):
+        pattern = pattern[:-1]
+        ends = [_SEPARATOR, '$']
+
+    # Wildcards at unanchored ends match nothing more.
+    if not start: pattern = pattern.lstrip('*')
+    if ends == ['']: pattern = pattern.rstrip('*')
+    if not pattern.isascii(): raise ValueError('Not ascii')
+
+    body = ''.join(
+        '.*' if char == '*' else _SEPARATOR if char == '^' else
+        f'\\{char}' if char in _SPECIAL else char
+        for char in pattern
+    )
+    if not (start or body or any(ends)): body = '.*'
+
+    return [f'{start}{body}{tail}' for tail in ends]
+
+
+def _domains(text: str, separator: str) -> tuple:
+    """Return the included and excluded domains in text."""
+    included, excluded = [], []
+    for domain in text.split(separator):
+        domain = domain.strip().lower()
+        if not domain: continue
+        domains = excluded if domain.startswith('~') else included
+        domain = domain.lstrip('~')
+        if not domain.isascii(): raise ValueError(f'Not ascii: {domain}')
+        domains.append(f'*{domain}')
+
+    return included, excluded
+
+
+def _set_domains(trigger: dict, included: list, excluded: list):
+    """Set the domains of trigger.
+
+    WebKit can't have both kinds, and an excluded domain is usually under
+    an included one, so the excluded ones are dropped then.
+    """
+    if included:
+        trigger['if-domain'] = included
+    elif excluded:
+        trigger['unless-domain'] = excluded
+
+
+def _network_rules(line: str) -> list:
+    """Return the rules of a network filter."""
+    exception = line.startswith('@@')
+    if exception: line = line[2:]
+
+    pattern, options = line, ''
+    # A $ in a regex is an anchor, not the start of the options.
+    if '$' in line and not (line.startswith('/') and line.endswith('/')):
+        pattern, options = line.rsplit('$', 1)
+
+    trigger = {}
+    types = set()
+    excluded_types = set()
+    # Keep the Adblock Plus names too, $subdocument and $document are both
+    # the document type in WebKit.
+    type_names = set()
+    for option in filter(None, options.split(',')):
+        option = option.strip().lower()
+        name = option.lstrip('~')
+        if option in _IGNORED_OPTIONS:
+            continue
+        elif option.startswith('domain='):
+            _set_domains(trigger, *_domains(option[7:], '|'))
+        elif name == 'third-party':
+            negated = option.startswith('~')
+            trigger['load-type'] = ['first-party' if negated else
+                                    'third-party']
+        elif option == 'match-case':
+            trigger['url-filter-is-case-sensitive'] = True
+        elif name in _TYPES:
+            kinds = excluded_types if option.startswith('~') else types
+            kinds.add(_TYPES[name])
+            if kinds is types: type_names.add(name)
+        else:
+            raise ValueError(f'Unsupported option: {option}')
+
+    if excluded_types and not types: types = _ALL_TYPES - excluded_types
+    if types: trigger['resource-type'] = sorted(types)
+
+    action = {'type': 'ignore-previous-rules' if exception else 'block'}
+
+    # An exception for a whole page is for the pages on its domain.
+    if (exception and type_names == {'document'} and
+            pattern.startswith('||')):
+        domain = pattern[2:].rstrip('^|/')
+        if not domain.isascii(): raise ValueError(f'Not ascii: {domain}')
+        # The rule can only have the domain of the pattern, so don't
+        # widen it to the pages on other domains.
+        if 'if-domain' in trigger or 'unless-domain' in trigger:
+            raise ValueError('Unsupported option: domain with document')
+        trigger.pop('resource-type')
+        trigger.update({'url-filter': '.*', 'if-domain': [f'*{domain}']})
+        return [{'trigger': trigger, 'action': action}]
+
+    return [
+        {'trigger': {'url-filter': url_filter, **trigger}, 'action': action}
+        for url_filter in _pattern_filters(pattern)
+    ]
+
+
+def _hiding_rules(domains: str, selector: str) -> list:
+    """Return the rule of an element hiding filter."""
+    if _EXTENDED_SELECTOR.search(selector) or not selector.isascii():
+        raise ValueError(f'Unsupported selector: {selector}')
+
+    trigger = {'url-filter': '.*'}
+    _set_domains(trigger, *_domains(domains, ','))
+
+    return [{
+        'trigger': trigger,
+        'action': {'type': 'css-display-none', 'selector': selector},
+    }]
+
+
+def convert_filter(line: str) -> list:
+    """Return the WebKit content blocker rules of the filter line.
+
+    Return an empty list for comments.  Raise ValueError if the filter
+    can't be compiled.
+    """
+    line = line.strip()
+    if not line or line.startswith(('!', '[')): return []
+
+    if '#@#' in line or '#?#' in line or '#$#' in line:
+        raise ValueError('Unsupported element hiding filter')
+    if '##' in line:
+        return _hiding_rules(*line.split('##', 1))
+
+    return _network_rules(line)
+
+
+def _filter_hash(line: str) -> str:
+    """Return the key of the filter line in the cache."""
+    return hashlib.blake2b(line.encode(), digest_size=8).hexdigest()
+
+
+def compile_filters(text: str, cache: dict = {}) -> tuple:
+    """Compile the filter list text into chunks of rules.
+
+    cache maps the hash of each filter to the kind, count and JSON of its
+    rules from the last compile, and those filters aren't compiled again.
+    Return the JSON of each chunk and the cache of this compile, which
+    only has the filters in text.
+    """
+    new_cache = {}
+    reused = skipped = 0
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith(('!', '[')): continue
+
+        key = _filter_hash(line)
+        if key in new_cache: continue
+
+        entry = cache.get(key)
+        if entry is not None:
+            reused += 1
+        else:
+            entry = _cache_entry(line)
+        if not entry[1]: skipped += 1
+        new_cache[key] = entry
+
+    logging.info(f'ABP: {len(new_cache)} filters, {reused} reused, '
+                 f'{skipped} skipped')
+
+    return _chunk(new_cache), new_cache
+
+
+def _cache_entry(line: str) -> list:
+    """Return the kind, count and JSON of the rules of the filter line."""
+    try:
+        rules = convert_filter(line)
+    except ValueError as err:
+        logging.debug(f'ABP: Skipping {line}: {err}')
+        rules = []
+
+    if not rules: return ['', 0, '']
+
+    kind = rules[0]['action']['type']
+    rules_json = json.dumps(rules, separators=(',', ':'))[1:-1]
+
+    return [kind, len(rules), rules_json]
+
+
+def _chunk(cache: dict) -> list:
+    """Return the JSON of the chunks of the rules in cache.
+
+    Every filter goes in the chunk picked by its hash, which doesn't
+    depend on the other filters.  Exceptions only apply to the rules in
+    their own content filter, so all of them are put at the end of every
+    chunk.
+    """
+    buckets = [[] for _ in range(CHUNK_COUNT)]
+    exceptions = []
+    exception_count = 0
+    for key in sorted(cache):
+        kind, count, rules_json = cache[key]
+        if kind == 'ignore-previous-rules':
+            exceptions.append(rules_json)
+            exception_count += count
+        elif count:
+            hash_value = int(key, 16)
+            buckets[hash_value % CHUNK_COUNT].append(
+                (hash_value // CHUNK_COUNT, count, rules_json))
+
+    room = MAX_RULES - exception_count
+    if room <= 0: raise ValueError('Too many exceptions for one chunk')
+
+    chunks = []
+    for bucket in buckets:
+        chunks.extend(_split_bucket(bucket, room))
+
+    return ['[' + ','.join(chunk + exceptions) + ']' for chunk in chunks]
+
+
+def _split_bucket(bucket: list, room: int) -> list:
+    """Split the rules in bucket into chunks of at most room rules.
+
+    Only a bucket with too many rules is split, by the rest of the hash
+    of each filter, so the other buckets stay the same.
+    """
+    if not bucket: return []
+    if max(count for _, count, _ in bucket) > room:
+        raise ValueError('Too many rules in one filter')
+
+    part_count = math.ceil(sum(count for _, count, _ in bucket) / room)
+    while True:
+        parts = [[] for _ in range(part_count)]
+        counts = [0] * part_count
+        for hash_value, count, rules_json in bucket:
+            index = hash_value % part_count
+            parts[index].append(rules_json)
+            counts[index] += count
+        if max(counts) <= room: break
+        part_count += 1
+
+    return [part for part in parts if part]
+
+
+def chunk_filters(filter_id: str, chunks: list) -> list:
+    """Return the id and JSON bytes of each chunk of filter_id.
+
+    The id of a chunk has the hash of its rules in it, so the chunks that
+    didn't change keep their ids.
+    """
+    chunk_list = []
+    for chunk in chunks:
+        data = chunk.encode()
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        chunk_list.append((f'{filter_id}.{digest}', data))
+
+    return chunk_list
+
+
+def cache_path(filter_path: str, filter_id: str) -> pathlib.Path:
+    """Return the path of the compile cache of filter_id."""
+    digest = hashlib.sha256(filter_id.encode()).hexdigest()[:16]
+
+    return pathlib.Path(filter_path, f'abp-cache-{digest}.json')
+
+
+def load_cache(path: pathlib.Path) -> dict:
+    """Return the compile cache in path, or an empty one."""
+    try:
+        cache = json.loads(path.read_bytes())
+    except (OSError, ValueError) as err:
+        logging.info(f'ABP: No cache {path}: {err}')
+        return {}
+
+    if cache.get('version') != VERSION: return {}
+
+    return cache.get('filters', {})
+
+
+def save_cache(path: pathlib.Path, cache: dict):
+    """Save the compile cache to path."""
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({'version': VERSION, 'filters': cache},
+                                   separators=(',', ':')))
+    except OSError as err:
+        logging.error(f'ABP: Cache not saved {path}: {err}')
+
+
+if __name__ == '__main__':
+    # Compile a filter list, change a few filters and compile it again.
+    # Give the path of a list to use it instead of a made up one.
+    import sys
+    import time
+    import random
+
+    random.seed(0)
+
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding='utf-8', errors='replace') as f:
+            lines = f.read().splitlines()
+    else:
+        lines = ['[Adblock Plus 2.0]', '! Title: Made up list']
+        for number in range(70000):
+            kind = number % 7
+            if kind == 0:
+                lines.append(f'||ads{number}.example.com^')
+            elif kind == 1:
+                lines.append(f'/banner{number}/*$image,third-party')
+            elif kind == 2:
+                lines.append(f'||cdn{number}.net/ad.js$script,'
+                             f'domain=site{number}.org|~news.site{number}.org')
+            elif kind == 3:
+                lines.append(f'site{number}.com##.ad-box-{number}')
+            elif kind == 4:
+                lines.append(f'##div[id^="sponsor-{number}"]')
+            elif kind == 5:
+                lines.append(f'|https://track{number}.example.net/pixel.gif|')
+            else:
+                lines.append(f'@@||good{number}.example.com^$document'
+                             if number % 700 == 6 else
+                             f'-advert-{number}.')
+
+    start = time.perf_counter()
+    chunks, cache = compile_filters('\n'.join(lines))
+    chunk_list = chunk_filters('list', chunks)
+    elapsed = time.perf_counter() - start
+    rule_count = sum(len(json.loads(data)) for _, data in chunk_list)
+    print(f'{len(lines)} lines: {rule_count} rules in {len(chunks)} '
+          f'chunks, compiled in {elapsed:.2f} s')
+
+    for changes in (1, 5, 50):
+        for index in random.sample(range(2, len(lines)), changes):
+            lines[index] = f'||changed{index}.example.com^$third-party'
+
+        start = time.perf_counter()
+        chunks, cache = compile_filters('\n'.join(lines), cache)
+        new_chunk_list = chunk_filters('list', chunks)
+        elapsed = time.perf_counter() - start
+        changed = set(new_chunk_list) - set(chunk_list)
+        chunk_list = new_chunk_list
+        print(f'{changes:2} changed filters: compiled in {elapsed:.2f} s, '
+              f'{len(changed)} of {len(chunk_list)} chunks changed')
+
+    # Adding filters only changes the chunks they go in.
+    lines += [f'||added{number}.example.com^' for number in range(3)]
+    chunks, cache = compile_filters('\n'.join(lines), cache)
+    new_chunk_list = chunk_filters('list', chunks)
+    changed = set(new_chunk_list) - set(chunk_list)
+    print(f' 3 added filters: {len(changed)} of {len(new_chunk_list)} '
+          f'chunks changed')
@@ -0,0 +1,620 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:sts=4:fdm=indent:fdl=0:
+# -*- coding: UTF8 -*-
+#
+# AdBlock uri matcher
+# Copyright (C) 2016 Josiah Gordon <josiahg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Match uris against the adblock regexes of a profile.
+
+Every regex is compiled once, and the literal text every match of it has
+to contain is indexed by its GRAM_SIZE character substrings.  A uri is
+only searched with the regexes whose literal is in it, and the result for
+recent uris is cached.
+
+The regexes are also compiled into WebKit content blocker rules, so the
+network process blocks the subresources the plug process never sees.
+"""
+
+import re
+import json
+import hashlib
+import logging
+from collections import OrderedDict
+
+# The length of the substrings literals are indexed by.
+GRAM_SIZE = 4
+
+# The start of the ids of the content filters made from adblock regexes.
+CONTENT_FILTER_PREFIX = 'webbrowser2-adblock-'
+
+# Bump this when content_rules makes different rules, so the content
+# filters saved by older versions are compiled again.
+CONTENT_RULES_VERSION = 1
+
+# The most url-filters one regex may be expanded into.
+MAX_EXPANSION = 32
+
+_FLAGS = frozenset('aiLmsux-')
+
+# The url-filter syntax has no escaped classes.
+_CLASSES = {'d': '0-9', 'w': 'A-Za-z0-9_'}
+
+# Stand ins for anchors while the url-filters are put together, since
+# WebKit only allows them at the ends.
+_START, _END = '\x01', '\x02'
+
+
+def _skip_class(pattern: str, index: int) -> int:
+    """Return the index after the character class starting at index.
+
+    Return -1 if the class doesn't end.
+    """
+    index += 1
+    if pattern[index:index + 1] == '^': index += 1
+    if pattern[index:index + 1] == ']': index += 1
+    while index < len(pattern) and pattern[index] != ']':
+        index += 2 if pattern[index] == '\\' else 1
+
+    return index + 1 if index < len(pattern) else -1
+
+
+def _skip_group(pattern: str, index: int) -> int:
+    """Return the index after the group starting at index.
+
+    Return -1 if the group doesn't end.
+    """
+    depth = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if char == '\\':
+            index += 2
+            continue
+        if char == '[':
+            index = _skip_class(pattern, index)
+            if index < 0: return -1
+            continue
+        if char == '(': depth += 1
+        if char == ')':
+            depth -= 1
+            if not depth: return index + 1
+        index += 1
+
+    return -1
+
+
+def _skip_quantifier(pattern: str, index: int) -> tuple:
+    """Return if the quantifier at index allows zero repeats and its end."""
+    char = pattern[index:index + 1]
+    if char in ('?', '*'):
+        optional, index = True, index + 1
+    elif char == '+':
+        optional, index = False, index + 1
+    elif char == '{' and re.match(r'\{\d*(,\d*)?\}', pattern[index:]):
+        end = pattern.index('}', index)
+        optional = pattern[index + 1:end].split(',')[0] in ('', '0')
+        index = end + 1
+    else:
+        return False, index
+
+    # Skip the lazy or possessive mark.
+    if pattern[index:index + 1] in ('?', '+'): index += 1
+
+    return optional, index
+
+
+def _skip_escape(pattern: str, index: int) -> tuple:
+    """Return the character the escape at index matches and its end.
+
+    The character is '' if the escape is a class, an anchor or a
+    backreference.
+    """
+    escaped = pattern[index + 1:index + 2]
+    index += 2
+    width = {'x': 2, 'u': 4, 'U': 8}.get(escaped)
+    if width:
+        code = pattern[index:index + width]
+        return chr(int(code, 16)), index + width
+    if escaped == 'N':
+        # Named characters aren't looked up.
+        return '', pattern.find('}', index) + 1 or len(pattern)
+    if escaped.isdigit():
+        match = re.match(r'0[0-7]{0,2}|[0-7]{3}', pattern[index - 1:])
+        if match:
+            return chr(int(match.group(), 8)), index - 1 + match.end()
+        # A backreference has at most two digits.
+        if pattern[index:index + 1].isdigit(): index += 1
+        return '', index
+    # Escaped letters are classes or anchors.
+    if escaped and not (escaped.isalnum() or escaped == '_'):
+        return escaped, index
+
+    return '', index
+
+
+def required_literals(pattern: str) -> list:
+    """Return the literal strings every match of pattern contains.
+
+    Return an empty list if none can be found, for example when pattern
+    has an alternative at the top level or sets flags.
+    """
+    runs = []
+    run = ''
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        literal = ''
+        if char == '\\':
+            literal, index = _skip_escape(pattern, index)
+        elif char == '|':
+            return []
+        elif char == '[':
+            index = _skip_class(pattern, index)
+            if index < 0: return []
+        elif char == '(':
+            if (pattern[index + 1:index + 2] == '?' and
+                    pattern[index + 2:index + 3] in _FLAGS):
+                return []
+            index = _skip_group(pattern, index)
+            if index < 0: return []
+        elif char in '.^$*+?{}':
+            index += 1
+        else:
+            literal = char
+            index += 1
+
+        optional, end = _skip_quantifier(pattern, index)
+        if literal and not optional: run += literal
+        # A repeated or optional literal ends the run, so does anything
+        # that isn't a literal.
+        if not literal or end != index:
+            if run: runs.append(run)
+            run = ''
+        index = end
+
+    if run: runs.append(run)
+
+    return runs
+
+
+def active_filters(filters: dict) -> dict:
+    """Return the regexes of the active filters in the profile dict."""
+    return {
+        name: regex for name, (regex, active) in filters.items() if active
+    }
+
+
+def _split_alternatives(pattern: str) -> list:
+    """Split pattern at the alternatives at its top level."""
+    parts = []
+    start = index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if char == '\\':
+            index += 2
+            continue
+        if char in '[(':
+            skip = _skip_class if char == '[' else _skip_group
+            index = skip(pattern, index)
+            if index < 0: raise ValueError(f'Unterminated {char}')
+            continue
+        if char == '|':
+            parts.append(pattern[start:index])
+            start = index + 1
+        index += 1
+
+    parts.append(pattern[start:])
+
+    return parts
+
+
+def _class_filter(pattern: str) -> str:
+    """Return the inside of a character class in the url-filter syntax."""
+    result = ''
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        index += 1
+        if char != '\\':
+            result += char
+            continue
+
+        escaped = pattern[index:index + 1]
+        index += 1
+        if escaped in _CLASSES:
+            result += _CLASSES[escaped]
+        elif not escaped or escaped.isalnum() or escaped == '_':
+            raise ValueError(f'Unsupported escape: \\{escaped}')
+        elif escaped in '\\]-^':
+            result += char + escaped
+        else:
+            result += escaped
+
+    return result
+
+
+def _repeat(atoms: list, pattern: str, index: int) -> tuple:
+    """Apply the quantifier at index in pattern to the alternatives atoms.
+
+    Return the repeated alternatives and the index after the quantifier.
+    """
+    _, end = _skip_quantifier(pattern, index)
+    if end == index: return atoms, index
+
+    # Lazy and possessive repeats match the same uris as greedy ones, so
+    # their mark is dropped.
+    quantifier = pattern[index]
+    if quantifier in '*+?':
+        if len(atoms) == 1 and atoms[0] not in (_START, _END, ''):
+            return [atoms[0] + quantifier], end
+        if quantifier == '?': return atoms + [''], end
+        raise ValueError('Unsupported repeat of alternatives')
+
+    counts = pattern[index + 1:pattern.index('}', index)].split(',')
+    low = int(counts[0] or 0)
+    high = low if len(counts) == 1 else int(counts[1]) if counts[1] else None
+    if len(atoms) != 1 or max(low, high or 0) > MAX_EXPANSION:
+        raise ValueError(f'Unsupported repeat: {pattern[index:end]}')
+
+    atom = atoms[0]
+    if high is None: return [atom * low + atom + '*'], end
+
+    return [atom * low + (atom + '?') * (high - low)], end
+
+
+def _sequence_filters(pattern: str) -> list:
+    """Return the url-filters of pattern without alternatives at the top."""
+    filters = ['']
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if char == '\\':
+            escaped = pattern[index + 1:index + 2]
+            index += 2
+            if escaped in _CLASSES:
+                atoms = [f'[{_CLASSES[escaped]}]']
+            elif not escaped or escaped.isalnum() or escaped == '_':
+                raise ValueError(f'Unsupported escape: \\{escaped}')
+            elif escaped in '.*+?^$[](){}|\\':
+                atoms = [char + escaped]
+            else:
+                atoms = [escaped]
+        elif char == '[':
+            end = _skip_class(pattern, index)
+            if end < 0: raise ValueError('Unterminated [')
+            atoms = [f'[{_class_filter(pattern[index + 1:end - 1])}]']
+            index = end
+        elif char == '(':
+            end = _skip_group(pattern, index)
+            if end < 0: raise ValueError('Unterminated (')
+            inner = pattern[index + 1:end - 1]
+            if inner.startswith('?:'):
+                inner = inner[2:]
+            elif inner.startswith('?'):
+                raise ValueError(f'Unsupported group: ({inner})')
+            atoms = _filters(inner)
+            # Keep the group around a single alternative, so a quantifier
+            # repeats all of it.
+            if len(atoms) == 1 and len(atoms[0]) > 1:
+                atoms = [f'({atoms[0]})']
+            index = end
+        elif char in '*+?{}':
+            raise ValueError(f'Nothing to repeat at {index}')
+        else:
+            atoms = [{'^': _START, '$': _END}.get(char, char)]
+            index += 1
+
+        atoms, index = _repeat(atoms, pattern, index)
+        filters = [url_filter + atom for url_filter in filters
+                   for atom in atoms]
+        if len(filters) > MAX_EXPANSION:
+            raise ValueError('Too many alternatives')
+
+    return filters
+
+
+def _filters(pattern: str) -> list:
+    """Return the url-filters of pattern with the anchors left in."""
+    filters = []
+    for alternative in _split_alternatives(pattern):
+        filters.extend(_sequence_filters(alternative))
+        if len(filters) > MAX_EXPANSION:
+            raise ValueError('Too many alternatives')
+
+    return filters
+
+
+def url_filters(regex: str) -> list:
+    """Return WebKit url-filters that together match the uris regex does.
+
+    The url-filter syntax has no alternatives, so they are expanded into
+    one url-filter each.  Raise ValueError if regex uses something it
+    can't express, like lookarounds, backreferences or flags.
+    """
+    filters = []
+    for url_filter in _filters(regex):
+        if _START in url_filter[1:] or _END in url_filter[:-1]:
+            raise ValueError('Anchor in the middle of a url-filter')
+        url_filter = url_filter.replace(_START, '^').replace(_END, '$')
+        if not url_filter or not url_filter.isascii():
+            raise ValueError(f'Unsupported url-filter: {url_filter!r}')
+        filters.append(url_filter)
+
+    return list(dict.fromkeys(filters))
+
+
+def content_rules(filters: dict) -> tuple:
+    """Return WebKit content blocker rules that block what filters do.
+
+    filters maps names to regexes.  Also return the names of the regexes
+    that can't be rules, those are only checked by AdBlockMatcher.
+    """
+    rules = []
+    skipped = []
+    for name, regex in sorted(filters.items()):
+        try:
+            re.compile(regex)
+            url_filter_list = url_filters(regex)
+        except (re.error, ValueError) as err:
+            logging.info(f'Adblock regex {name} is not a content rule: {err}')
+            skipped.append(name)
+            continue
+
+        rules.extend(
+            {
+                'trigger': {
+                    'url-filter': url_filter,
+                    'url-filter-is-case-sensitive': True,
+                },
+                'action': {'type': 'block'},
+            } for url_filter in url_filter_list
+        )
+
+    return rules, skipped
+
+
+def content_filter_id(filters: dict) -> str:
+    """Return the id of the content filter made from the regexes filters.
+
+    The id has the hash of the regexes in it, so a saved content filter is
+    reused until they change.  Return '' if there are no regexes.
+    """
+    if not filters: return ''
+
+    rule_set = json.dumps([CONTENT_RULES_VERSION, sorted(filters.items())])
+    digest = hashlib.sha256(rule_set.encode()).hexdigest()
+
+    return CONTENT_FILTER_PREFIX + digest[:32]
+
+
+class AdBlockMatcher(object):
+    """Find which adblock regex matches a uri.
+
+    filters maps the name of each regex to the regex.  The results for the
+    last cache_size uris are kept.
+    """
+
+    def __init__(self, filters: dict = {}, cache_size: int = 4096):
+        """Compile and index filters."""
+        # Map each name to the compiled regex and the literal it needs.
+        self._rules = {}
+
+        # Map each substring to the names of the rules with it in their
+        # literal, and each rule to the substring it is indexed by.
+        self._index = {}
+        self._grams = {}
+
+        # Rules with a literal shorter than GRAM_SIZE, and rules without a
+        # literal that are always tried.
+        self._short = {}
+        self._always = set()
+
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+
+        # How many uris were found in the cache, and how many regexes were
+        # searched.
+        self.stats = {'lookups': 0, 'cache-hits': 0, 'searches': 0}
+
+        for name, regex in filters.items(): self.add(name, regex)
+
+    def __len__(self) -> int:
+        """Return the number of rules."""
+        return len(self._rules)
+
+    def add(self, name: str, regex: str) -> bool:
+        """Add or replace the rule name.
+
+        Return False if regex doesn't compile.
+        """
+        self.remove(name)
+
+        try:
+            compiled = re.compile(regex)
+        except re.error as err:
+            logging.error(f'Bad adblock regex {name}: {regex} {err}')
+            return False
+
+        literal = max(required_literals(regex), key=len, default='')
+        self._rules[name] = (compiled, literal)
+
+        if not literal:
+            self._always.add(name)
+        elif len(literal) < GRAM_SIZE:
+            self._short[name] = literal
+        else:
+            # Index the rule by its least used substring.
+            gram = min(
+                (literal[i:i + GRAM_SIZE]
+                 for i in range(len(literal) - GRAM_SIZE + 1)),
+                key=lambda gram: (len(self._index.get(gram, ())), gram)
+            )
+            self._index.setdefault(gram, set()).add(name)
+            self._grams[name] = gram
+
+        self._cache.clear()
+
+        return True
+
+    def remove(self, name: str):
+        """Remove the rule name if there is one."""
+        if self._rules.pop(name, None) is None: return
+
+        self._short.pop(name, None)
+        self._always.discard(name)
+        gram = self._grams.pop(name, None)
+        if gram:
+            names = self._index[gram]
+            names.discard(name)
+            if not names: del self._index[gram]
+
+        self._cache.clear()
+
+    def match(self, uri: str) -> str:
+        """Return the name of a rule that matches uri, or '' if none do."""
+        if not uri: return ''
+
+        self.stats['lookups'] += 1
+        result = self._cache.get(uri)
+        if result is not None:
+            self.stats['cache-hits'] += 1
+            self._cache.move_to_end(uri)
+            return result
+
+        result = self._match(uri)
+        self._cache[uri] = result
+        if len(self._cache) > self._cache_size: self._cache.popitem(False)
+
+        return result
+
+    def _match(self, uri: str) -> str:
+        """Search uri with the regexes of the rules that could match it."""
+        candidates = set(self._always)
+        for name, literal in self._short.items():
+            if literal in uri: candidates.add(name)
+
+        if self._index:
+            grams = {
+                uri[i:i + GRAM_SIZE]
+                for i in range(len(uri) - GRAM_SIZE + 1)
+            }
+            for gram in grams & self._index.keys():
+                candidates.update(self._index[gram])
+
+        for name in candidates:
+            regex, literal = self._rules[name]
+            if literal not in uri: continue
+            self.stats['searches'] += 1
+            if regex.search(uri): return name
+
+        return ''
+
+    def summary(self) -> str:
+        """Return the number of rules and how well the cache worked."""
+        return (f'ADBLOCK: {len(self._rules)} rules, {len(self._always)} '
+                f'always searched, {self.stats}')
+
+
+if __name__ == '__main__':
+    # Compare searching every regex, like the plug process used to, with
+    # the matcher.  Give a file with a uri per line to use a recorded
+    # corpus, and a file with a regex per line for the rules.
+    import sys
+    import time
+    import random
+
+    random.seed(0)
+
+    if len(sys.argv) > 2:
+        with open(sys.argv[2]) as rules_file:
+            filters = {
+                f'rule {number}': line.strip()
+                for number, line in enumerate(rules_file) if line.strip()
+            }
+    else:
+        filters = {
+            '/ads/': r'\/ads\/',
+            'doubleclick': r'doubleclick\.net',
+            'pubads': r'pubads\.',
+        }
+        for number in range(250):
+            filters[f'host {number}'] = rf'(^|\.)adhost{number}\.(com|net)\/'
+            filters[f'path {number}'] = rf'\/banner{number}[_-]\d+x\d+\.'
+        filters['tracker'] = r'[?&]utm_[a-z]+='
+        # Escapes that stand for more than the character after the slash.
+        filters['hex escape'] = r'ad\x2dserver'
+        filters['octal escape'] = r'a\101bcd'
+
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as uri_file:
+            uri_list = [line.strip() for line in uri_file if line.strip()]
+    else:
+        hosts = [f'www.site{number}.org' for number in range(200)]
+        hosts += [f'cdn.adhost{number}.com' for number in range(0, 500, 5)]
+        uri_list = []
+        for _ in range(10000):
+            host = random.choice(hosts)
+            path = '/'.join(random.choice(('img', 'js', 'ads', 'page',
+                                           f'banner{random.randint(0, 400)}_'
+                                           '300x250.png', 'static'))
+                            for _ in range(random.randint(1, 4)))
+            query = random.choice(('', '?id=42', '?utm_source=feed'))
+            uri_list.append(f'https://{host}/{path}{query}')
+        uri_list += ['https://ad-server.example.com/', 'https://a.org/aAbcd',
+                     'https://adx2dserver.org/', 'https://a.org/a101bcd']
+        # Pages load the same resources again and again.
+        uri_list += random.choices(uri_list, k=10000)
+
+    def search_all(uri: str) -> str:
+        """Return the name of the first regex that matches uri."""
+        for name, regex in filters.items():
+            if re.search(regex, uri): return name
+        return ''
+
+    print(f'{len(filters)} rules, {len(uri_list)} uris')
+
+    start = time.perf_counter()
+    matcher = AdBlockMatcher(filters)
+    print(f'build: {(time.perf_counter() - start) * 1000:8.1f} ms')
+
+    results = {}
+    for name, match in (('re.search', search_all), ('matcher', matcher.match)):
+        start = time.perf_counter()
+        results[name] = [bool(match(uri)) for uri in uri_list]
+        elapsed = time.perf_counter() - start
+        print(f'{name:>9}: {elapsed / len(uri_list) * 1e6:8.1f} us/uri, '
+              f'{sum(results[name])} blocked')
+
+    assert results['re.search'] == results['matcher']
+    print(matcher.summary())
+
+    # The url-filter syntax is a subset of Python's, so check the content
+    # rules block the same uris.
+    start = time.perf_counter()
+    rules, skipped = content_rules(filters)
+    elapsed = time.perf_counter() - start
+    print(f'content rules: {len(rules)} from {len(filters) - len(skipped)} '
+          f'regexes in {elapsed * 1000:.1f} ms, {len(skipped)} skipped, '
+          f'{len(json.dumps(rules))} bytes of JSON')
+
+    url_filter_list = [re.compile(rule['trigger']['url-filter'])
+                       for rule in rules]
+    skipped_matcher = AdBlockMatcher({name: filters[name] for name in skipped})
+    for uri, blocked in zip(uri_list[:2000], results['matcher']):
+        assert blocked == (any(url_filter.search(uri)
+                               for url_filter in url_filter_list) or
+                           bool(skipped_matcher.match(uri)))
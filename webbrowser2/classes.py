@@ -25,8 +25,17 @@
 
 from .bookmarks import EntryDialog
 from .functions import save_dialog
+from .session_file import dumps as sessions_dumps
+from .session_file import loads as sessions_loads
+from .wire import encode, decode, encode_tab, decode_tab
 from json import dumps as json_dumps
 from json import loads as json_loads
+from collections import deque
+import os
+import mmap
+import time
+import select
+import struct
 import socket
 import logging
 import shutil
@@ -35,6 +44,10 @@ from gi import require_version as gi_require_version
 gi_require_version('Gtk', '3.0')
 from gi.repository import Gtk, GObject, GLib, Gio, WebKit2, Gdk, Pango
 
+# Seconds a process that is exiting waits to send what its transport has
+# queued.
+FLUSH_TIMEOUT = 1
+
 
 class ChildDict(dict):
     """A dictionary that has a send command."""
@@ -65,6 +78,549 @@ class ChildDict(dict):
         self.__setitem__(item.replace('_', '-', item.count('_')), data)
 
 
+def _write_blob(message: bytes) -> int:
+    """Return a memfd holding message."""
+    fd = os.memfd_create('webbrowser2-message', os.MFD_CLOEXEC)
+    try:
+        view = memoryview(message)
+        while view: view = view[os.write(fd, view):]
+    except OSError:
+        os.close(fd)
+        raise
+
+    return fd
+
+
+class Transport(object):
+    """Send and recieve messages over a Connection without blocking.
+
+    Messages are framed the same way Connection.send_bytes frames them.
+    Sent messages are queued and written whenever the pipe can take them,
+    and every time the pipe is readable all the messages in it are passed
+    to handler(signal, data).  If handler returns False nothing more is
+    read.
+
+    If the Connection is a unix socket, messages bigger than
+    blob_threshold are written to a memfd instead, and only the length is
+    framed in the pipe with the fd passed alongside it.  The reciever maps
+    the memfd and decodes the message from there.
+    """
+
+    _decode = staticmethod(decode)
+
+    def __init__(self, connection: object, handler: object,
+                 on_eof: object = None, on_drained: object = None,
+                 high_water: int = 1 << 20, blob_threshold: int = 1 << 16):
+        """Start watching connection.
+
+        on_eof is called when the other end closes, and on_drained when
+        the queued data goes back under high_water bytes.
+        """
+        self.connection = connection
+        self._fd = connection.fileno()
+        os.set_blocking(self._fd, False)
+
+        # The socket used to pass the fds of big messages.
+        self._socket = None
+        if hasattr(os, 'memfd_create'):
+            try:
+                self._socket = socket.socket(fileno=os.dup(self._fd))
+            except OSError:
+                pass
+            else:
+                if self._socket.family != socket.AF_UNIX:
+                    self._socket.detach()
+                    self._socket = None
+
+        self._handler = handler
+        self._on_eof = on_eof
+        self._on_drained = on_drained
+        self._high_water = high_water
+        self._blob_threshold = blob_threshold
+
+        self._in_buffer = bytearray()
+        self._in_fds = deque()
+        self._out_buffer = bytearray()
+        # The memfds waiting to be sent as a list of the offset of their
+        # frame in the queue, the fd, and the size of the message in it.
+        self._out_fds = deque()
+        self._out_blob_size = 0
+        self._out_id = 0
+        self._in_id = GLib.io_add_watch(self._fd,
+                                        GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR,
+                                        self._readable)
+        self.closed = False
+        self.eof = False
+
+    @property
+    def congested(self) -> bool:
+        """Return True if more than high_water bytes are waiting to be sent."""
+        return len(self._out_buffer) + self._out_blob_size > self._high_water
+
+    def send(self, signal: str, data: object) -> bool:
+        """Queue signal and data to be sent.
+
+        Return False if the queue is congested, so the caller can hold back
+        until on_drained is called.
+        """
+        return self._queue(encode(signal, data))
+
+    def _queue(self, message: bytes) -> bool:
+        """Queue message framed with its length, and try to send it."""
+        if self.closed: raise BrokenPipeError('Transport is closed')
+
+        if self._socket and len(message) > self._blob_threshold:
+            self._out_fds.append(
+                [len(self._out_buffer), _write_blob(message), len(message)]
+            )
+            self._out_blob_size += len(message)
+            self._out_buffer += struct.pack('!iQ', -2, len(message))
+        elif len(message) > 0x7fffffff:
+            self._out_buffer += struct.pack('!iQ', -1, len(message))
+            self._out_buffer += message
+        else:
+            self._out_buffer += struct.pack('!i', len(message))
+            self._out_buffer += message
+
+        if not self._out_id: self._write()
+
+        return not self.congested
+
+    def _send_some(self) -> int:
+        """Write from the start of the queue once, and return how much.
+
+        The fd of a big message is sent with the first byte of its frame.
+        """
+        if not self._out_fds: return os.write(self._fd, self._out_buffer)
+
+        offset, fd, size = self._out_fds[0]
+        if offset:
+            written = os.write(self._fd, self._out_buffer[:offset])
+        else:
+            end = (self._out_fds[1][0] if len(self._out_fds) > 1
+                   else len(self._out_buffer))
+            written = socket.send_fds(self._socket,
+                                      [self._out_buffer[:end]], [fd])
+            self._out_fds.popleft()
+            self._out_blob_size -= size
+            os.close(fd)
+
+        for out_fd in self._out_fds: out_fd[0] -= written
+
+        return written
+
+    def _write(self) -> bool:
+        """Write as much of the queue as the pipe takes.
+
+        Return True if there is still data waiting.
+        """
+        was_congested = self.congested
+        while self._out_buffer:
+            try:
+                written = self._send_some()
+            except BlockingIOError:
+                break
+            del self._out_buffer[:written]
+
+        if self._out_buffer and not self._out_id:
+            self._out_id = GLib.io_add_watch(self._fd, GLib.IO_OUT,
+                                             self._writable)
+        if (was_congested and not self.congested and self._on_drained and
+                not self.closed):
+            self._on_drained()
+
+        return bool(self._out_buffer)
+
+    def _writable(self, source: int, cb_condition: int) -> bool:
+        """Write the queue when the pipe can take more."""
+        try:
+            if self._write(): return True
+        except OSError as err:
+            logging.error(f'Transport write failed: {err}')
+            self._clear_out()
+
+        self._out_id = 0
+        if self.closed: self._close_pipe()
+
+        return False
+
+    def _clear_out(self):
+        """Drop everything waiting to be sent."""
+        self._out_buffer.clear()
+        while self._out_fds: os.close(self._out_fds.popleft()[1])
+        self._out_blob_size = 0
+
+    def _recv(self) -> bytes:
+        """Read once from the pipe, keeping any fds sent with the data."""
+        if not self._socket: return os.read(self._fd, 1 << 16)
+
+        data, fds, _, _ = socket.recv_fds(self._socket, 1 << 16, 4)
+        self._in_fds.extend(fds)
+
+        return data
+
+    def _read(self) -> bool:
+        """Read everything available, return False at end of file."""
+        while True:
+            try:
+                data = self._recv()
+            except BlockingIOError:
+                return True
+            except ConnectionResetError:
+                return False
+            if not data: return False
+            self._in_buffer += data
+
+    def _read_blob(self, size: int) -> tuple:
+        """Return the decoded message in the next memfd recieved."""
+        fd = self._in_fds.popleft()
+        try:
+            blob = mmap.mmap(fd, size, prot=mmap.PROT_READ)
+        finally:
+            os.close(fd)
+
+        # The map is closed when the last view of it is released.
+        return self._decode(blob)
+
+    def _messages(self):
+        """Yield the complete messages that have been read."""
+        buffer = self._in_buffer
+        offset = 0
+        try:
+            while len(buffer) - offset >= 4:
+                size, = struct.unpack_from('!i', buffer, offset)
+                if size == -2:
+                    # The message is in the memfd sent with this frame.
+                    if len(buffer) - offset < 12 or not self._in_fds: break
+                    size, = struct.unpack_from('!Q', buffer, offset + 4)
+                    offset += 12
+                    yield self._read_blob(size)
+                else:
+                    header = 4
+                    if size == -1:
+                        if len(buffer) - offset < 12: break
+                        size, = struct.unpack_from('!Q', buffer, offset + 4)
+                        header = 12
+                    end = offset + header + size
+                    if len(buffer) < end: break
+                    message = bytes(buffer[offset + header:end])
+                    offset = end
+                    yield self._decode(message)
+                # Stop if the handler closed the transport.
+                if self.closed: return
+        finally:
+            del buffer[:offset]
+
+    def read_messages(self) -> list:
+        """Return all the messages that can be read now."""
+        self._read()
+
+        return list(self._messages())
+
+    def dispatch(self) -> bool:
+        """Pass every message that can be read now to the handler.
+
+        Return False at end of file, or when the handler returned False or
+        closed the transport.
+        """
+        is_open = self._read()
+
+        for message in self._messages():
+            try:
+                keep_reading = self._handler(*message)
+            except Exception as err:
+                logging.exception(f'Handling {message[:-1]}: {err}')
+                keep_reading = True
+            if self.closed or keep_reading is False: return False
+
+        if is_open: return True
+
+        if self._on_eof and not self.eof: self._on_eof()
+        self.eof = True
+
+        return False
+
+    def _readable(self, source: int, cb_condition: int) -> bool:
+        """Pass every message recieved to the handler."""
+        if self.dispatch(): return True
+
+        self._in_id = 0
+
+        return False
+
+    def flush(self, timeout: float):
+        """Send what is queued, waiting up to timeout seconds.
+
+        This blocks, so only a process that is about to exit uses it.
+        """
+        deadline = time.monotonic() + timeout
+        while self._out_buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: break
+            select.select([], [self._fd], [], remaining)
+            try:
+                del self._out_buffer[:self._send_some()]
+            except BlockingIOError:
+                continue
+            except OSError:
+                break
+
+    def close(self):
+        """Stop reading, and close the pipe once what is queued is sent.
+
+        The queue is sent from the write watch, and dropped if the pipe
+        fails.
+        """
+        if self.closed: return
+        self.closed = True
+
+        if self._in_id: GLib.Source.remove(self._in_id)
+        self._in_id = 0
+
+        try:
+            if self._out_buffer and self._write(): return
+        except OSError as err:
+            logging.error(f'Transport write failed: {err}')
+
+        self._close_pipe()
+
+    def _close_pipe(self):
+        """Drop what is left and close the pipe."""
+        if self._out_id: GLib.Source.remove(self._out_id)
+        self._out_id = 0
+
+        self._clear_out()
+        while self._in_fds: os.close(self._in_fds.popleft())
+        if self._socket: self._socket.close()
+
+        self.connection.close()
+
+
+class Channel(Transport):
+    """A Transport shared by all the tabs of a process.
+
+    Every message carries the id of the tab it is for, and is passed to the
+    handler added for that id.  A handler that returns False is removed.
+    The main window uses the socket id of a tab as its id, and tabs made by
+    the tab process use negative ids, so both ends can pick new ids.
+    """
+
+    _decode = staticmethod(decode_tab)
+
+    def __init__(self, connection: object, on_eof: object = None,
+                 on_drained: object = None, high_water: int = 1 << 20):
+        """Start watching connection."""
+        self.tabs = {}
+        super().__init__(connection, self._route, on_eof=on_eof,
+                         on_drained=on_drained, high_water=high_water)
+
+    def add_tab(self, tab_id: int, handler: object):
+        """Pass the messages for tab_id to handler(signal, data)."""
+        self.tabs[tab_id] = handler
+
+    def remove_tab(self, tab_id: int) -> bool:
+        """Stop passing the messages for tab_id on.
+
+        Return True if there are no tabs left.
+        """
+        self.tabs.pop(tab_id, None)
+
+        return not self.tabs
+
+    def send(self, tab_id: int, signal: str, data: object) -> bool:
+        """Queue signal and data to be sent to the tab tab_id."""
+        return self._queue(encode_tab(tab_id, signal, data))
+
+    def _route(self, tab_id: int, signal: str, data: object) -> bool:
+        """Pass signal and data to the handler of tab_id."""
+        handler = self.tabs.get(tab_id)
+        if not handler:
+            logging.info(f'No tab {tab_id} for {signal}')
+            return True
+
+        if handler(signal, data) is False and self.tabs.get(tab_id) is handler:
+            self.tabs.pop(tab_id)
+
+        return True
+
+
+class SignalDispatcher(object):
+    """Call the handler of each signal with a single lookup.
+
+    handlers maps a signal to a function that takes the arguments given to
+    dispatch, and fallback is called with the signal first for signals
+    without a handler.  Signals in quiet are only logged at the debug
+    level.  The calls and time spent handling each signal are counted.
+    """
+
+    def __init__(self, name: str, handlers: dict, fallback: object,
+                 quiet: frozenset = frozenset()):
+        """Dispatch signals to handlers, logging them with name."""
+        self._name = name
+        self._handlers = handlers
+        self._fallback = fallback
+        self._quiet = quiet
+
+        # Map each signal to a list of its call count and total seconds.
+        self.stats = {}
+
+    def dispatch(self, signal: str, *args) -> object:
+        """Call the handler of signal with args and return its result."""
+        level = logging.DEBUG if signal in self._quiet else logging.INFO
+        if logging.root.isEnabledFor(level):
+            logging.log(level, f'{self._name}: {signal} => {args[-1]}')
+
+        handler = self._handlers.get(signal)
+        start = time.perf_counter()
+        try:
+            if handler: return handler(*args)
+            return self._fallback(signal, *args)
+        finally:
+            stats = self.stats.get(signal)
+            if not stats: stats = self.stats[signal] = [0, 0.0]
+            stats[0] += 1
+            stats[1] += time.perf_counter() - start
+
+    def summary(self) -> str:
+        """Return the counts and times of the signals, slowest first."""
+        lines = [f'{self._name} SIGNAL STATS:']
+        for signal, (calls, total) in sorted(self.stats.items(),
+                                             key=lambda item: -item[1][1]):
+            lines.append(f'{signal:>24}: {calls:8} calls '
+                         f'{total * 1000:10.1f} ms '
+                         f'{total / calls * 1e6:8.1f} us/call')
+
+        return '\n'.join(lines)
+
+
+class History(object):
+    """The back/forward history of a tab, changed by small operations.
+
+    entries has a (uri, title, original-uri) tuple for every history item,
+    oldest first, and current is the index of the current item.  The tab
+    process uses update to find the operations that turn the history it
+    last sent into the new one, and the main window applies them to its
+    copy.
+    """
+
+    def __init__(self):
+        """Start with an empty history."""
+        self.entries = []
+        self.current = -1
+
+        # The first operations clear the other copy, because it may hold
+        # the history from a previous process.
+        self._synced = False
+
+    def apply(self, ops: list):
+        """Change the history by each operation in ops."""
+        entries = self.entries
+        for op, *args in ops:
+            if op == 'shift':
+                # Items were dropped from the start to stay under the limit.
+                del entries[:args[0]]
+            elif op == 'truncate':
+                del entries[args[0]:]
+            elif op == 'push':
+                entries.extend(args[0])
+            elif op == 'title':
+                index, title = args
+                uri, _, original_uri = entries[index]
+                entries[index] = (uri, title, original_uri)
+            elif op == 'current':
+                self.current = args[0]
+
+    def update(self, entries: list, current: int) -> list:
+        """Change the history to entries and current.
+
+        Return the operations that did it.
+        """
+        old = self.entries
+        ops = [] if self._synced else [('truncate', 0)]
+        self._synced = True
+
+        # Items are the same if their uri and original uri are, titles are
+        # updated separately.
+        shift = 0
+        if old and entries and old[0][::2] != entries[0][::2]:
+            shift = next((index for index, entry in enumerate(old)
+                          if entry[::2] == entries[0][::2]), len(old))
+            ops.append(('shift', shift))
+
+        length = min(len(old) - shift, len(entries))
+        prefix = 0
+        while (prefix < length and
+               old[shift + prefix][::2] == entries[prefix][::2]):
+            prefix += 1
+
+        if prefix < len(old) - shift: ops.append(('truncate', prefix))
+        for index in range(prefix):
+            if old[shift + index][1] != entries[index][1]:
+                ops.append(('title', index, entries[index][1]))
+        if prefix < len(entries): ops.append(('push', entries[prefix:]))
+        if current != self.current: ops.append(('current', current))
+
+        self.apply(ops)
+
+        return ops
+
+    def _item_dicts(self, entries: list) -> list:
+        """Return a dict for each of entries, last first."""
+        return [
+            {'uri': uri, 'title': title, 'original-uri': original_uri}
+            for uri, title, original_uri in reversed(entries)
+        ]
+
+    def back_list(self) -> list:
+        """Return the items before the current one, nearest first."""
+        return self._item_dicts(self.entries[:max(self.current, 0)])
+
+    def forward_list(self) -> list:
+        """Return the items after the current one, farthest first."""
+        return self._item_dicts(self.entries[self.current + 1:])
+
+
+class RestartTracker(object):
+    """Track the crashes of a tab to back off restarting it.
+
+    Each crash within window seconds of the first doubles the time to
+    wait before restarting, and after max_crashes of them the tab should
+    not be restarted until the user asks for it.
+    """
+
+    def __init__(self, max_crashes: int = 5, window: float = 60,
+                 delay: float = 1, max_delay: float = 30):
+        """Initialize."""
+        self._max_crashes = max_crashes
+        self._window = window
+        self._delay = delay
+        self._max_delay = max_delay
+        self._crash_times = []
+
+    def crashed(self) -> float:
+        """Record a crash and return how many seconds to wait to restart.
+
+        Return None if the tab crashed too often to restart it.
+        """
+        now = time.monotonic()
+        self._crash_times = [
+            crash_time for crash_time in self._crash_times
+            if now - crash_time < self._window
+        ]
+        self._crash_times.append(now)
+
+        count = len(self._crash_times)
+        if count >= self._max_crashes:
+            logging.warning(f'{count} crashes in {self._window} seconds')
+            return None
+
+        return min(self._delay * 2 ** (count - 1), self._max_delay)
+
+    def reset(self):
+        """Forget all the crashes."""
+        self._crash_times.clear()
+
+
 class Profile(dict):
     """A Profile configuration dictionary.
 
@@ -192,6 +748,14 @@ class Profile(dict):
                 self[key] = False
             elif key == 'home-uri':
                 self[key] = 'https://www.startpage.com'
+            elif key == 'hibernate-after':
+                self[key] = 30
+            elif key == 'max-tab-processes':
+                self[key] = 0
+            elif key == 'process-placement':
+                self[key] = 'new'
+            elif key == 'process-memory-limit':
+                self[key] = 0
             return super(Profile, self).__getitem__(key)
 
     def __getattr__(self, item: str) -> object:
@@ -732,7 +1296,11 @@ class SessionManager(Gtk.Grid):
             return []
 
         with pathlib.Path(session_file) as sessions_file:
-            sessions = json_loads(sessions_file.read_text())
+            try:
+                sessions = sessions_loads(sessions_file.read_bytes())
+            except ValueError as err:
+                logging.error(f'Could not read {sessions_file}: {err}')
+                sessions = []
             sessions_file.unlink()
 
         # Only return non-empty sessions.
@@ -751,7 +1319,7 @@ class SessionManager(Gtk.Grid):
         if sessions:
             logging.info('Saving Sessions...')
             with pathlib.Path(filename) as sessions_file:
-                sessions_file.write_text(json_dumps(sessions, indent=4))
+                sessions_file.write_bytes(sessions_dumps(sessions))
             logging.info('Saved Sessions.')
 
     @property
@@ -1051,6 +1619,28 @@ class SettingsManager(Gtk.Grid):
                                self._profile.enable_user_stylesheet,
                               'Use User Stylesheet',
                               'Apply the user-stylesheet.css to every webpage.')
+        self.add_int_setting('hibernate-after', self._profile.hibernate_after,
+                             'Hibernate Tabs After (minutes)',
+                             ('Close the process of a background tab after '
+                              'this many minutes, 0 to never.'))
+        self.add_int_setting('max-tab-processes',
+                             self._profile.max_tab_processes,
+                             'Maximum Tab Processes',
+                             ('Open new tabs in existing processes once '
+                              'there are this many, 0 for no limit.'))
+        self.add_str_setting('process-placement',
+                             self._profile.process_placement,
+                             'Tab Process Placement',
+                             ('new: a new process for every tab, site: '
+                              'share a process with tabs from the same '
+                              'site, opener: share the process of the tab '
+                              'that opened it.'))
+        self.add_int_setting('process-memory-limit',
+                             self._profile.process_memory_limit,
+                             'Process Memory Limit (MiB)',
+                             ('Move tabs out of a process that uses more '
+                              'than this much memory, 0 for no limit.'),
+                             maximum=65536)
         self.add_settings(self._profile.web_view_settings)
 
     def add_settings(self, settings: dict):
@@ -1149,7 +1739,7 @@ class SettingsManager(Gtk.Grid):
                                            Gtk.PositionType.BOTTOM, 1, 1)
 
     def add_int_setting(self, setting: str, value: int, title: str = '',
-                        tooltip: str = ''):
+                        tooltip: str = '', maximum: int = 100):
         """ Show the user agent setting.
 
         """
@@ -1159,7 +1749,7 @@ class SettingsManager(Gtk.Grid):
         if not tooltip:
             tooltip = title
 
-        adjustment = Gtk.Adjustment(value, 0, 100, 1, 0, 0)
+        adjustment = Gtk.Adjustment(value, 0, maximum, 1, 0, 0)
         spin_button = Gtk.SpinButton.new(adjustment, 1, 0)
         spin_button.set_tooltip_text(tooltip)
         spin_button.set_margin_start(3)
@@ -1204,6 +1794,9 @@ class SettingsManager(Gtk.Grid):
         value = get_value()
         if setting == 'home-uri':
             self._profile.home_uri = value
+        elif setting in ('hibernate-after', 'max-tab-processes',
+                         'process-placement', 'process-memory-limit'):
+            self._profile[setting] = value
         else:
             self._profile.web_view_settings[setting] = value
         self.emit('setting-changed', setting, value)
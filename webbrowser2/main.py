@@ -21,9 +21,20 @@
 
 """Main browser process."""
 
+import gc
+import os
+import time
 import logging
+from collections import deque
+from signal import SIGKILL, SIGTERM, pidfd_send_signal
 from multiprocessing import Pipe, Process, active_children
-from multiprocessing.connection import Connection
+from multiprocessing.connection import Connection, wait
+from webbrowser2.proc_stats import update_stats
+
+# Seconds a process gets to exit by itself before it is terminated.  It
+# has to be longer than the FLUSH_TIMEOUT in classes.py a closing tab
+# process can spend sending its last messages.
+TERMINATE_GRACE = 3
 
 
 def run_browser(data: Connection):
@@ -33,6 +44,303 @@ def run_browser(data: Connection):
     browser.run()
 
 
+def run_pooled_browser(pool_pipe: Connection):
+    """Run an idle browser plug process from the warm pool.
+
+    Initialize everything a BrowserProc needs, then wait on pool_pipe for
+    the init dict of a new tab.  When the last tab of the browser closes
+    tell the main process so this process can be reused.
+    """
+    from webbrowser2.plug_process import BrowserProc, init_process
+    init_process()
+
+    while True:
+        try:
+            signal, data = pool_pipe.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+
+        if signal != 'new-proc': break
+
+        browser = BrowserProc(data)
+        browser.run()
+
+        # Drop all the per-tab state before offering this process again.
+        del browser
+        gc.collect()
+
+        try:
+            pool_pipe.send(('recycled', True))
+        except BrokenPipeError:
+            break
+
+    pool_pipe.close()
+
+
+def run_zygote(zygote_pipe: Connection, profile: str = 'default'):
+    """Run a zygote process that forks browser plug processes.
+
+    Import and load everything a BrowserProc needs once, then fork a child
+    for each 'new-proc' request so all the children share those pages
+    copy-on-write.  Report the pid of each child and its exitcode when it
+    exits.
+    """
+    # Keep gtk from connecting to the display before forking, each child
+    # has to open its own connection.
+    display_env = {
+        name: os.environ.pop(name) for name in ('DISPLAY', 'WAYLAND_DISPLAY')
+        if name in os.environ
+    }
+    from gi.repository import Gtk
+    from webbrowser2.functions import get_config_path
+    from webbrowser2.plug_process import BrowserProc, init_process
+    from webbrowser2.plug_process import preload_process
+    os.environ.update(display_env)
+
+    preload_process(get_config_path(profile))
+
+    # Keep the garbage collector from touching, and so copying, all the
+    # shared objects in every child.
+    gc.collect()
+    gc.freeze()
+
+    # Map a pidfd to the pid of each child.
+    children = {}
+
+    while True:
+        try:
+            ready_list = wait([zygote_pipe, *children])
+        except KeyboardInterrupt:
+            break
+
+        for pidfd in ready_list:
+            if pidfd is zygote_pipe: continue
+            pid = children.pop(pidfd)
+            os.close(pidfd)
+            _, status = os.waitpid(pid, 0)
+            zygote_pipe.send(
+                ('proc-exited', (pid, os.waitstatus_to_exitcode(status)))
+            )
+
+        if zygote_pipe not in ready_list: continue
+
+        try:
+            signal, data = zygote_pipe.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+
+        if signal != 'new-proc': break
+
+        pid = os.fork()
+        if pid == 0:
+            exitcode = 0
+            try:
+                zygote_pipe.close()
+                for pidfd in children: os.close(pidfd)
+                # The shared objects stay frozen so collections in the
+                # child never write to their pages.  New objects are still
+                # collected.
+                Gtk.init_check()
+                init_process()
+                BrowserProc(data).run()
+            except BaseException as err:
+                logging.error(f'ZYGOTE CHILD {os.getpid()} FAILED: {err}')
+                exitcode = 1
+            finally:
+                os._exit(exitcode)
+
+        # Only the child uses the tab pipe.
+        data['com-pipe'].close()
+
+        children[os.pidfd_open(pid)] = pid
+        zygote_pipe.send(('proc-pid', pid))
+
+    for pidfd in children: os.close(pidfd)
+    zygote_pipe.close()
+
+
+class ZygoteProc(object):
+    """A browser process forked by the zygote.
+
+    It acts enough like a multiprocessing.Process that the main loop can
+    treat both the same.
+    """
+
+    def __init__(self, pid: int):
+        """Watch the process pid using a pidfd."""
+        self.pid = pid
+        self.exitcode = None
+
+        try:
+            self.sentinel = os.pidfd_open(pid)
+        except ProcessLookupError:
+            # The zygote already reaped it.
+            self.sentinel = None
+            self.exitcode = -1
+
+    def __repr__(self) -> str:
+        """Return a description of the process."""
+        return f'<ZygoteProc pid={self.pid} exitcode={self.exitcode}>'
+
+    def is_alive(self) -> bool:
+        """Return True if the process hasn't exited."""
+        if self.sentinel is None: return False
+        return not wait([self.sentinel], 0)
+
+    def join(self, timeout: float = None):
+        """Wait for the process to exit, at most timeout seconds."""
+        if self.sentinel is not None: wait([self.sentinel], timeout)
+
+    def _send_signal(self, signum: int):
+        """Send signum to the process through its pidfd.
+
+        The pidfd keeps the signal from going to another process that got
+        the pid after this one was reaped.
+        """
+        if self.sentinel is None: return
+        try:
+            pidfd_send_signal(self.sentinel, signum)
+        except ProcessLookupError:
+            pass
+
+    def terminate(self):
+        """Send SIGTERM to the process."""
+        self._send_signal(SIGTERM)
+
+    def kill(self):
+        """Send SIGKILL to the process."""
+        self._send_signal(SIGKILL)
+
+    def close(self):
+        """Close the pidfd."""
+        if self.sentinel is not None: os.close(self.sentinel)
+        self.sentinel = None
+
+
+def start_zygote(profile: str) -> dict:
+    """Start the zygote process and return a dict with it and its pipe."""
+    zygote_pipe, proc_pipe = Pipe()
+    proc = Process(target=run_zygote, args=(proc_pipe, profile))
+    proc.start()
+    proc_pipe.close()
+    logging.info(f'ZYGOTE STARTED: {proc.pid}')
+
+    return {'proc': proc, 'pipe': zygote_pipe}
+
+
+def read_zygote_pipe(zygote: dict, window_dict: dict,
+                     main_cpipe: Connection) -> tuple:
+    """Handle a message from the zygote and return it."""
+    signal, data = zygote['pipe'].recv()
+    if signal == 'proc-exited':
+        pid, exitcode = data
+        proc = window_dict.get(pid, None)
+        if proc:
+            proc.exitcode = exitcode
+            proc_exited(window_dict, pid, main_cpipe)
+
+    return signal, data
+
+
+def zygote_new_proc(zygote: dict, window_dict: dict, data: dict,
+                    main_cpipe: Connection) -> ZygoteProc:
+    """Have the zygote fork a browser process for data and return it."""
+    zygote['pipe'].send(('new-proc', data))
+
+    signal, pid = read_zygote_pipe(zygote, window_dict, main_cpipe)
+    while signal != 'proc-pid':
+        signal, pid = read_zygote_pipe(zygote, window_dict, main_cpipe)
+
+    return ZygoteProc(pid)
+
+
+def start_pooled_proc(pool: dict) -> Process:
+    """Start a new idle browser process and add it to the pool."""
+    pool_pipe, proc_pipe = Pipe()
+    proc = Process(target=run_pooled_browser, args=(proc_pipe,))
+    proc.start()
+    proc_pipe.close()
+
+    pool['pipes'][proc.pid] = (proc, pool_pipe)
+    pool['idle'].append(proc.pid)
+    logging.info(f'POOL STARTED: {proc.pid}')
+
+    return proc
+
+
+def fill_pool(pool: dict):
+    """Start idle browser processes until the pool is full."""
+    while len(pool['idle']) < pool['size']:
+        start_pooled_proc(pool)
+
+
+def take_pooled_proc(pool: dict, data: dict) -> Process:
+    """Hand data to an idle process from the pool and return it.
+
+    Return None if there are no usable idle processes.
+    """
+    while pool['idle']:
+        proc, pool_pipe = pool['pipes'][pool['idle'].popleft()]
+        try:
+            pool_pipe.send(('new-proc', data))
+        except (BrokenPipeError, OSError) as err:
+            logging.error(f'POOL PROCESS {proc.pid} BROKEN: {err}')
+            drop_pooled_proc(pool, proc.pid)
+            continue
+        return proc
+
+    return None
+
+
+def drop_pooled_proc(pool: dict, pid: int):
+    """Remove the process with pid from the pool."""
+    proc, pool_pipe = pool['pipes'].pop(pid, (None, None))
+    if pid in pool['idle']: pool['idle'].remove(pid)
+    if pool_pipe: pool_pipe.close()
+
+
+def recycle_pooled_proc(pool: dict, pid: int) -> bool:
+    """Put a process whose last tab closed back in the pool.
+
+    If the pool is already full tell the process to quit instead.  Return
+    True if the process was put back in the pool.
+    """
+    proc, pool_pipe = pool['pipes'][pid]
+    if len(pool['idle']) < pool['size']:
+        logging.info(f'POOL RECYCLED: {pid}')
+        pool['idle'].append(pid)
+        return True
+
+    logging.info(f'POOL FULL RETIRING: {pid}')
+    try:
+        pool_pipe.send(('quit', True))
+    except (BrokenPipeError, OSError):
+        pass
+    drop_pooled_proc(pool, pid)
+
+    return False
+
+
+def read_pool_pipe(pool: dict, pid: int) -> bool:
+    """Handle a message from the pooled process with pid.
+
+    Return True if the process was put back in the pool.  Processes that
+    broke their pipe or were retired are only dropped from the pool, and
+    their sentinel reports the exit.
+    """
+    proc, pool_pipe = pool['pipes'][pid]
+    try:
+        signal, data = pool_pipe.recv()
+    except (EOFError, OSError):
+        drop_pooled_proc(pool, pid)
+        return False
+
+    if signal == 'recycled':
+        return recycle_pooled_proc(pool, pid)
+
+    return False
+
+
 def run_main(com_pipe: Connection, **kwargs):
     """Run a main window process."""
     from webbrowser2.socket_process import MainWindow
@@ -40,42 +348,169 @@ def run_main(com_pipe: Connection, **kwargs):
     main_window.run()
 
 
-def terminate_proc(proc: Process) -> bool:
-    """Terminate and close a process."""
-    if not proc:
-        return True
-    # If the process has exited do not join it.
-    if not proc.is_alive():
-        return True
+def proc_exited(window_dict: dict, pid: int, main_cpipe: Connection):
+    """Forget the exited process pid and tell the main window."""
+    proc = window_dict.pop(pid)
+    if isinstance(proc, Process): proc.join()
+    exitcode = proc.exitcode
+    proc.close()
 
-    pid = proc.pid
+    logging.info(f'PROCESS EXITED: {pid} {exitcode=}')
+    try:
+        main_cpipe.send(('proc-exited', {'pid': pid, 'exitcode': exitcode}))
+    except (BrokenPipeError, OSError) as err:
+        logging.error(f'Main window is gone: {err}')
 
-    logging.info(f"Joining: {proc}")
-    proc.join(1)
-    while proc.is_alive():
-        logging.info(f"Terminating: {proc}")
-        proc.terminate()
-    proc.close()
-    logging.info(f'PID {pid} Closed')
+
+def terminate_procs(proc_list: list, grace: float = TERMINATE_GRACE,
+                    timeout: float = TERMINATE_GRACE + 2) -> bool:
+    """Terminate and close all the processes in proc_list at once.
+
+    Give the processes grace seconds to exit by themselves, then terminate
+    the ones still running, and kill any that are left after timeout
+    seconds.  Log how long each process took to exit.
+    """
+    start = time.monotonic()
+    running = {
+        proc.sentinel: proc for proc in proc_list
+        if proc and proc.sentinel is not None
+    }
+
+    for deadline, stop in ((start + grace, 'terminate'),
+                           (start + timeout, 'kill')):
+        while running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: break
+            for sentinel in wait(list(running), remaining):
+                proc = running.pop(sentinel)
+                proc.join()
+                logging.info(f'PID {proc.pid} exited after '
+                             f'{time.monotonic() - start:.3f}s: {proc}')
+
+        for proc in running.values():
+            logging.info(f'{stop.title()}: {proc}')
+            getattr(proc, stop)()
+
+    for proc in running.values():
+        proc.join()
+        logging.warning(f'PID {proc.pid} killed after '
+                        f'{time.monotonic() - start:.3f}s: {proc}')
+
+    for proc in proc_list:
+        if proc: proc.close()
+
+    logging.info(f'All processes closed in {time.monotonic() - start:.3f}s')
 
     return True
 
 
-def main(main_proc: Process, main_cpipe: Connection) -> bool:
+def main(main_proc: Process, main_cpipe: Connection, pool_size: int = 0,
+         launch_mode: str = 'pool', profile: str = 'default') -> bool:
     """Listen on main_cpipe for signals.
 
     Depending on what signal is recieved it will start new child processes.
+    In 'pool' launch_mode keep pool_size idle browser processes ready to
+    take new tabs, in 'zygote' launch_mode fork them from a zygote process.
+    Tell the main window when a child process exits.
     """
     window_dict = {}
+    zygote = {}
+
+    # The recent resource usage samples of each process.
+    stats_history = {}
+
+    # Map the pid of each process being terminated to the time to stop
+    # waiting for it, and how many times it was already signaled.
+    terminating = {}
+
+    if launch_mode == 'zygote':
+        if hasattr(os, 'pidfd_open'):
+            zygote = start_zygote(profile)
+            pool_size = 0
+        else:
+            logging.error('pidfd_open is not available, not using a zygote')
+
+    pool = {'size': pool_size, 'idle': deque(), 'pipes': {}}
+
+    fill_pool(pool)
 
     while main_proc.is_alive():
+        # Only the pipes of processes that are showing tabs can report
+        # that they are ready to be recycled.
+        busy_pipes = {
+            pool_pipe: pid for pid, (_, pool_pipe) in pool['pipes'].items()
+            if pid not in pool['idle']
+        }
+        zygote_pipes = [zygote['pipe']] if zygote else []
+        # The zygote reports when its children exit.
+        sentinels = {
+            proc.sentinel: pid for pid, proc in window_dict.items()
+            if isinstance(proc, Process)
+        }
+
+        for pid in tuple(terminating):
+            if pid not in window_dict: terminating.pop(pid)
+        timeout = None
+        if terminating:
+            deadline = min(deadline for deadline, _ in terminating.values())
+            timeout = max(0, deadline - time.monotonic())
+
         try:
-            signal, data = main_cpipe.recv()
+            ready_list = wait(
+                [main_cpipe, main_proc.sentinel, *busy_pipes, *zygote_pipes,
+                 *sentinels],
+                timeout
+            )
         except KeyboardInterrupt:
             break
 
+        for ready in ready_list:
+            if ready in (main_cpipe, main_proc.sentinel): continue
+            if ready in zygote_pipes:
+                read_zygote_pipe(zygote, window_dict, main_cpipe)
+            elif ready in sentinels:
+                pid = sentinels[ready]
+                if pid not in window_dict: continue
+                drop_pooled_proc(pool, pid)
+                proc_exited(window_dict, pid, main_cpipe)
+            elif ready in busy_pipes:
+                pid = busy_pipes[ready]
+                if pid not in pool['pipes']: continue
+                if read_pool_pipe(pool, pid): window_dict.pop(pid, None)
+
+        now = time.monotonic()
+        for pid, (deadline, count) in tuple(terminating.items()):
+            if pid not in window_dict or deadline > now: continue
+            # The process had time to exit by itself, so terminate it and
+            # if that doesn't work kill it.
+            drop_pooled_proc(pool, pid)
+            proc = window_dict[pid]
+            logging.info(f"Terminating: {proc}")
+            if count:
+                proc.kill()
+            else:
+                proc.terminate()
+            terminating[pid] = (now + 1, count + 1)
+
+        if main_cpipe not in ready_list: continue
+
+        try:
+            message = main_cpipe.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+
+        # Requests that expect a reply carry a request id, which is sent
+        # back with the reply so the main window can match them up.
+        signal, data = message[:2]
+        request_id = message[2] if len(message) > 2 else None
+
         if signal == 'quit':
             break
+        if signal == 'stats':
+            # Sample the resource usage of every browser process and its
+            # WebKit child processes.
+            stats = update_stats(stats_history, list(window_dict))
+            main_cpipe.send(('reply', (request_id, stats)))
         if signal == 'refresh':
             # Make sure all children exit.
             logging.info(
@@ -85,31 +520,51 @@ def main(main_proc: Process, main_cpipe: Connection) -> bool:
                     f'PROCESS: {pid} {proc.exitcode=} {proc.is_alive()=}'
                 )
         if signal == 'new-proc':
-            proc = Process(target=run_browser, args=(data,))
-            proc.start()
-            main_cpipe.send(('proc-pid', proc.pid))
+            if zygote:
+                proc = zygote_new_proc(zygote, window_dict, data, main_cpipe)
+            else:
+                proc = take_pooled_proc(pool, data)
+            if not proc:
+                proc = Process(target=run_browser, args=(data,))
+                proc.start()
+            main_cpipe.send(('reply', (request_id, proc.pid)))
+            # Replace the used process in the background.
+            fill_pool(pool)
             logging.info(f"MAIN_LOOP NEW_PROC: {data}")
             window_dict[proc.pid] = proc
             logging.info(f"child pid: {proc.pid}")
             logging.info(f'window_dict: {window_dict}')
-        elif signal == 'is-alive':
-            proc = window_dict.get(data, None)
-            if proc:
-                proc.join(1)
-                main_cpipe.send(('is-alive', proc.is_alive()))
-                if not proc.is_alive():
-                    window_dict.pop(data, None)
-            else:
-                main_cpipe.send(('is-alive', False))
         elif signal == 'terminate':
-            terminate_proc(window_dict.pop(data, None))
+            # Give the process time to exit, or finish closing its last
+            # tab so it can be reused, before terminating it.
+            if data in window_dict and data not in terminating:
+                logging.info(f"Joining: {window_dict[data]}")
+                terminating[data] = (time.monotonic() + TERMINATE_GRACE, 0)
 
     logging.info("Quitting")
 
     logging.info(window_dict)
 
-    for proc in window_dict.values():
-        terminate_proc(proc)
+    for pid in tuple(pool['pipes']):
+        proc, pool_pipe = pool['pipes'][pid]
+        window_dict[pid] = proc
+        try:
+            pool_pipe.send(('quit', True))
+        except (BrokenPipeError, OSError):
+            pass
+        drop_pooled_proc(pool, pid)
+
+    proc_list = list(window_dict.values())
+
+    if zygote:
+        try:
+            zygote['pipe'].send(('quit', True))
+        except (BrokenPipeError, OSError):
+            pass
+        zygote['pipe'].close()
+        proc_list.append(zygote['proc'])
+
+    terminate_procs(proc_list)
 
     # Make sure all children exit.
     logging.info(
@@ -125,6 +580,12 @@ if __name__ == '__main__':
                         help='The profile to use', dest='profile')
     parser.add_argument('-v', '--verbose', action='store', default=1, type=int,
                         help='How verbose to be', dest='verbosity')
+    parser.add_argument('-n', '--pool-size', action='store', default=2,
+                        type=int, dest='pool_size',
+                        help='How many idle tab processes to keep ready')
+    parser.add_argument('-m', '--launch-mode', action='store', default='pool',
+                        choices=('pool', 'zygote'), dest='launch_mode',
+                        help='How to start new tab processes')
     parser.add_argument('uri', nargs='*', default=['about:blank'])
     args, leftovers = parser.parse_known_args()
 
@@ -149,7 +610,8 @@ if __name__ == '__main__':
     main_p.start()
     logging.info(f"main pid: {main_p.pid}")
 
-    main(main_p, main_cpipe)
+    main(main_p, main_cpipe, pool_size=args.pool_size,
+         launch_mode=args.launch_mode, profile=args.profile)
 
     # from socket_process import MainWindow
     # main = MainWindow(main_ppipe, main_dict, profile=args.profile,
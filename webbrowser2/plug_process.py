@@ -23,21 +23,241 @@
 
 from .functions import looks_like_uri
 import re
+import time
+import itertools
 import tempfile
 import subprocess
 import logging
-import codecs
 import urllib.parse
 import pathlib
-from multiprocessing import Pipe, Process
+from multiprocessing import Process
 from multiprocessing import current_process
+from html import escape as html_escape
 from gi import require_version as gi_require_version
 gi_require_version('Gtk', '3.0')
 gi_require_version('WebKit2', '4.0')
 gi_require_version('GLib', '2.0')
 from gi.repository import WebKit2, Gtk, Gdk, GLib, Pango, Gio
 
-from .classes import ChildDict
+from .classes import ChildDict, RestartTracker, Channel, SignalDispatcher
+from .classes import History, FLUSH_TIMEOUT
+from .adblock import AdBlockMatcher, active_filters
+from .abp import filter_ids
+from .whitelist import WhitelistIndex
+
+
+# Each BrowserProc run in the same process needs its own application id.
+_app_count = itertools.count()
+
+_css_provider = None
+_css_loaded = False
+
+# Parsed user scripts by filename, with the mtime they were read at.
+_user_scripts = {}
+
+# Signals that only report the current state of a webview, so only the
+# latest value needs to be sent.
+STATE_SIGNALS = frozenset((
+    'hover-link', 'mouse-motion', 'estimated-load-progress', 'is-loading',
+    'is-playing-audio', 'title',
+))
+
+# Signals from the main window that are only logged at the debug level.
+QUIET_SIGNALS = frozenset(('restore-session',))
+
+# How often to send the queued state signals in milliseconds.
+FLUSH_INTERVAL = 16
+
+# The least time between sending the history of a view in milliseconds.
+BACK_FORWARD_INTERVAL = 100
+
+
+def preload_process(profile_path: object = None):
+    """Load the data every BrowserProc needs that doesn't need a display.
+
+    A zygote process calls this once, before it forks, so the children
+    share it.
+    """
+    global _css_provider
+    if not _css_provider:
+        _css_provider = Gtk.CssProvider.get_default()
+        _css_provider.load_from_data(
+            b'''.status {
+                    padding: 5px;
+                    font-size: 10px;
+                    background: rgba(0,0,0,100);
+                    border-radius: 0px 2px 0px 0px;
+                }'''
+        )
+
+    if profile_path: read_user_scripts(profile_path)
+
+
+def init_process():
+    """Do the setup shared by every BrowserProc in this process.
+
+    This only has to be done once, so a process can do it before it has a
+    tab to show.
+    """
+    global _css_loaded
+    if _css_loaded: return
+
+    preload_process()
+
+    Gtk.StyleContext.add_provider_for_screen(
+        Gdk.Screen.get_default(), _css_provider,
+        Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION
+    )
+
+    _css_loaded = True
+
+
+def read_user_scripts(profile_path: object) -> list:
+    """Return a list of the user.js scripts in profile_path.
+
+    Each item is a tuple of the arguments to WebKit2.UserScript.new.
+    Scripts are only parsed again if their file changed.
+    """
+    times_dict = {
+        'document-start': WebKit2.UserScriptInjectionTime.START,
+        'document-end': WebKit2.UserScriptInjectionTime.END,
+    }
+    script_list = []
+    for filename in pathlib.Path(profile_path).iterdir():
+        if filename.match('*.user.js'):
+            mtime = filename.stat().st_mtime
+            cached_mtime, script_tup = _user_scripts.get(filename, (0, ()))
+            if cached_mtime == mtime:
+                script_list.append(script_tup)
+                continue
+
+            prepend_script = []
+            script_text = filename.read_text()
+            whitelist = []
+            blacklist = []
+            injection_time = times_dict['document-start']
+            injection_frames = WebKit2.UserContentInjectedFrames.ALL_FRAMES
+            for line in script_text.splitlines():
+                line_value = line.split()[-1]
+                if '/UserScript' in line: break
+                if '@include' in line: whitelist.append(line_value)
+                if '@match' in line: whitelist.append(line_value)
+                if '@exclude' in line: blacklist.append(line_value)
+                if '@run-at' in line:
+                    injection_time = times_dict.get(
+                        line_value,
+                        times_dict['document-start']
+                    )
+                if '@noframes' in line:
+                    injection_frames = WebKit2.UserContentInjectedFrames.TOP_FRAME
+                else:
+                    injection_frames = WebKit2.UserContentInjectedFrames.ALL_FRAMES
+                if '@require' in line:
+                    tmp_file = Gio.File.new_for_uri(line_value)
+                    result, content, _ = tmp_file.load_contents(None)
+                    if not result: continue
+                    prepend_script.append(content.decode())
+
+            logging.info(
+                f'SCRIPT INFO: {whitelist=} {blacklist=} '
+                f'{injection_time=} {injection_frames=}'
+            )
+            prepend_script.append(script_text)
+            script_text = '\n'.join(prepend_script)
+            script_tup = (
+                script_text,
+                injection_time,
+                injection_frames,
+                whitelist,
+                blacklist
+            )
+            _user_scripts[filename] = (mtime, script_tup)
+            script_list.append(script_tup)
+
+    return script_list
+
+
+class IdleScheduler(object):
+    """Run named tasks for each view when the main loop is idle.
+
+    A task that is already waiting for a view is not queued again, so all
+    the requests made before it runs are merged into one run.  Each task
+    has a priority, and a minimum interval in milliseconds between runs
+    for the same view.
+    """
+
+    def __init__(self):
+        """Start with no tasks."""
+        # Map the name of each task to its function, priority and interval.
+        self._tasks = {}
+
+        # Map the name and view of each waiting task to its source id, and
+        # of each task that ran to when it ran.
+        self._pending = {}
+        self._last_run = {}
+
+        # Map the name of each task to how many times it was asked for, how
+        # many of those were merged into a waiting run, and how many times
+        # it ran.
+        self.stats = {}
+
+    def add_task(self, name: str, func: object,
+                 priority: int = GLib.PRIORITY_DEFAULT_IDLE,
+                 interval: int = 0):
+        """Add the task name, which calls func(view_dict)."""
+        self._tasks[name] = (func, priority, interval)
+        self.stats[name] = [0, 0, 0]
+
+    def schedule(self, name: str, view_dict: dict):
+        """Run the task name for view_dict unless it is already waiting."""
+        stats = self.stats[name]
+        stats[0] += 1
+
+        key = (name, id(view_dict))
+        if key in self._pending:
+            stats[1] += 1
+            return
+
+        _, priority, interval = self._tasks[name]
+        last_run = self._last_run.get(key)
+        delay = 0
+        if last_run is not None:
+            delay = interval - (time.monotonic() - last_run) * 1000
+
+        if delay > 0:
+            self._pending[key] = GLib.timeout_add(
+                int(delay), self._run, name, view_dict, priority=priority)
+        else:
+            self._pending[key] = GLib.idle_add(self._run, name, view_dict,
+                                               priority=priority)
+
+    def _run(self, name: str, view_dict: dict) -> bool:
+        """Run the task name for view_dict."""
+        key = (name, id(view_dict))
+        self._pending.pop(key, None)
+        self._last_run[key] = time.monotonic()
+        self.stats[name][2] += 1
+
+        self._tasks[name][0](view_dict)
+
+        return False
+
+    def cancel(self, view_dict: dict):
+        """Remove all the waiting tasks of view_dict."""
+        for name in self._tasks:
+            key = (name, id(view_dict))
+            self._last_run.pop(key, None)
+            source_id = self._pending.pop(key, None)
+            if source_id: GLib.Source.remove(source_id)
+
+    def summary(self) -> str:
+        """Return how many requests of each task were merged."""
+        lines = ['IDLE TASK STATS:']
+        for name, (requests, merged, runs) in self.stats.items():
+            lines.append(f'{name:>24}: {requests:8} requests {merged:8} '
+                         f'merged {runs:8} runs')
+
+        return '\n'.join(lines)
 
 
 class BrowserProc(Gtk.Application):
@@ -49,26 +269,15 @@ class BrowserProc(Gtk.Application):
 
         # Initialize the gtk application.
         super().__init__(
-            application_id=f'org.webbrowser2.pid{self._pid}',
+            application_id=f'org.webbrowser2.pid{self._pid}.'
+                           f'app{next(_app_count)}',
             flags=0
         )
 
         profile_name = pathlib.Path(com_dict['profile-path']).name
         GLib.set_prgname(f'org.webbrowser2.{profile_name}')
 
-        css_provider = Gtk.CssProvider.get_default()
-        css_provider.load_from_data(
-            b'''.status {
-                    padding: 5px;
-                    font-size: 10px;
-                    background: rgba(0,0,0,100);
-                    border-radius: 0px 2px 0px 0px;
-                }'''
-        )
-        Gtk.StyleContext.add_provider_for_screen(
-            Gdk.Screen.get_default(), css_provider,
-            Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION
-        )
+        init_process()
 
         self._tmp_files = []
 
@@ -79,11 +288,12 @@ class BrowserProc(Gtk.Application):
         self._search_url = com_dict.pop('search-url', self._fallback_search)
         self._web_view_settings['user-agent'] = com_dict.get('user-agent', '')
 
-        self._adblock_filters = {}
-        adblock_filters = com_dict.get('adblock-filters', {})
-        for name, (regex, active) in adblock_filters.items():
-            if active:
-                self._adblock_filters[name] = regex  # re.compile(regex)
+        self._adblock = AdBlockMatcher(
+            active_filters(com_dict.get('adblock-filters', {})))
+
+        # The content filter the main window compiled from the adblock
+        # regexes.
+        self._adblock_filter_id = com_dict.get('adblock-filter-id', '')
 
         self._media_filters = {}
         media_filters = com_dict.get('media-filters', {})
@@ -92,8 +302,8 @@ class BrowserProc(Gtk.Application):
                 self._media_filters[name] = re.compile(regex)
 
         self._content_filters = com_dict.get('content-filters', {})
-        self._content_filter_whitelist = com_dict.get(
-            'content-filter-whitelist', {})
+        self._content_filter_whitelist = WhitelistIndex(active_filters(
+            com_dict.get('content-filter-whitelist', {})))
 
         self._enable_user_stylesheet = com_dict.get('enable-user-stylesheet',
                                                     False)
@@ -108,9 +318,40 @@ class BrowserProc(Gtk.Application):
 
         self._cancellable = Gio.Cancellable.new()
 
+        # The content filters are loaded once for the process.  The ids to
+        # use, the loaded filters by id, and the ids being loaded.
+        self._filter_store = WebKit2.UserContentFilterStore.new(
+            self._filter_path)
+        self._wanted_filters = set()
+        self._loaded_filters = {}
+        self._loading_filters = set()
+
+        # The filter ids installed in each user content manager, and if the
+        # page in it is whitelisted.
+        self._filter_states = {}
+
+        self._update_content_filters()
+
+        self._dispatcher = self._make_dispatcher()
+
+        self._idle = IdleScheduler()
+        self._idle.add_task('back-forward', self._send_back_forward,
+                            interval=BACK_FORWARD_INTERVAL)
+
         socket_id, com_pipe = com_dict['socket-id'], com_dict['com-pipe']
         logging.info(f"CREATING: {socket_id} {com_pipe}")
-        view_dict = self._create_window(socket_id, com_pipe)
+
+        # All the tabs of this process share one channel to the main
+        # window.  The tabs it asks for use their socket id as tab id, and
+        # the ones made here get negative ids.
+        self._channel = Channel(
+            com_pipe,
+            on_eof=lambda: logging.error('IN PLUG _recieve: EOF'),
+            on_drained=self._flush_all
+        )
+        self._tab_ids = itertools.count(-1, -1)
+
+        view_dict = self._create_window(socket_id, socket_id)
         view_dict.load(com_dict.get('uri', 'about:blank'))
         self._windows.append(view_dict)
 
@@ -157,7 +398,7 @@ class BrowserProc(Gtk.Application):
         self._toggle_user_stylesheet(webview, self._enable_user_stylesheet)
 
         # Apply content filters to the new webview
-        self._apply_content_filters(webview)
+        self._sync_content_filters(webview)
 
         self._load_user_scripts(webview)
 
@@ -165,62 +406,8 @@ class BrowserProc(Gtk.Application):
 
     def _load_user_scripts(self, webview: object):
         """Load and add all user.js scripts in the profile directory."""
-        times_dict = {
-            'document-start': WebKit2.UserScriptInjectionTime.START,
-            'document-end': WebKit2.UserScriptInjectionTime.END,
-        }
-        for filename in self._profile_path.iterdir():
-            if filename.match('*.user.js'):
-                prepend_script = []
-                script_text = filename.read_text()
-                whitelist = []
-                blacklist = []
-                injection_time = times_dict['document-start']
-                injection_frames = WebKit2.UserContentInjectedFrames.ALL_FRAMES
-                for line in script_text.splitlines():
-                    line_value = line.split()[-1]
-                    if '/UserScript' in line: break
-                    if '@include' in line: whitelist.append(line_value)
-                    if '@match' in line: whitelist.append(line_value)
-                    if '@exclude' in line: blacklist.append(line_value)
-                    if '@run-at' in line:
-                        injection_time = times_dict.get(
-                            line_value,
-                            times_dict['document-start']
-                        )
-                    if '@noframes' in line:
-                        injection_frames = WebKit2.UserContentInjectedFrames.TOP_FRAME
-                    else:
-                        injection_frames = WebKit2.UserContentInjectedFrames.ALL_FRAMES
-                    if '@require' in line:
-                        tmp_file = Gio.File.new_for_uri(line_value)
-                        result, content, _ = tmp_file.load_contents(
-                            self._cancellable)
-                        if not result: continue
-                        prepend_script.append(content.decode())
-                        # webview.run_javascript(content.decode(),
-                        #                        self._cancellable,
-                        #                        self._run_js_callback, None)
-                        # self._add_user_script(webview, (content.decode(),
-                        #                                 times_dict['document-start'],
-                        #                                 WebKit2.UserContentInjectedFrames.ALL_FRAMES,
-                        #                                 whitelist, blacklist))
-
-                logging.info(
-                    f'SCRIPT INFO: {whitelist=} {blacklist=} '
-                    f'{injection_time=} {injection_frames=}'
-                )
-                prepend_script.append(script_text)
-                script_text = '\n'.join(prepend_script)
-                self._add_user_script(
-                    webview, (
-                        script_text,
-                        injection_time,
-                        injection_frames,
-                        whitelist,
-                        blacklist
-                    )
-                )
+        for script_tup in read_user_scripts(self._profile_path):
+            self._add_user_script(webview, script_tup)
 
     def _run_js_callback(self, webview: object, result: object,
                          user_data: object):
@@ -259,49 +446,96 @@ class BrowserProc(Gtk.Application):
         except TypeError as err:
             logging.error(err)
 
-    def _apply_content_filters(self, webview: object):
-        """Apply all content filters in self._content_filters to webview."""
-        if not self._content_filters: return
-
-        user_content_manager = webview.get_user_content_manager()
-
-        content_filter_store = WebKit2.UserContentFilterStore.new(
-            self._filter_path)
-
-        content_filter_store.fetch_identifiers(None,
-                                               self._filter_fetch_callback,
-                                               user_content_manager)
+    def _update_content_filters(self):
+        """Find the content filters to use and load the new ones."""
+        self._filter_store.fetch_identifiers(self._cancellable,
+                                             self._filter_fetch_callback,
+                                             None)
 
     def _filter_fetch_callback(self, content_filter_store: object,
-                               result: object, user_content_manager: object):
+                               result: object, user_data: object):
         """Content filter fetch callback.
 
-        Finishes fetching the content filter and adds it to the content
-        manager.
+        Finishes fetching the ids of the saved content filters, and loads
+        the active ones that aren't loaded yet.
         """
         id_list = content_filter_store.fetch_identifiers_finish(result)
 
+        wanted = set()
         for filter_id, (uri, active) in self._content_filters.items():
             logging.info(f"PLUG: {filter_id=}, {uri=}, {active=}")
-            if not active:
-                user_content_manager.remove_filter_by_id(filter_id)
-                continue
-            if filter_id in id_list:
-                content_filter_store.load(filter_id, None,
-                                          self._filter_load_callback,
-                                          user_content_manager)
+            # Filters compiled from Adblock Plus lists are in chunks.
+            if active: wanted.update(filter_ids(filter_id, id_list))
+        if self._adblock_filter_id in id_list:
+            wanted.add(self._adblock_filter_id)
+        self._wanted_filters = wanted
+
+        for filter_id in self._loaded_filters.keys() - wanted:
+            del self._loaded_filters[filter_id]
+
+        for filter_id in wanted - self._loaded_filters.keys():
+            if filter_id in self._loading_filters: continue
+            self._loading_filters.add(filter_id)
+            content_filter_store.load(filter_id, self._cancellable,
+                                      self._filter_load_callback, filter_id)
+
+        self._sync_all_content_filters()
 
     def _filter_load_callback(self, content_filter_store: object,
-                              result: object, user_content_manager: object):
+                              result: object, filter_id: str):
         """Content filter load callback.
 
-        Finishes loading the content filter and adds it to the content manager.
+        Finishes loading the content filter and adds it to the content
+        managers.
         """
-        content_filter = content_filter_store.load_finish(result)
-        if content_filter:
-            user_content_manager.add_filter(content_filter)
-
-    def _create_window(self, socket_id: int, com_pipe: object,
+        self._loading_filters.discard(filter_id)
+        try:
+            content_filter = content_filter_store.load_finish(result)
+        except GLib.Error as err:
+            logging.error(f'PLUG: Filter {filter_id} not loaded: {err}')
+            return
+
+        if content_filter and filter_id in self._wanted_filters:
+            self._loaded_filters[filter_id] = content_filter
+            self._sync_all_content_filters()
+
+    def _sync_all_content_filters(self):
+        """Install the content filters each window should have."""
+        for window in self._windows:
+            self._sync_content_filters(window.webview)
+
+    def _sync_content_filters(self, webview: object, whitelisted: bool = None):
+        """Install the content filters webview should have.
+
+        whitelisted is if the page in webview is whitelisted, None keeps
+        what it was.  Filters are only added or removed when that or the
+        filters to use change.
+        """
+        content_manager = webview.get_user_content_manager()
+        state = self._filter_states.get(content_manager)
+        if state is None:
+            # Start from nothing, related webviews share a content manager.
+            content_manager.remove_all_filters()
+            state = {'installed': set(), 'whitelisted': False}
+            self._filter_states[content_manager] = state
+
+        if whitelisted is not None: state['whitelisted'] = whitelisted
+
+        installed = state['installed']
+        wanted = set()
+        if not state['whitelisted']:
+            wanted = self._loaded_filters.keys() & self._wanted_filters
+        if wanted == installed: return
+
+        for filter_id in installed - wanted:
+            content_manager.remove_filter_by_id(filter_id)
+        for filter_id in wanted - installed:
+            content_manager.add_filter(self._loaded_filters[filter_id])
+        state['installed'] = wanted
+
+        logging.debug(f'PLUG: Content filters: {sorted(wanted)}')
+
+    def _create_window(self, socket_id: int, tab_id: int,
                        webview: object = None):
         """Create a window with a webview in it."""
         webview = self._new_webview(webview)
@@ -330,9 +564,10 @@ class BrowserProc(Gtk.Application):
         view_dict = ChildDict()
         view_dict.update(
             {
-                'send': lambda signal, data: self._send(signal, data,
-                                                        com_pipe),
-                'recv': com_pipe.recv,
+                'send': lambda signal, data: self._queue_send(view_dict,
+                                                              signal, data),
+                'send-queue': {},
+                'flush-source-id': 0,
                 'grab_focus': webview.grab_focus,
                 'update-status': lambda info: self._update_status(view_dict,
                                                                   info),
@@ -348,7 +583,7 @@ class BrowserProc(Gtk.Application):
                 'webview': webview,
                 'overlay': overlay,
                 'socket-id': socket_id,
-                'com-pipe': com_pipe,
+                'tab-id': tab_id,
                 'find-controller': find_controller,
                 'find-options': WebKit2.FindOptions.CASE_INSENSITIVE |
                 WebKit2.FindOptions.WRAP_AROUND,
@@ -357,6 +592,16 @@ class BrowserProc(Gtk.Application):
                 'session': b'',
                 'reader-mode': False,
                 'freeze-session': b'',
+                # Bumped whenever the history changes, so the serialized
+                # session is only made again when it could be different.
+                'session-generation': 0,
+                'session-cache': (-1, b''),
+                'sent-session-generation': -1,
+                'history': History(),
+                'restart-tracker': RestartTracker(),
+                'restart-source-id': 0,
+                'crashed-session': b'',
+                'crashed-uri': '',
             }
         )
 
@@ -395,6 +640,11 @@ class BrowserProc(Gtk.Application):
                 webview.connect(signal, func, *args)
             )
 
+        view_dict['back-forward-sig-id'] = (
+            webview.get_back_forward_list().connect(
+                'changed', lambda *args: self._session_changed(view_dict))
+        )
+
         find_controller.connect('found-text', self._found_text, view_dict)
         find_controller.connect(
             'failed-to-find-text',
@@ -407,11 +657,9 @@ class BrowserProc(Gtk.Application):
             view_dict
         )
 
-        GLib.io_add_watch(
-            com_pipe.fileno(),
-            GLib.IO_IN,
-            self._recieve,
-            view_dict
+        self._channel.add_tab(
+            tab_id,
+            lambda signal, data: self._recieve(view_dict, signal, data)
         )
 
         return view_dict
@@ -427,15 +675,57 @@ class BrowserProc(Gtk.Application):
 
         return plug
 
-    def _send(self, signal: str, data: object, com_pipe: object):
-        """Send signal with data over com_pipe."""
+    def _send(self, view_dict: dict, signal: str, data: object):
+        """Send signal with data for view_dict over the channel."""
 
         try:
-            com_pipe.send((signal, data))
+            self._channel.send(view_dict.tab_id, signal, data)
         except BrokenPipeError as err:
             logging.error(f"_send PIPE BROKE CLOSING: {err}")
             self.quit()
 
+    def _queue_send(self, view_dict: dict, signal: str, data: object):
+        """Send signal with data for view_dict.
+
+        State signals are queued and only the latest value of each is sent
+        once every FLUSH_INTERVAL.  Other signals flush the queue first, so
+        everything is recieved in order.
+        """
+        if signal in STATE_SIGNALS:
+            # Move the signal to the end of the queue.
+            view_dict.send_queue.pop(signal, None)
+            view_dict.send_queue[signal] = data
+            if not view_dict.flush_source_id:
+                view_dict.flush_source_id = GLib.timeout_add(
+                    FLUSH_INTERVAL, self._flush_timeout, view_dict)
+            return
+
+        self._flush_send(view_dict)
+        self._send(view_dict, signal, data)
+
+    def _flush_timeout(self, view_dict: dict) -> bool:
+        """Send the queued state signals when the flush interval is up."""
+        view_dict.flush_source_id = 0
+        # Wait for the main window to catch up before sending more.
+        if not self._channel.congested: self._flush_send(view_dict)
+
+        return False
+
+    def _flush_all(self):
+        """Send the queued state signals of every window."""
+        for view_dict in self._windows: self._flush_send(view_dict)
+
+    def _flush_send(self, view_dict: dict):
+        """Send the queued state signals of view_dict."""
+        if view_dict.flush_source_id:
+            GLib.Source.remove(view_dict.flush_source_id)
+            view_dict.flush_source_id = 0
+
+        send_queue = view_dict.send_queue
+        while send_queue:
+            signal = next(iter(send_queue))
+            self._send(view_dict, signal, send_queue.pop(signal))
+
     def _restore_session(self, session_data: bytes, view_dict: dict) -> bool:
         """Restores the session for view_dict."""
         if not session_data:
@@ -443,8 +733,7 @@ class BrowserProc(Gtk.Application):
 
         logging.info('Restoring session...')
 
-        session_bytes = GLib.Bytes.new(codecs.decode(session_data.encode(),
-                                                     'base64'))
+        session_bytes = GLib.Bytes.new(session_data)
         session_state = WebKit2.WebViewSessionState.new(session_bytes)
         view_dict.webview.restore_session_state(session_state)
 
@@ -453,7 +742,8 @@ class BrowserProc(Gtk.Application):
             view_dict.webview.go_to_back_forward_list_item(item)
             view_dict.webview.grab_focus()
 
-        GLib.idle_add(self._send_back_forward, view_dict)
+        self._session_changed(view_dict)
+        self._idle.schedule('back-forward', view_dict)
 
         logging.info('Session restored.')
 
@@ -464,19 +754,29 @@ class BrowserProc(Gtk.Application):
         logging.info('Sending session data...')
 
         view_dict.send('session-data', view_dict.get_session())
+        view_dict.sent_session_generation = view_dict.session_generation
 
         logging.info('Sent session data.')
 
-    def _get_session(self, view_dict: dict):
-        """Return the session_data base64 encoded."""
-        webview = view_dict.webview
-        session_data = b''
+    def _session_changed(self, view_dict: dict):
+        """Mark the session of view_dict as changed."""
+        view_dict.session_generation += 1
+
+    def _get_session(self, view_dict: dict) -> bytes:
+        """Return the serialized session state of view_dict.
+
+        The session is only serialized again after it changed.
+        """
+        generation, session_data = view_dict.session_cache
+        if generation == view_dict.session_generation: return session_data
 
+        session_data = b''
         if not view_dict.is_blank_page():
-            session_bytes = webview.get_session_state().serialize()
-            session_data = codecs.encode(session_bytes.get_data(), 'base64')
+            webview = view_dict.webview
+            session_data = webview.get_session_state().serialize().get_data()
+        view_dict.session_cache = (view_dict.session_generation, session_data)
 
-        return session_data.decode()
+        return session_data
 
     def _is_blank(self, view_dict: dict):
         """Return True if the webview in view_dict is an empty session."""
@@ -499,6 +799,8 @@ class BrowserProc(Gtk.Application):
         # Disconnect all signal handlers for the web_view.
         for sig_id in view_dict.webview_sig_ids:
             view_dict.webview.disconnect(sig_id)
+        view_dict.webview.get_back_forward_list().disconnect(
+            view_dict.back_forward_sig_id)
 
         # Store the session data so it will be sent when the tab is
         # closed.
@@ -523,6 +825,12 @@ class BrowserProc(Gtk.Application):
         """Quit"""
         self._windows.remove(view_dict)
 
+        # Forget the content manager if no other webview shares it.
+        content_manager = view_dict.webview.get_user_content_manager()
+        if not any(window.webview.get_user_content_manager() is
+                   content_manager for window in self._windows):
+            self._filter_states.pop(content_manager, None)
+
         if not self._windows:
             # Close all temporary files.
             for f in self._tmp_files:
@@ -531,6 +839,9 @@ class BrowserProc(Gtk.Application):
             self._cancellable.cancel()
 
             logging.info(f"DESTROYING: {self._pid}")
+            logging.info(self._dispatcher.summary())
+            logging.info(self._idle.summary())
+            logging.info(self._adblock.summary())
 
             self.quit()
 
@@ -544,145 +855,167 @@ class BrowserProc(Gtk.Application):
             logging.error(f"_destroy PIPE BROKE CLOSING: {err}")
 
         logging.info(f"CLOSED {view_dict.webview}")
-        view_dict.com_pipe.close()
+        # Remove the io watches so they don't outlive the pipe when this
+        # process is reused.
+        if view_dict.restart_source_id:
+            GLib.Source.remove(view_dict.restart_source_id)
+        if view_dict.flush_source_id:
+            GLib.Source.remove(view_dict.flush_source_id)
+        self._idle.cancel(view_dict)
+        self._channel.remove_tab(view_dict.tab_id)
+        if not self._windows:
+            # This process is exiting, so send the session before the main
+            # loop stops.
+            self._channel.flush(FLUSH_TIMEOUT)
+            self._channel.close()
         view_dict.clear()
 
     def do_shutdown(self):
         """Finish shutting down the application."""
         Gtk.Application.do_shutdown(self)
 
-    def _recieve(self, source: int, cb_condition: int, view_dict: dict):
-        """Recieve signals from outside."""
-        logging.debug(f"IN RECIEVE: {view_dict.com_pipe}")
-
-        try:
-            signal, data = view_dict.recv()
-        except EOFError as err:
-            logging.error(f'IN PLUG _recieve: EOF')
-            return False
-        except TypeError as err:
-            logging.error(f'IN PLUG _recieve: {err}')
-            return True
-
-        if signal in ['restore-session']:
-            logging.debug(f'SIGNAL: {signal}, DATA: {data}')
-        else:
-            logging.info(f'SIGNAL: {signal}, DATA: {data}')
-
-        if signal == 'close' and data:
-            view_dict.plug.emit('delete-event', None)
-            return False
-
-        if signal == 'grab-focus':
-            view_dict.grab_focus()
-
-        if signal == 'open-uri':
-            view_dict.load(data)
-
-        if signal == 'new-tab':
-            new_win = self._new_tab(view_dict, data)
-            new_win.load(data.get('uri', 'about:blank'))
-
-        if signal == 'socket-id':
-            view_dict['socket-id'] = data
-            view_dict['plug'] = self._create_plug(view_dict)
-
-            # Add the new plug as an application window.
-            self.add_window(view_dict['plug'])
-
-        if signal == 'stop':
-            view_dict['webview'].stop_loading()
-
-        if signal == 'refresh':
-            view_dict['webview'].reload()
-
-        if signal == 'refresh-bypass':
-            view_dict['webview'].reload_bypass_cache()
+    def _make_dispatcher(self) -> object:
+        """Return the dispatcher of the signals from the main window."""
+        handlers = {
+            'close': self._on_close,
+            'grab-focus': lambda view_dict, data: view_dict.grab_focus(),
+            'open-uri': lambda view_dict, data: view_dict.load(data),
+            'new-tab': lambda view_dict, data: self._new_tab(
+                view_dict, data).load(data.get('uri', 'about:blank')),
+            'socket-id': self._on_socket_id,
+            'stop': lambda view_dict, data: view_dict.webview.stop_loading(),
+            'refresh': lambda view_dict, data: view_dict.webview.reload(),
+            'refresh-bypass': lambda view_dict, data:
+                view_dict.webview.reload_bypass_cache(),
+            'history-go-to': self._on_history_go_to,
+            'find': lambda view_dict, data: view_dict.find_controller.search(
+                data, view_dict.find_options, 0),
+            'find-next': lambda view_dict, data:
+                view_dict.find_controller.search_next(),
+            'find-prev': lambda view_dict, data:
+                view_dict.find_controller.search_previous(),
+            'find-finish': lambda view_dict, data:
+                view_dict.find_controller.search_finish(),
+            'restore-session': self._on_restore_session,
+            'get-session': lambda view_dict, data: view_dict.send_session(),
+            'adopt-tab': lambda view_dict, data: self._adopt_tab(data),
+            'web-view-settings': lambda view_dict, data:
+                self._set_webview_property(view_dict.webview.get_settings(),
+                                           *data),
+            'default-search': self._on_default_search,
+            'adblock': self._on_adblock,
+            'media-filter': self._on_media_filter,
+            'adblock-filter': self._on_adblock_filter,
+            'content-filter': self._on_content_filter,
+            'content-filter-whitelist': self._on_content_filter_whitelist,
+            'enable-user-stylesheet': self._on_enable_user_stylesheet,
+        }
 
-        if signal == 'history-go-to':
-            webview = view_dict['webview']
-            if data == 1:
-                webview.go_forward()
-            elif data == -1:
-                webview.go_back()
-            else:
-                back_forward_list = webview.get_back_forward_list()
-                item = back_forward_list.get_nth_item(data)
-                webview.go_to_back_forward_list_item(item)
-
-        if signal.startswith('find'):
-            finder = view_dict['find-controller']
-            if signal.endswith('prev'):
-                finder.search_previous()
-            elif signal.endswith('next'):
-                finder.search_next()
-            elif signal.endswith('finish'):
-                finder.search_finish()
-            else:
-                finder.search(data, view_dict['find-options'], 0)
+        return SignalDispatcher('PLUG', handlers, self._on_unknown,
+                                quiet=QUIET_SIGNALS)
 
-        if signal == 'restore-session':
-            webview = view_dict.webview
-            uri = webview.get_uri()
-            if view_dict.is_blank_page():
-                view_dict.restore_session(data['session-data'])
-            else:
-                new_win = self._new_tab(view_dict, data)
+    def _recieve(self, view_dict: dict, signal: str, data: object) -> bool:
+        """Recieve signals from outside.
 
-        if signal == 'get-session':
-            view_dict.send_session()
+        Return False when view_dict is closing.
+        """
+        return self._dispatcher.dispatch(signal, view_dict, data) is not False
 
-        if signal == 'web-view-settings':
-            settings = view_dict.webview.get_settings()
-            self._set_webview_property(settings, *data)
+    def _on_unknown(self, signal: str, view_dict: dict, data: object):
+        """Ignore signals this process doesn't know."""
+        # TODO: Run the javascript sent with run-js.
+        logging.debug(f'UNHANDLED SIGNAL: {signal} for {view_dict.tab_id}')
 
-        if signal == 'default-search':
-            self._search_url = data
-            view_dict.search_url = data
+    def _on_close(self, view_dict: dict, data: bool) -> bool:
+        """Close the tab of view_dict."""
+        if not data: return True
 
-        if signal == 'adblock':
-            name, regex, active = data
-            if active:
-                self._adblock_filters[name] = regex  # re.compile(regex)
-            else:
-                self._adblock_filters.pop(name, None)
+        view_dict.plug.emit('delete-event', None)
 
-        if signal == 'media-filter':
-            name, regex, active = data
-            if active:
-                self._media_filters[name] = re.compile(regex)
-            else:
-                self._media_filters.pop(name, None)
+        return False
 
-        if signal == 'content-filter':
-            name, uri, active = data
-            self._content_filters[name] = (uri, active)
-            for window in self._windows:
-                self._apply_content_filters(window.webview)
+    def _on_socket_id(self, view_dict: dict, socket_id: int):
+        """Plug the webview of view_dict into its tab."""
+        view_dict['socket-id'] = socket_id
+        view_dict['plug'] = self._create_plug(view_dict)
 
-        if signal == 'content-filter-whitelist':
-            name, uri, active = data
-            self._content_filter_whitelist[name] = (uri, active)
+        # Add the new plug as an application window.
+        self.add_window(view_dict['plug'])
 
-        if signal == 'enable-user-stylesheet':
-            for window in self._windows:
-                self._toggle_user_stylesheet(window.webview, data)
+    def _on_history_go_to(self, view_dict: dict, data: int):
+        """Go to the history item data steps from the current one."""
+        webview = view_dict['webview']
+        if data == 1:
+            webview.go_forward()
+        elif data == -1:
+            webview.go_back()
+        else:
+            back_forward_list = webview.get_back_forward_list()
+            item = back_forward_list.get_nth_item(data)
+            webview.go_to_back_forward_list_item(item)
+
+    def _on_restore_session(self, view_dict: dict, data: dict):
+        """Restore the session in view_dict, or a new tab if it is used."""
+        if view_dict.is_blank_page():
+            view_dict.restore_session(data['session-data'])
+        else:
+            self._new_tab(view_dict, data)
+
+    def _on_default_search(self, view_dict: dict, search_url: str):
+        """Use search_url to search."""
+        self._search_url = search_url
+        view_dict.search_url = search_url
+
+    def _on_adblock(self, view_dict: dict, data: tuple):
+        """Add or remove an adblock filter."""
+        name, regex, active = data
+        if active:
+            self._adblock.add(name, regex)
+        else:
+            self._adblock.remove(name)
 
-        if signal == 'run-js':
-            # TODO: Run the javascript sent.
-            js_data = data
+    def _on_media_filter(self, view_dict: dict, data: tuple):
+        """Add or remove a media filter."""
+        name, regex, active = data
+        if active:
+            self._media_filters[name] = re.compile(regex)
+        else:
+            self._media_filters.pop(name, None)
+
+    def _on_adblock_filter(self, view_dict: dict, filter_id: str):
+        """Use the content filter compiled from the adblock regexes."""
+        if filter_id == self._adblock_filter_id: return
+
+        self._adblock_filter_id = filter_id
+        self._update_content_filters()
+
+    def _on_content_filter(self, view_dict: dict, data: tuple):
+        """Set a content filter and apply them to all the windows."""
+        name, uri, active = data
+        self._content_filters[name] = (uri, active)
+        self._update_content_filters()
+
+    def _on_content_filter_whitelist(self, view_dict: dict, data: tuple):
+        """Set a content filter whitelist entry."""
+        name, uri, active = data
+        if active:
+            self._content_filter_whitelist.add(name, uri)
+        else:
+            self._content_filter_whitelist.remove(name)
 
-        return True
+    def _on_enable_user_stylesheet(self, view_dict: dict, enable: bool):
+        """Add or remove the user stylesheet in all the windows."""
+        for window in self._windows:
+            self._toggle_user_stylesheet(window.webview, enable)
 
     def _new_tab(self, view_dict: dict, data: dict):
         """Make a new window."""
-        com_pipe, proc_pipe = Pipe()
-        new_win = self._create_window(0, proc_pipe, view_dict.webview)
+        tab_id = next(self._tab_ids)
+        new_win = self._create_window(0, tab_id, view_dict.webview)
         info_dict = {
             'uri': data.get('uri', 'about:blank'),
             'pid': self._pid,
-            'com-pipe': com_pipe,
-            'child-pipe': proc_pipe,
+            'tab-id': tab_id,
             'focus': data.get('focus', False),
             'private': data.get('private', self._private),
             'index': data.get('index', -1),
@@ -697,6 +1030,22 @@ class BrowserProc(Gtk.Application):
 
         return new_win
 
+    def _adopt_tab(self, data: dict):
+        """Make a window for a tab moved here from another process.
+
+        Plug it into the tab's socket and restore its session.
+        """
+        new_win = self._create_window(data['socket-id'], data['socket-id'])
+        self._windows.append(new_win)
+        self.add_window(new_win.plug)
+
+        if data['session-data']:
+            new_win.restore_session(data['session-data'])
+        else:
+            new_win.load(data['uri'])
+
+        return new_win
+
     def _new_window(self, webview: object, navigation_action: object,
                     view_dict: dict):
         """New window in this process."""
@@ -1109,12 +1458,14 @@ class BrowserProc(Gtk.Application):
 
     def _is_ad_match(self, uri: str) -> bool:
         """Returns true if uri looks like an ad."""
-        for _, regex in self._adblock_filters.items():
-            # if regex.search(uri):
-            logging.info(f'{regex} in {uri}')
-            if re.search(regex, uri):
-                logging.info(f'AdBlock Blocking: {uri}')
-                return True
+        name = self._adblock.match(uri)
+        if name: logging.info(f'AdBlock Blocking: {uri} ({name})')
+
+        return bool(name)
+
+    def _is_whitelisted(self, uri: str) -> bool:
+        """Return True if content filters are off for uri."""
+        return bool(self._content_filter_whitelist.match(uri))
 
     def _policy(self, webview: object, decision: object, decision_type: object,
                 view_dict: dict):
@@ -1123,15 +1474,9 @@ class BrowserProc(Gtk.Application):
 
         # Remove all content filters from whitelisted uris, otherwise
         # apply content filters.
-        user_content_manager = webview.get_user_content_manager()
-        whitelist_items = self._content_filter_whitelist.items()
-        for _, (whitelisted_uri, active) in whitelist_items:
-            if not page_uri: break
-            if whitelisted_uri in page_uri and active:
-                user_content_manager.remove_all_filters()
-                break
-        else:
-            self._apply_content_filters(webview)
+        if page_uri:
+            self._sync_content_filters(webview,
+                                       self._is_whitelisted(page_uri))
 
         if decision_type in \
                 [WebKit2.PolicyDecisionType.NAVIGATION_ACTION,
@@ -1150,6 +1495,19 @@ class BrowserProc(Gtk.Application):
             if decision_type == WebKit2.PolicyDecisionType.NAVIGATION_ACTION:
                 logging.debug(f'NAV ACTION {uri}')
 
+                # The reload link on the crashed page was clicked.
+                if view_dict.crashed_session and \
+                        nav_action.get_navigation_type() == \
+                        WebKit2.NavigationType.LINK_CLICKED and \
+                        uri == view_dict.crashed_uri == webview.get_uri():
+                    decision.ignore()
+                    session = view_dict.crashed_session
+                    view_dict.crashed_session = b''
+                    view_dict.crashed_uri = ''
+                    view_dict.restart_tracker.reset()
+                    self._restart_crashed(view_dict, session)
+                    return True
+
             if nav_action.get_mouse_button() == 2 or \
                     (nav_action.get_mouse_button() == 1 and
                      nav_action.get_modifiers() &
@@ -1223,7 +1581,7 @@ class BrowserProc(Gtk.Application):
         else:
             logging.info(f"UNKNOWN: {decision} {decision_type}")
 
-        GLib.idle_add(self._send_back_forward, view_dict)
+        self._idle.schedule('back-forward', view_dict)
         decision.use()
 
         return True
@@ -1275,8 +1633,9 @@ class BrowserProc(Gtk.Application):
         value = webview.get_property(prop.name)
         name = prop.name
 
+        if name in ('uri', 'title'): self._session_changed(view_dict)
         if name == 'uri':
-            GLib.idle_add(self._send_back_forward, view_dict)
+            self._idle.schedule('back-forward', view_dict)
 
         logging.info(f"{name.upper()}: {value}")
         view_dict.send(name, value)
@@ -1321,44 +1680,30 @@ class BrowserProc(Gtk.Application):
 
     def _send_back_forward(self, view_dict: dict):
         """Send the back/forward history lists."""
-        # Send the session.
-        view_dict.send_session()
-
-        def build_list(hist_list: object) -> list:
-            """Build a dictionary from hist_list.
-
-            For each item in hist_list add the data to a dictionary and append
-            that to a list.  Return the resulting list of dictionaries.
-            """
-            hist_dict_list = []
-
-            if not hist_list: return hist_dict_list
-
-            for item in hist_list:
-                hist_dict_list.append(
-                    {
-                        'title': item.get_title(),
-                        'uri': item.get_uri(),
-                        'original-uri': item.get_original_uri()
-                    }
-                )
-
-            return hist_dict_list
+        # Send the session if it changed since it was last sent.
+        if view_dict.sent_session_generation != view_dict.session_generation:
+            view_dict.send_session()
 
         webview = view_dict.webview
-        view_dict.send('can-go-back', webview.can_go_back())
-        view_dict.send('can-go-forward', webview.can_go_forward())
-
         back_forward_list = webview.get_back_forward_list()
-
         current_item = back_forward_list.get_current_item()
-        current_dict = build_list([current_item])[0] if current_item else {}
-
-        back_dict_list = build_list(back_forward_list.get_back_list())
-        forward_dict_list = build_list(back_forward_list.get_forward_list())
 
-        view_dict.send('back-forward-list', (back_dict_list, current_dict,
-                                             forward_dict_list))
+        # WebKit lists the back items nearest first and the forward items
+        # farthest first.
+        items, current = [], -1
+        if current_item:
+            back_items = back_forward_list.get_back_list()
+            items = [*reversed(back_items), current_item,
+                     *reversed(back_forward_list.get_forward_list())]
+            current = len(back_items)
+
+        # Only send what changed since the last update.
+        ops = view_dict.history.update(
+            [(item.get_uri(), item.get_title(), item.get_original_uri())
+             for item in items],
+            current
+        )
+        if ops: view_dict.send('back-forward-ops', ops)
 
         return False
 
@@ -1394,13 +1739,20 @@ class BrowserProc(Gtk.Application):
     def _load_status(self, webview: object, load_event: object,
                      view_dict: dict):
         """Notify the parent process when the load status changes."""
+        self._session_changed(view_dict)
+
         if load_event == WebKit2.LoadEvent.STARTED:
-            pass
+            # Forget the crashed session once a load leaves the page that
+            # reloads it.
+            if view_dict.crashed_session and \
+                    webview.get_uri() != view_dict.crashed_uri:
+                view_dict.crashed_session = b''
+                view_dict.crashed_uri = ''
         elif load_event == WebKit2.LoadEvent.REDIRECTED:
             view_dict.send('uri-changed', webview.get_uri())
         elif load_event == WebKit2.LoadEvent.FINISHED:
             view_dict.update_status('')
-            GLib.idle_add(self._send_back_forward, view_dict)
+            self._idle.schedule('back-forward', view_dict)
             self._verify_view(view_dict)
 
         view_dict.send('load-status', int(load_event))
@@ -1488,5 +1840,46 @@ class BrowserProc(Gtk.Application):
 
         reason = 0 : Crashed 1 : Exceeded Memory Limit
         """
-        view_dict.send('crashed', view_dict.get_session())
-        view_dict.restore_session(view_dict.get_session())
+        session = view_dict.get_session()
+        view_dict.send('crashed', session)
+
+        if view_dict.restart_source_id:
+            GLib.Source.remove(view_dict.restart_source_id)
+            view_dict.restart_source_id = 0
+
+        # Wait longer to restore the session every time it crashes, so a
+        # page that keeps crashing doesn't restart in a loop.
+        delay = view_dict.restart_tracker.crashed()
+        if delay is None:
+            self._show_crashed(view_dict, session, reason)
+            return
+
+        logging.info(f'WEB PROCESS CRASHED ({reason}) RESTARTING IN {delay}s')
+        view_dict.restart_source_id = GLib.timeout_add(
+            int(delay * 1000),
+            self._restart_crashed,
+            view_dict,
+            session
+        )
+
+    def _restart_crashed(self, view_dict: dict, session: bytes) -> bool:
+        """Restore the session of the crashed webview."""
+        view_dict.restart_source_id = 0
+        if not view_dict.restore_session(session): view_dict.webview.reload()
+
+        return False
+
+    def _show_crashed(self, view_dict: dict, session: bytes,
+                      reason: object):
+        """Show a page to reload the crashed webview from."""
+        uri = view_dict.webview.get_uri() or 'about:blank'
+        reason_str = 'ran out of memory' if reason == 1 else 'crashed'
+        view_dict.crashed_session = session
+        view_dict.crashed_uri = uri
+        view_dict.webview.load_alternate_html(
+            f'<html><body><h2>This page {reason_str} too many times.</h2>'
+            f'<p><a href="{html_escape(uri)}">Click to reload</a></p>'
+            f'</body></html>',
+            uri,
+            None
+        )
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:sts=4:fdm=indent:fdl=0:
+# -*- coding: UTF8 -*-
+#
+# Process resource statistics
+# Copyright (C) 2016 Josiah Gordon <josiahg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Read the resource usage of browser processes from /proc.
+
+This is used by the main process, so it must not import Gtk.
+"""
+
+import os
+import time
+import logging
+import pathlib
+from collections import deque
+
+_PROC = pathlib.Path('/proc')
+_CLK_TCK = os.sysconf('SC_CLK_TCK')
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def _read_stat(pid: int) -> list:
+    """Return the fields of /proc/pid/stat after the command name."""
+    stat = (_PROC / str(pid) / 'stat').read_text()
+    # The command name is in parentheses and may contain spaces.
+    return stat[stat.rindex(')') + 2:].split()
+
+
+def children_map() -> dict:
+    """Return a dict mapping each running pid to a list of its children."""
+    children = {}
+    for path in _PROC.iterdir():
+        if not path.name.isdigit(): continue
+        try:
+            ppid = int(_read_stat(int(path.name))[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(path.name))
+
+    return children
+
+
+def child_pids(pid: int, parents: dict = None) -> list:
+    """Return the pids of all the descendants of pid.
+
+    This includes the WebKitWebProcess and WebKitNetworkProcess that
+    WebKit starts for a browser process.  parents is a dict from
+    children_map, which is read if it is not given.
+    """
+    if parents is None: parents = children_map()
+
+    descendants = []
+    todo = [pid]
+    while todo:
+        children = parents.get(todo.pop(), [])
+        descendants.extend(children)
+        todo.extend(children)
+
+    return descendants
+
+
+def read_proc_stats(pid: int) -> dict:
+    """Return the memory, cpu time and thread count of pid.
+
+    Memory sizes are in bytes, and cpu-time is in seconds.  PSS is 0 if
+    /proc/pid/smaps_rollup is not available.
+    """
+    fields = _read_stat(pid)
+    stats = {
+        'rss': int(fields[21]) * _PAGE_SIZE,
+        'pss': 0,
+        'cpu-time': (int(fields[11]) + int(fields[12])) / _CLK_TCK,
+        'threads': int(fields[17]),
+    }
+
+    try:
+        rollup = (_PROC / str(pid) / 'smaps_rollup').read_text()
+    except OSError:
+        return stats
+
+    for line in rollup.splitlines():
+        if line.startswith('Pss:'):
+            stats['pss'] = int(line.split()[1]) * 1024
+            break
+
+    return stats
+
+
+def sample_proc_tree(pid: int, parents: dict = None) -> dict:
+    """Return the stats of pid added to those of all its descendants."""
+    total = {'rss': 0, 'pss': 0, 'cpu-time': 0.0, 'threads': 0,
+             'pids': [], 'time': time.monotonic()}
+
+    for proc_pid in [pid, *child_pids(pid, parents)]:
+        try:
+            stats = read_proc_stats(proc_pid)
+        except (OSError, ValueError, IndexError):
+            # The process exited while reading it.
+            continue
+        for key, value in stats.items():
+            total[key] += value
+        total['pids'].append(proc_pid)
+
+    return total
+
+
+def update_stats(history: dict, pids: list, length: int = 12) -> dict:
+    """Sample pids and add the samples to history.
+
+    history maps pid to a deque of the last length samples.  Return a dict
+    mapping each pid to its newest sample with 'cpu-percent' set from the
+    cpu time used since the previous sample.
+    """
+    for pid in tuple(history):
+        if pid not in pids: history.pop(pid)
+
+    # Read the process tree once for all the samples.
+    parents = children_map()
+
+    result = {}
+    for pid in pids:
+        sample = sample_proc_tree(pid, parents)
+        if not sample['pids']: continue
+
+        samples = history.setdefault(pid, deque(maxlen=length))
+        sample['cpu-percent'] = 0.0
+        if samples:
+            last = samples[-1]
+            elapsed = sample['time'] - last['time']
+            if elapsed > 0:
+                used = sample['cpu-time'] - last['cpu-time']
+                sample['cpu-percent'] = max(0.0, 100 * used / elapsed)
+        samples.append(sample)
+        result[pid] = sample
+
+    logging.debug(f'STATS: {result}')
+
+    return result
+
+
+def memory_used(sample: dict) -> int:
+    """Return the pss of sample, or its rss if the pss couldn't be read."""
+    return sample.get('pss') or sample.get('rss') or 0
+
+
+def memory_info() -> tuple:
+    """Return the available and total system memory in bytes."""
+    info = {}
+    try:
+        with open(_PROC / 'meminfo') as meminfo:
+            for line in meminfo:
+                key, value, *_ = line.split()
+                info[key] = int(value) * 1024
+    except (OSError, ValueError):
+        return 0, 0
+
+    return info.get('MemAvailable:', 0), info.get('MemTotal:', 0)
+
+
+def format_size(size: int) -> str:
+    """Return size in bytes as a human readable string."""
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024: return f'{size:.0f} {unit}'
+        size /= 1024
+
+    return f'{size:.1f} GiB'
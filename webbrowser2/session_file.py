@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:sts=4:fdm=indent:fdl=0:
+# -*- coding: UTF8 -*-
+#
+# Session file format
+# Copyright (C) 2016 Josiah Gordon <josiahg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Store sessions with their WebKit session state as raw bytes.
+
+A session file starts with MAGIC, then the format version and the length
+of the JSON list of sessions.  The 'session-data' of each session in the
+JSON is the length of its session state, and the session states follow
+the JSON in the same order.
+
+Files from before this format are JSON with the session state base64
+encoded, and are still read.
+"""
+
+import json
+import struct
+import base64
+import binascii
+
+MAGIC = b'WB2SESSIONS\n'
+VERSION = 1
+
+_header = struct.Struct('!BI')
+
+
+def dumps(sessions: list) -> bytes:
+    """Return sessions as the bytes of a session file."""
+    blobs = []
+    metadata = []
+    for session in sessions:
+        if not session: continue
+        session_data = session.get('session-data') or b''
+        blobs.append(session_data)
+        metadata.append({**session, 'session-data': len(session_data)})
+
+    metadata_bytes = json.dumps(metadata, separators=(',', ':')).encode()
+
+    return b''.join((MAGIC, _header.pack(VERSION, len(metadata_bytes)),
+                     metadata_bytes, *blobs))
+
+
+def loads(data: bytes) -> list:
+    """Return the list of sessions in the session file data.
+
+    Raise ValueError if data is not a session file.
+    """
+    if not data.startswith(MAGIC): return _loads_json(data)
+    if len(data) < len(MAGIC) + _header.size:
+        raise ValueError('Truncated session file')
+
+    version, length = _header.unpack_from(data, len(MAGIC))
+    if version != VERSION:
+        raise ValueError(f'Unknown session file version: {version}')
+
+    offset = len(MAGIC) + _header.size
+    sessions = json.loads(data[offset:offset + length])
+    offset += length
+
+    for session in sessions:
+        size = session['session-data']
+        session['session-data'] = data[offset:offset + size]
+        offset += size
+
+    if offset != len(data): raise ValueError('Truncated session file')
+
+    return sessions
+
+
+def _loads_json(data: bytes) -> list:
+    """Return the sessions in an old JSON session file."""
+    sessions = json.loads(data)
+
+    for session in sessions:
+        if not session: continue
+        session_data = session.get('session-data') or ''
+        try:
+            session['session-data'] = base64.b64decode(session_data)
+        except binascii.Error as err:
+            raise ValueError(f'Bad session data: {err}') from err
+
+    return sessions
+
+
+if __name__ == '__main__':
+    # Compare the size and speed of the old JSON files with this format.
+    import os
+    import time
+
+    sessions = [
+        {
+            'session-data': os.urandom(20000 + 1000 * i),
+            'index': i, 'state': {'minimized': False, 'hidden': False},
+            'pid': 1000 + i, 'private': True, 'focus': i == 0,
+            'title': f'Page {i}', 'uri': f'https://example.com/{i}',
+            'order': 0,
+        } for i in range(50)
+    ]
+
+    def dumps_json(sessions: list) -> bytes:
+        """Return sessions as an old JSON session file."""
+        return json.dumps([
+            {**session, 'session-data': base64.encodebytes(
+                session['session-data']).decode()}
+            for session in sessions
+        ], indent=4).encode()
+
+    for name, dump in (('json', dumps_json), ('binary', dumps)):
+        start = time.perf_counter()
+        for _ in range(20): data = dump(sessions)
+        dump_time = (time.perf_counter() - start) / 20
+        start = time.perf_counter()
+        for _ in range(20): assert loads(data) == sessions
+        load_time = (time.perf_counter() - start) / 20
+        print(f'{name:>7}: {len(data):9} bytes, dump {dump_time * 1000:6.2f} '
+              f'ms, load {load_time * 1000:6.2f} ms')
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:sts=4:fdm=indent:fdl=0:
+# -*- coding: UTF8 -*-
+#
+# The sites of uris
+# Copyright (C) 2016 Josiah Gordon <josiahg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Find the site, the registrable domain, of a uri.
+
+The public suffix list is used if it is installed, otherwise the last
+label, or the last two for the common second levels of country code
+domains, is taken as the suffix.
+"""
+
+import logging
+import pathlib
+import ipaddress
+import functools
+from urllib.parse import urlsplit
+
+
+# The public suffix list installed by most distributions.
+PUBLIC_SUFFIX_LIST = pathlib.Path('/usr/share/publicsuffix/'
+                                  'public_suffix_list.dat')
+
+# The second level labels of country code domains that sites are
+# registered under, used when there is no public suffix list.
+_CC_SECOND_LEVELS = frozenset(('co', 'com', 'org', 'net', 'ac', 'gov'))
+
+
+@functools.lru_cache(maxsize=1)
+def _public_suffixes() -> tuple:
+    """Return the rules, wildcard rules and exceptions of the suffix list.
+
+    They are empty if the list isn't installed.
+    """
+    rules, wildcards, exceptions = set(), set(), set()
+    try:
+        text = PUBLIC_SUFFIX_LIST.read_text(encoding='utf-8')
+    except OSError as err:
+        logging.info(f'No public suffix list: {err}')
+        return rules, wildcards, exceptions
+
+    for line in text.splitlines():
+        rule = line.strip().lower()
+        if not rule or rule.startswith('//'): continue
+        if not rule.isascii():
+            # Host names are punycode.
+            try:
+                rule = rule.encode('idna').decode()
+            except UnicodeError:
+                continue
+        if rule.startswith('!'):
+            exceptions.add(rule[1:])
+        elif rule.startswith('*.'):
+            wildcards.add(rule[2:])
+        else:
+            rules.add(rule)
+
+    return rules, wildcards, exceptions
+
+
+def _suffix_length(labels: list) -> int:
+    """Return how many of the last labels are the public suffix."""
+    rules, wildcards, exceptions = _public_suffixes()
+    if not rules:
+        if (len(labels) > 2 and len(labels[-1]) == 2 and
+                labels[-2] in _CC_SECOND_LEVELS):
+            return 2
+        return 1
+
+    # The longest matching rule wins, and exceptions beat wildcards.
+    for index in range(len(labels)):
+        suffix = '.'.join(labels[index:])
+        if suffix in exceptions: return len(labels) - index - 1
+        if suffix in rules: return len(labels) - index
+        if (index + 1 < len(labels) and
+                '.'.join(labels[index + 1:]) in wildcards):
+            return len(labels) - index
+
+    return 1
+
+
+def site_for_uri(uri: str) -> str:
+    """Return the site of uri.
+
+    The site is the registrable domain of the host name, the public
+    suffix and the label before it, so 'https://www.example.com/page' and
+    'https://images.example.com' are both 'example.com', and
+    'https://news.bbc.co.uk' is 'bbc.co.uk'.  IP addresses are their own
+    site.  Return '' if uri has no host.
+    """
+    try:
+        host = urlsplit(uri).hostname or ''
+    except ValueError:
+        return ''
+
+    host = host.rstrip('.')
+    try:
+        ipaddress.ip_address(host)
+        return host
+    except ValueError:
+        pass
+
+    labels = host.split('.')
+
+    return '.'.join(labels[-(_suffix_length(labels) + 1):])
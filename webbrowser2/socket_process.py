@@ -23,10 +23,15 @@
 
 from .bookmarks import BookmarkMenu
 from .functions import looks_like_uri
+from .sites import site_for_uri
+from .proc_stats import format_size, memory_info, memory_used
 import math
+import time
 import logging
+import itertools
+import threading
 from multiprocessing import Pipe
-from json import loads as json_loads
+from json import loads as json_loads, dumps as json_dumps
 from gi import require_version as gi_require_version
 gi_require_version('Gtk', '3.0')
 gi_require_version('WebKit2', '4.0')
@@ -35,6 +40,24 @@ from .classes import ContentFilterSettings, ContentFilterWhitelistSettings
 from .classes import AgentSettings, AdBlockSettings, MediaFilterSettings
 from .classes import SettingsManager, SessionManager, DownloadManager
 from .classes import ChildDict, Profile, SettingsPopover, SearchSettings
+from .classes import RestartTracker, Channel, SignalDispatcher, History
+from .adblock import active_filters, content_rules, content_filter_id
+from .adblock import CONTENT_FILTER_PREFIX
+from .abp import is_filter_list, filter_ids, compile_filters, chunk_filters
+from .abp import cache_path, load_cache, save_cache
+
+# Signals from the tab processes that are only logged at the debug level.
+QUIET_SIGNALS = frozenset((
+    'mouse-motion', 'back-forward-ops', 'is-secure', 'icon-bytes',
+    'estimated-load-progress', 'hover-link', 'session-data', 'closed',
+))
+
+# Seconds to wait for the exit of a crashed tab process to be reported
+# before giving up on its channel.
+EXIT_REPORT_TIMEOUT = 5
+
+# Seconds between fetching and compiling the content filter lists again.
+CONTENT_FILTER_REFRESH = 24 * 60 * 60
 
 
 class MainWindow(Gtk.Application):
@@ -101,11 +124,13 @@ class MainWindow(Gtk.Application):
         accel_dict = {
             ('<Ctrl>t', '<Control><Alt>t', '<Ctrl><Shift>t'): self._new_tab,
             ('<Ctrl>w', '<Control><Alt>w'): self._close_tab_key,
-            ('<Ctrl><Alt>r',): lambda *a: com_pipe.send(('refresh', True)),
+            ('<Ctrl><Alt>r',): self._log_debug_info,
             ('<Ctrl>l',): self._focus_address_entry_key,
             ('<Ctrl>m',): lambda *a: self._minimize_tab(
                 self._get_child_dict()),
             ('<Ctrl>h',): lambda *a: self._hide_tab(self._get_child_dict()),
+            ('<Ctrl><Alt>m',): lambda *a: self._migrate_tab(
+                self._get_child_dict()),
             ('<Ctrl>f',): self._findbar_toggle,
             ('<Ctrl>d',): lambda *a: self._bookmark_menu.bookmark_page(),
             ('<Ctrl>y',): self._yank_hover,
@@ -284,10 +309,26 @@ class MainWindow(Gtk.Application):
 
         self._pipe = com_pipe
 
-        self._recv = self._pipe.recv
+        self._dispatcher = self._make_dispatcher()
+
+        # Callbacks waiting for replies from the main process by request
+        # id.
+        self._requests = {}
+        self._request_ids = itertools.count(1)
 
         self._cancellable = Gio.Cancellable.new()
 
+        # The token of the latest compile of each content filter, a compile
+        # is dropped if the token changed because the filter was removed or
+        # compiled again.  The lock keeps a compile from writing the cache
+        # of a removed filter.
+        self._filter_tokens = {}
+        self._filter_token_count = itertools.count(1)
+        self._filter_lock = threading.Lock()
+        # Map the ids of the filters being compiled to the arguments of the
+        # compile to start after, so only one runs at a time.
+        self._compiling_filters = {}
+
         self._user_stylesheet = self._profile.get_file('user-stylesheet.css')
         self._reader_js = self._profile.get_file('Readability.js')
         self._reader_css = self._profile.get_file('reader.css')
@@ -298,8 +339,16 @@ class MainWindow(Gtk.Application):
 
         self._home_uri = self._profile.home_uri
 
-        # Save any not saved content filters.
+        # Save any not saved content filters, and refresh the old ones.
         self._content_filter_set_active(self._content_filter_settings)
+        GLib.timeout_add_seconds(CONTENT_FILTER_REFRESH,
+                                 self._refresh_content_filters)
+
+        # The id of the content filter made from the adblock regexes that
+        # the tabs use, and the one being compiled.
+        self._adblock_filter_id = ''
+        self._adblock_filter_wanted = ''
+        self._compile_adblock_filter()
 
         GLib.io_add_watch(self._pipe.fileno(), GLib.IO_IN, self._recieve)
 
@@ -314,6 +363,13 @@ class MainWindow(Gtk.Application):
         GLib.io_add_watch(self._socket.fileno(), GLib.IO_IN,
                           self._handle_extern_signal)
 
+        # Periodically get the resource usage of the tab processes.
+        self._stats_pending = False
+        GLib.timeout_add_seconds(5, self._request_stats)
+
+        # Periodically hibernate tabs that have not been used for a while.
+        GLib.timeout_add_seconds(30, self._hibernate_idle_tabs)
+
     def do_activate(self):
         """Activate the app."""
         self.add_window(self._window)
@@ -325,17 +381,21 @@ class MainWindow(Gtk.Application):
     def _make_tab(self, uri: str = 'about:blank', focus: bool = False,
                   private: bool = True, index: int = -1):
         """Make a tab."""
-        main_pipe, child_pipe = Pipe()
+        channel, child_pipe = self._new_channel()
         socket_id, child = self._add_tab(
-            main_pipe,
-            child_pipe,
+            channel,
             focus,
             uri=uri,
             index=index,
             private=private
         )
 
-        init_dict = {
+        return self._make_init_dict(uri, private, child_pipe, socket_id), child
+
+    def _make_init_dict(self, uri: str, private: bool, child_pipe: object,
+                        socket_id: int) -> dict:
+        """Return the settings to start a new tab process with."""
+        return {
             'profile-path': self._profile._config_path,
             'uri': uri,
             'private': private,
@@ -346,6 +406,7 @@ class MainWindow(Gtk.Application):
             'media-filters': self._profile.media_filters,
             'content-filters': self._profile.content_filters,
             'content-filters-path': self._profile.get_path('content-filters'),
+            'adblock-filter-id': self._adblock_filter_id,
             'content-filter-whitelist': self._profile.content_filter_whitelist,
             'com-pipe': child_pipe,
             'socket-id': socket_id,
@@ -355,8 +416,6 @@ class MainWindow(Gtk.Application):
             'enable-user-stylesheet': self._profile.enable_user_stylesheet,
         }
 
-        return init_dict, child
-
     def save_config(func):
         """Wrap button release events."""
         def wrapper(self, *args, **kwargs):
@@ -383,6 +442,10 @@ class MainWindow(Gtk.Application):
             self._send_all('enable-user-stylesheet', value)
         elif setting == 'home-uri':
             self._home_uri = value if value else 'about:blank'
+        elif setting in ('hibernate-after', 'max-tab-processes',
+                         'process-placement', 'process-memory-limit'):
+            # These are read from the profile when they are needed.
+            pass
         else:
             self._send_all('web-view-settings', (setting, value))
 
@@ -401,6 +464,71 @@ class MainWindow(Gtk.Application):
                             data: str, active: bool):
         """Change adblock."""
         self._send_all('adblock', (name, data, active))
+        self._compile_adblock_filter()
+
+    def _compile_adblock_filter(self):
+        """Make a content filter from the active adblock regexes.
+
+        The filter id has the hash of the regexes in it, so they are only
+        compiled again when they change.
+        """
+        self._adblock_filter_wanted = content_filter_id(
+            active_filters(self._profile.adblock))
+
+        self._content_filter_store.fetch_identifiers(
+            self._cancellable,
+            self._adblock_fetch_callback,
+            self._adblock_filter_wanted
+        )
+
+    def _adblock_fetch_callback(self, content_filter_store: object,
+                                result: object, filter_id: str):
+        """Save the adblock content filter if it isn't in the store."""
+        id_list = content_filter_store.fetch_identifiers_finish(result)
+        if filter_id != self._adblock_filter_wanted: return
+
+        # Remove the filters made from older adblock regexes.
+        for old_id in id_list:
+            if old_id == filter_id: continue
+            if old_id.startswith(CONTENT_FILTER_PREFIX):
+                self._content_filter_removed(None, old_id, '')
+
+        if filter_id in id_list:
+            logging.info(f'SOCKET: Using saved adblock filter {filter_id}')
+            self._set_adblock_filter(filter_id)
+            return
+
+        rules, _ = content_rules(active_filters(self._profile.adblock))
+        if not rules:
+            self._set_adblock_filter('')
+            return
+
+        logging.info(f'SOCKET: Compiling {len(rules)} adblock rules')
+        content_filter_store.save(
+            filter_id,
+            GLib.Bytes.new(json_dumps(rules).encode()),
+            self._cancellable,
+            self._adblock_save_callback,
+            filter_id
+        )
+
+    def _adblock_save_callback(self, content_filter_store: object,
+                               result: object, filter_id: str):
+        """Finishes saving the adblock content filter."""
+        # Only use it if the regexes didn't change while compiling.
+        wanted = filter_id == self._adblock_filter_wanted
+        try:
+            content_filter_store.save_finish(result)
+        except GLib.Error as err:
+            logging.error(f'SOCKET: Adblock filter not compiled: {err}')
+            filter_id = ''
+
+        if wanted: self._set_adblock_filter(filter_id)
+
+    def _set_adblock_filter(self, filter_id: str):
+        """Tell all the tabs to use the adblock content filter filter_id."""
+        self._adblock_filter_id = filter_id
+        self._send_all('adblock-filter', filter_id)
 
     @save_config
     def _media_filter_set_active(self, media_filter_settings: object,
@@ -411,13 +539,29 @@ class MainWindow(Gtk.Application):
     def _content_filter_removed(self, content_filter_settings: object,
                                 filter_id: str, uri: str):
         """Remove content filter."""
-        self._content_filter_store.remove(
-            filter_id,
+        with self._filter_lock:
+            self._filter_tokens[filter_id] = next(self._filter_token_count)
+            cache_path(self._profile.get_path('content-filters'),
+                       filter_id).unlink(missing_ok=True)
+
+        self._content_filter_store.fetch_identifiers(
             self._cancellable,
-            self._filter_remove_callback,
+            self._remove_fetch_callback,
             filter_id
         )
 
+    def _remove_fetch_callback(self, content_filter_store: object,
+                               result: object, filter_id: str):
+        """Remove the content filter filter_id and its chunks."""
+        id_list = content_filter_store.fetch_identifiers_finish(result)
+        for chunk_id in filter_ids(filter_id, id_list) or [filter_id]:
+            content_filter_store.remove(
+                chunk_id,
+                self._cancellable,
+                self._filter_remove_callback,
+                chunk_id
+            )
+
     def _filter_remove_callback(self, content_filter_store: object,
                                 result: object, filter_id: str):
         """Finishes removing the content filter."""
@@ -450,42 +594,217 @@ class MainWindow(Gtk.Application):
             filter_id, uri, active = filter_tuple
             logging.info(f"SOCKET: {filter_id=}, {uri=}, {active=}")
 
-            if filter_id in id_list or not active:
+            if filter_ids(filter_id, id_list) or not active:
                 self._send_all('content-filter', filter_tuple)
-            else:
+            if active and (not filter_ids(filter_id, id_list) or
+                           self._filter_is_old(filter_id)):
                 self._save_filter(content_filter_store, filter_tuple)
         else:
             content_filter_items = self._profile.content_filters.items()
             for filter_id, (uri, active) in content_filter_items:
                 logging.info(f"SOCKET: {filter_id=}, {uri=}, {active=}")
 
-                if filter_id not in id_list and active:
+                if active and (not filter_ids(filter_id, id_list) or
+                               self._filter_is_old(filter_id)):
                     self._save_filter(
                         content_filter_store,
                         (filter_id, uri, active)
                     )
 
+    def _filter_is_old(self, filter_id: str) -> bool:
+        """Return True if the list filter_id was compiled too long ago.
+
+        Lists that don't have a compile cache are only refreshed by the
+        timer.
+        """
+        path = cache_path(self._profile.get_path('content-filters'),
+                          filter_id)
+        try:
+            age = time.time() - path.stat().st_mtime
+        except OSError:
+            return False
+
+        return age > CONTENT_FILTER_REFRESH
+
+    def _refresh_content_filters(self) -> bool:
+        """Fetch and compile the active content filters again.
+
+        Lists are compiled against their cache, so only the filters that
+        changed are compiled, and the chunks that changed replace the old
+        ones.
+        """
+        content_filter_items = self._profile.content_filters.items()
+        for filter_id, (uri, active) in content_filter_items:
+            if not active: continue
+            logging.info(f'SOCKET: Refreshing "{filter_id}" from {uri}')
+            self._save_filter(self._content_filter_store,
+                              (filter_id, uri, active))
+
+        return True
+
     def _save_filter(self, content_filter_store: object, filter_tuple: tuple):
-        """Save the filter."""
+        """Load the filter to save it."""
         filter_id, uri, active = filter_tuple
 
         if (uri_file := self._profile._config_path.joinpath(uri)).is_file():
             uri = uri_file.as_uri()
 
+        with self._filter_lock:
+            token = next(self._filter_token_count)
+            self._filter_tokens[filter_id] = token
+
         filter_file = Gio.File.new_for_uri(uri)
-        content_filter_store.save_from_file(
-            filter_id,
-            filter_file,
+        filter_file.load_contents_async(
             self._cancellable,
-            self._filter_save_callback,
-            filter_tuple
+            self._filter_contents_callback,
+            (filter_tuple, token)
         )
 
-    def _filter_save_callback(self, content_filter_store: object,
-                              result: object, filter_tuple: tuple):
-        """Finishes saving the content filter."""
-        if content_filter_store.save_finish(result):
+    def _filter_is_current(self, filter_id: str, token: int) -> bool:
+        """Return True if token is of the last compile of active filter_id."""
+        _, active = self._profile.content_filters.get(filter_id, ('', False))
+
+        return active and self._filter_tokens.get(filter_id) == token
+
+    def _filter_contents_callback(self, filter_file: object, result: object,
+                                  data: tuple):
+        """Compile the filter if it is an Adblock Plus list, and save it.
+
+        Adblock Plus lists are compiled in a thread and saved in chunks,
+        and only the filters and chunks that changed since the last time
+        are compiled again.  Other lists are saved as one chunk.
+        """
+        filter_tuple, token = data
+        filter_id = filter_tuple[0]
+        try:
+            _, contents, _ = filter_file.load_contents_finish(result)
+        except GLib.Error as err:
+            logging.error(f'SOCKET: Filter "{filter_id}" not loaded: {err}')
+            return
+
+        if not self._filter_is_current(filter_id, token): return
+
+        if is_filter_list(contents):
+            path = cache_path(self._profile.get_path('content-filters'),
+                              filter_id)
+            compile_args = (filter_tuple, contents.decode('utf-8', 'replace'),
+                            path, token)
+            if filter_id in self._compiling_filters:
+                # Compile the newest contents after the running compile.
+                self._compiling_filters[filter_id] = compile_args
+            else:
+                self._start_compile(*compile_args)
+        else:
+            # The id has the hash of the rules in it, so a refresh saves
+            # the rules again only when they changed.
+            chunk_list = chunk_filters(
+                filter_id, [contents.decode('utf-8', 'replace')])
+            self._filter_compiled(filter_tuple, chunk_list, token)
+
+    def _start_compile(self, filter_tuple: tuple, text: str, path: object,
+                       token: int):
+        """Compile the Adblock Plus list text in a thread."""
+        self._compiling_filters[filter_tuple[0]] = None
+        threading.Thread(
+            target=self._compile_filter_list,
+            args=(filter_tuple, text, path, token),
+            daemon=True
+        ).start()
+
+    def _compile_filter_list(self, filter_tuple: tuple, text: str,
+                             path: object, token: int):
+        """Compile the Adblock Plus list text with the cache in path.
+
+        This runs in a thread, and the chunks are saved from the main loop.
+        The cache is only saved if the filter wasn't removed or compiled
+        again meanwhile.
+        """
+        filter_id = filter_tuple[0]
+        chunk_list = None
+        try:
+            chunks, cache = compile_filters(text, load_cache(path))
+        except ValueError as err:
+            logging.error(f'SOCKET: Filter "{filter_id}" not compiled: {err}')
+        else:
+            with self._filter_lock:
+                if self._filter_tokens.get(filter_id) == token:
+                    save_cache(path, cache)
+            chunk_list = chunk_filters(filter_id, chunks)
+
+        GLib.idle_add(self._filter_compiled, filter_tuple, chunk_list, token)
+
+    def _filter_compiled(self, filter_tuple: tuple, chunk_list: list,
+                         token: int) -> bool:
+        """Save the chunks of the compiled filter.
+
+        chunk_list is None if the filter didn't compile.  Start the next
+        compile of the filter if one is waiting.
+        """
+        filter_id = filter_tuple[0]
+        if filter_id in self._compiling_filters:
+            compile_args = self._compiling_filters.pop(filter_id)
+            if compile_args: self._start_compile(*compile_args)
+
+        if chunk_list is None: return False
+        if not self._filter_is_current(filter_id, token):
+            logging.info(f'SOCKET: Dropping old compile of "{filter_id}"')
+            return False
+
+        self._content_filter_store.fetch_identifiers(
+            self._cancellable,
+            self._chunks_fetch_callback,
+            (filter_tuple, chunk_list, token)
+        )
+
+        return False
+
+    def _chunks_fetch_callback(self, content_filter_store: object,
+                               result: object, data: tuple):
+        """Save the chunks that aren't saved and remove the old ones."""
+        filter_tuple, chunk_list, token = data
+        id_list = content_filter_store.fetch_identifiers_finish(result)
+        if not self._filter_is_current(filter_tuple[0], token): return
+
+        chunk_ids = [chunk_id for chunk_id, _ in chunk_list]
+        for old_id in filter_ids(filter_tuple[0], id_list):
+            if old_id in chunk_ids: continue
+            content_filter_store.remove(old_id, self._cancellable,
+                                        self._filter_remove_callback, old_id)
+
+        new_chunks = [
+            (chunk_id, chunk) for chunk_id, chunk in chunk_list
+            if chunk_id not in id_list
+        ]
+        logging.info(f'SOCKET: Saving {len(new_chunks)} of {len(chunk_list)} '
+                     f'chunks of "{filter_tuple[0]}"')
+        if not new_chunks:
             self._send_all('content-filter', filter_tuple)
+            return
+
+        save_state = {'filter-tuple': filter_tuple, 'pending': len(new_chunks)}
+        for chunk_id, chunk in new_chunks:
+            content_filter_store.save(
+                chunk_id,
+                GLib.Bytes.new(chunk),
+                self._cancellable,
+                self._filter_save_callback,
+                save_state
+            )
+
+    def _filter_save_callback(self, content_filter_store: object,
+                              result: object, save_state: dict):
+        """Finishes saving a chunk of a content filter.
+
+        The filter is sent to the tabs when all of its chunks are saved.
+        """
+        try:
+            content_filter_store.save_finish(result)
+        except GLib.Error as err:
+            logging.error(f'SOCKET: Content filter not compiled: {err}')
+
+        save_state['pending'] -= 1
+        if not save_state['pending']:
+            self._send_all('content-filter', save_state['filter-tuple'])
 
     @save_config
     def _content_filter_whitelist_set_active(self, _, name: str = None, data:
@@ -508,19 +827,6 @@ class MainWindow(Gtk.Application):
             state = Gdk.WindowState.TILED
         return False
 
-    def _close_wait(self, child: dict) -> bool:
-        """Wait for child to stop before removing the tab.
-
-        Check if the child is still running.  If it is not running remove the
-        tab.
-        """
-        self._send('refresh', True)
-        self._send('is-alive', child.pid)
-        signal, is_alive = self._recv()
-        if signal != 'is-alive': return True
-        if not is_alive and child: child.remove_tab()
-        return False
-
     def _close_child(self, child: dict) -> bool:
         """Close a tab."""
         # Do not try to close more than once.
@@ -531,6 +837,20 @@ class MainWindow(Gtk.Application):
 
         child.closing = True
 
+        if child.hibernated:
+            # There is no process to send the session, so store the one
+            # it sent when it was hibernated, or the last one it sent
+            # before if it is still hibernating.
+            session = child.hibernated_session
+            if not session.get('session-data'): session = child.session_dict
+            if session.get('session-data'):
+                child.session_dict.update(session)
+                # Restore each hibernated tab in its own process.
+                child.session_dict['pid'] = -child.socket_id
+                self._session_manager.add_session(child.session_dict)
+            child.remove_tab()
+            return True
+
         try:
             child.send('close', True)
         except BrokenPipeError as err:
@@ -544,13 +864,15 @@ class MainWindow(Gtk.Application):
 
     def _remove_tab(self, child: dict):
         """Remove the tab and close its pipe."""
-        # Remove the io watch for child.
-        GLib.Source.remove(child['event-source-id'])
+        # Remove the io watches for child.
+        if child.restart_source_id:
+            GLib.Source.remove(child.restart_source_id)
+        if child.exit_source_id:
+            GLib.Source.remove(child.exit_source_id)
 
         self._tabs.remove_page(self._tabs.page_num(child.tab_grid))
 
-        child.com_pipe.close()
-        child.child_pipe.close()
+        self._unwatch_child(child)
 
         self._windows.pop(child.socket_id).clear()
 
@@ -610,6 +932,8 @@ class MainWindow(Gtk.Application):
 
         self._download_manager.cancel_all()
 
+        logging.info(self._dispatcher.summary())
+
         # Cancel all gio async functions.
         self._cancellable.cancel()
 
@@ -641,18 +965,16 @@ class MainWindow(Gtk.Application):
         pid = session.get('pid', 0)
         private = session.get('private', True)
 
-        if pid in self._pid_map:
-            # Find the child with the same pid as the session to be
-            # restored.
-            for child in self._windows.values():
-                if child.pid == self._pid_map[pid]:
-                    break
-        else:
+        # Restore sessions from the same process in the same new process,
+        # unless its tab has already been removed.
+        child = self._pid_map.get(pid)
+        if not child or child.socket_id not in self._windows:
             # This is the first session from this pid to be restored, so
             # start a new process for it.
             init_dict, child = self._make_tab(private=private,
                                               focus=session.get('focus', True))
-            self._pid_map[pid] = self._new_proc(init_dict, child)
+            self._new_proc(init_dict, child)
+            self._pid_map[pid] = child
             child.set_state(session['state'])
             # child.order = session.get('order', 0)
             self._tabs.reorder_child(child.tab_grid, session['index'])
@@ -676,74 +998,131 @@ class MainWindow(Gtk.Application):
 
         return child.session_dict
 
-    def _callback(self, source: int, cb_condition: int, window: dict):
-        """Handle each window."""
-        try:
-            signal, data = window.recv()
-        except TypeError as err:
-            logging.error(f'{source} {cb_condition} socket_process '
-                          f'_callback {err} for {window}')
-            return True
+    def _new_channel(self) -> tuple:
+        """Return a new channel for a tab process and the pipe to give it."""
+        main_pipe, child_pipe = Pipe()
+        return Channel(main_pipe), child_pipe
+
+    def _watch_child(self, child: dict, channel: object, tab_id: int):
+        """Send and recieve the messages of child over channel."""
+        child.channel = channel
+        child.tab_id = tab_id
+        channel.add_tab(
+            tab_id,
+            lambda signal, data: self._callback(window=child, signal=signal,
+                                                data=data)
+        )
 
-        debug_list = ['mouse-motion', 'back-forward-list', 'can-go-back',
-                      'can-go-forward', 'is-secure', 'icon-bytes',
-                      'estimated-load-progress', 'hover-link',
-                      'session-data', 'closed']
-        if signal in debug_list:
-            logging.debug(f"_CALLBACK: {signal} => {data}")
-        else:
-            logging.info(f"_CALLBACK: {signal} => {data}")
+    def _unwatch_child(self, child: dict):
+        """Stop recieving the messages of child.
+
+        Close its channel if no other tabs use it.
+        """
+        channel = child.channel
+        if not channel: return
+
+        child.channel = None
+        if channel.remove_tab(child.tab_id): channel.close()
+
+    def _make_dispatcher(self) -> object:
+        """Return the dispatcher of the signals from the tab processes."""
+        handlers = {
+            'closed': self._on_closed,
+            'mouse-motion': lambda window, data: window.address_bar.set_visible(
+                not self._profile.hide_address_bar),
+            'tab-info': self._on_tab_info,
+            'create-tab': lambda window, data: self._open_tab(data, window),
+            'title': self._on_title,
+            'icon-bytes': self._on_icon_bytes,
+            'load-status': self._on_load_status,
+            'uri': self._on_uri,
+            'estimated-load-progress': lambda window, data:
+                window.address_entry.set_progress_fraction(
+                    data if data < 1 else 0),
+            'hover-link': self._on_hover_link,
+            'is-playing-audio': lambda window, data:
+                window['playing-icon'].set_visible(data),
+            'is-secure': self._on_is_secure,
+            'insecure-content': self._on_insecure_content,
+            'find-failed': lambda window, data:
+                window['find-entry'].set_name('not-found' if data else ''),
+            'back-forward-ops': self._on_back_forward_ops,
+            'is-loading': self._on_is_loading,
+            'crashed': self._on_session_data,
+            'download': lambda window, data:
+                self._download_manager.new_download(
+                    data['uri'], start=data.get('start', True)),
+            'session-data': self._on_session_data,
+            'notification-clicked': self._on_notification_clicked,
+        }
 
-        if signal == 'closed':
-            session = data['session']
-            if session['session-data']:
-                # Store the closed session in the session manager, so it
-                # can be re-opened.
-                window.session_dict.update(session)
-                self._session_manager.add_session(window.session_dict)
+        return SignalDispatcher('_CALLBACK', handlers, self._on_unknown,
+                                quiet=QUIET_SIGNALS)
+
+    def _callback(self, window: dict, signal: str, data: object) -> bool:
+        """Handle a signal from the process of window.
+
+        Return False when the tab has closed.
+        """
+        return self._dispatcher.dispatch(signal, window, data) is not False
 
-            if data['is-last']:
-                logging.info(f'Sending terminate for: {window.pid}')
-                self._send('terminate', window.pid)
+    def _on_unknown(self, signal: str, window: dict, data: object):
+        """Ignore signals the main window has no use for."""
+        logging.debug(f'UNHANDLED SIGNAL: {signal} from {window.socket_id}')
 
-            window.remove_tab()
+    def _on_closed(self, window: dict, data: dict) -> bool:
+        """Store the session of the closed tab and remove it."""
+        if window.hibernated:
+            self._tab_hibernated(window, data['session'], data['is-last'])
             return False
 
-        if signal == 'mouse-motion':
-            window.address_bar.set_visible(not self._profile.hide_address_bar)
-
-        if signal == 'tab-info':
-            logging.info(f'TAB_INFO: {data}')
-            socket_id, child = self._add_tab(data['com-pipe'],
-                                             data['child-pipe'], data['focus'],
-                                             uri=data['uri'],
-                                             index=data['index'],
-                                             private=data['private'])
-            child.update(data)
-            self._windows[socket_id] = child
-            child.send('socket-id', socket_id)
-            self._update_title(child)
+        session = data['session']
+        if session['session-data']:
+            # Store the closed session in the session manager, so it
+            # can be re-opened.
+            window.session_dict.update(session)
+            self._session_manager.add_session(window.session_dict)
 
-        if signal == 'create-tab':
-            pid = self._new_proc(*self._make_tab(**data))
-
-        if signal == 'title':
-            window.title = data if data else window.uri
-            self._update_title(window)
-
-        if signal == 'icon-bytes':
-            if data:
-                loader = GdkPixbuf.PixbufLoader()
-                loader.set_size(16, 16)
-                loader.write(data)
-                loader.close()
-                pixbuf = loader.get_pixbuf()
-                window['icon'].set_from_pixbuf(pixbuf)
-            else:
-                window['icon'].set_from_gicon(self._blank_gicon,
-                                              Gtk.IconSize.BUTTON)
+        if data['is-last']:
+            logging.info(f'Sending terminate for: {window.pid}')
+            self._send('terminate', window.pid)
+
+        window.remove_tab()
+        return False
+
+    def _on_tab_info(self, window: dict, data: dict):
+        """Add a tab for the new tab made in the process of window."""
+        socket_id, child = self._add_tab(window.channel, data['focus'],
+                                         uri=data['uri'],
+                                         index=data['index'],
+                                         private=data['private'],
+                                         tab_id=data['tab-id'])
+        child.update(data)
+        self._windows[socket_id] = child
+        child.send('socket-id', socket_id)
+        self._update_title(child)
 
-        if signal == 'load-status' and data == 0:
+    def _on_title(self, window: dict, title: str):
+        """Show the new title of window."""
+        window.title = title if title else window.uri
+        self._update_title(window)
+
+    def _on_icon_bytes(self, window: dict, data: bytes):
+        """Show the favicon of window."""
+        if data:
+            loader = GdkPixbuf.PixbufLoader()
+            loader.set_size(16, 16)
+            loader.write(data)
+            loader.close()
+            pixbuf = loader.get_pixbuf()
+            window['icon'].set_from_pixbuf(pixbuf)
+        else:
+            window['icon'].set_from_gicon(self._blank_gicon,
+                                          Gtk.IconSize.BUTTON)
+
+    def _on_load_status(self, window: dict, data: int):
+        """Show the spinner while window loads."""
+        if data == 0:
             window.address_entry.set_name('')
             if window.uri != 'about:blank':
                 uri_str = window.uri
@@ -757,7 +1136,7 @@ class MainWindow(Gtk.Application):
             window.icon_stack.set_visible_child_name('spinner')
             window.icon_stack.get_child_by_name('spinner').start()
             window.insecure_content = False
-        elif signal == 'load-status' and data == 3:
+        elif data == 3:
             entry = window.address_entry
             entry.set_progress_fraction(0)
             entry.set_icon_from_gicon(
@@ -767,107 +1146,129 @@ class MainWindow(Gtk.Application):
             window.icon_stack.set_visible_child_name('icon')
             window.icon_stack.get_child_by_name('spinner').stop()
 
-        if signal == 'uri' and data:
-            window['uri'] = data
-            if data != 'about:blank': window.address_entry.set_text(data)
-
-        if signal == 'estimated-load-progress':
-            window.address_entry.set_progress_fraction(data if data < 1 else 0)
-
-        if signal == 'hover-link':
-            window['hover-uri'] = data['uri']
-
-        if signal == 'is-playing-audio':
-            window['playing-icon'].set_visible(data)
-
-        if signal == 'is-secure':
-            insecure_str = ''
-            verified, issuer_known, certificate, flags = data
-            logging.info(f"ISSUER KNOWN: {issuer_known}")
-
-            window.cert_data = data if certificate else ()
+    def _on_uri(self, window: dict, uri: str):
+        """Show the new uri of window."""
+        if not uri: return
 
-            if verified:
-                verified_str = 'Page has a verified certificate.'
-                window.address_entry.set_name('verified')
-            else:
-                verified_str = 'Page has an invalid or un-verified certificate.'
-                window.address_entry.set_name('unverified')
-
-            if verified and window.get('insecure-content', True):
-                insecure_str = ' Page contains insecure content.'
-                window.address_entry.set_name('insecure')
+        window['uri'] = uri
+        if uri != 'about:blank': window.address_entry.set_text(uri)
 
-            if not window.uri.startswith('https'):
-                verified_str = 'Page is insecure.'
-                window.address_entry.set_name('unverified')
-
-            if window.uri == 'about:blank':
-                tooltip_text = 'Enter address or search terms.'
-                window.address_entry.set_name('neutral')
-            else:
-                tooltip_text = f'{verified_str} {insecure_str}'
+    def _on_hover_link(self, window: dict, data: dict):
+        """Remember the link the mouse is over."""
+        window['hover-uri'] = data['uri']
 
-            window.address_entry.set_tooltip_text(tooltip_text)
+    def _on_is_secure(self, window: dict, data: tuple):
+        """Show the security of the page in the address entry."""
+        insecure_str = ''
+        verified, issuer_known, certificate, flags = data
+        logging.info(f"ISSUER KNOWN: {issuer_known}")
 
-        if signal == 'insecure-content':
-            window.insecure_content = data
+        window.cert_data = data if certificate else ()
 
-        if signal == 'can-go-back':
-            window['back-button'].set_sensitive(data)
+        if verified:
+            verified_str = 'Page has a verified certificate.'
+            window.address_entry.set_name('verified')
+        else:
+            verified_str = 'Page has an invalid or un-verified certificate.'
+            window.address_entry.set_name('unverified')
 
-        if signal == 'can-go-forward':
-            window['forward-button'].set_sensitive(data)
+        if verified and window.get('insecure-content', True):
+            insecure_str = ' Page contains insecure content.'
+            window.address_entry.set_name('insecure')
 
-        if signal == 'find-failed':
-            window['find-entry'].set_name('not-found' if data else '')
+        if not window.uri.startswith('https'):
+            verified_str = 'Page is insecure.'
+            window.address_entry.set_name('unverified')
 
-        if signal == 'back-forward-list':
-            back_list, current_dict, forward_list = data
-            window.back_list = back_list
-            window.current = current_dict
-            window.forward_list = forward_list
+        if window.uri == 'about:blank':
+            tooltip_text = 'Enter address or search terms.'
+            window.address_entry.set_name('neutral')
+        else:
+            tooltip_text = f'{verified_str} {insecure_str}'
 
-            # Save sessions to restore if the window crashes.
-            session_list = [i.session_dict for i in self._windows.values()]
-            self._session_manager.save_sessions(session_list, True)
+        window.address_entry.set_tooltip_text(tooltip_text)
 
-        if signal == 'is-loading':
-            window.is_loading = data
+    def _on_insecure_content(self, window: dict, data: bool):
+        """Remember if the page has insecure content."""
+        window.insecure_content = data
 
-        if signal == 'crashed':
-            if not self._is_closing: window.update_session(data)
+    def _on_back_forward_ops(self, window: dict, ops: list):
+        """Update the history of window."""
+        history = window.history
+        history.apply(ops)
+        window['back-button'].set_sensitive(history.current > 0)
+        window['forward-button'].set_sensitive(
+            0 <= history.current < len(history.entries) - 1)
 
-        if signal == 'download':
-            self._download_manager.new_download(
-                data['uri'], start=data.get('start', True))
+        # Save sessions to restore if the window crashes.
+        session_list = [i.session_dict for i in self._windows.values()]
+        self._session_manager.save_sessions(session_list, True)
 
-        if signal == 'session-data':
-            if not self._is_closing: window.update_session(data)
+    def _on_is_loading(self, window: dict, data: bool):
+        """Remember if window is loading."""
+        window.is_loading = data
 
-        if signal == 'notification-clicked':
-            if data.get('focus-tab', False):
-                self._tabs.set_current_page(
-                    self._tabs.page_num(window.tab_grid))
-                self._window.present()
+    def _on_session_data(self, window: dict, data: dict):
+        """Store the session of window unless the browser is closing."""
+        if not self._is_closing: window.update_session(data)
 
-        return True
+    def _on_notification_clicked(self, window: dict, data: dict):
+        """Switch to window if the notification asks for it."""
+        if data.get('focus-tab', False):
+            self._tabs.set_current_page(self._tabs.page_num(window.tab_grid))
+            self._window.present()
 
     def _recieve(self, source: int, cb_condition: int):
         """Recieve signals from outside."""
         signal, data = self._pipe.recv()
+        self._main_signal(signal, data)
+
+        return True
+
+    def _main_signal(self, signal: str, data: object):
+        """Handle a signal from the main process."""
         logging.info(f'RECIEVE: {signal} => {data}')
 
         if signal == 'add-tab':
-            pid = self._new_proc(*self._make_tab(**data))
+            self._new_proc(*self._make_tab(**data))
 
-        return True
+        if signal == 'reply':
+            request_id, result = data
+            callback = self._requests.pop(request_id, None)
+            if callback: callback(result)
+
+        if signal == 'proc-exited':
+            self._proc_exited(data['pid'], data['exitcode'])
+
+    def _proc_exited(self, pid: int, exitcode: int):
+        """Remove the tabs of the process pid that won't be removed later.
+
+        Tabs that are closing, or whose plug was never added, will not get
+        a plug-removed signal.
+        """
+        for child in tuple(self._windows.values()):
+            if child.pid != pid: continue
+            child.exitcode = exitcode
+            if child.hibernated:
+                if child.channel: self._hibernate_exited(child)
+                continue
+            if child.closing or not child.plug_added:
+                logging.info(f'PROCESS {pid} EXITED: {exitcode} {child.uri}')
+                child.remove_tab()
 
     def _update_title(self, child: dict):
         """Update the window title."""
-        child.title_str = f'{child.title} (pid: {child.pid}) {child.private_str}'
+        if child.crashed and child.restart_source_id:
+            pid_str = 'crashed, restarting'
+        elif child.crashed:
+            pid_str = 'crashed, click to reload'
+        elif child.hibernated:
+            pid_str = 'hibernated'
+        else:
+            pid_str = f'pid: {child.pid}'
+        child.title_str = f'{child.title} ({pid_str}) {child.private_str}'
         child.label.set_text(child.title_str)
-        child.event_box.set_tooltip_text(child.title_str)
+        self._update_tooltip(child)
         # Set window title if child is focused.
         if child == self._get_child_dict():
             self._window.set_title(f'{child.title_str} - {self._name}')
@@ -878,10 +1279,333 @@ class MainWindow(Gtk.Application):
         label.set_ellipsize(Pango.EllipsizeMode.END)
         self._tabs.set_menu_label(child.tab_grid, label)
 
+    def _update_tooltip(self, child: dict):
+        """Show the title and resource usage in the tab tooltip."""
+        tooltip_text = child.title_str
+        if child.stats_str: tooltip_text += f'\n{child.stats_str}'
+        child.event_box.set_tooltip_text(tooltip_text)
+
+    def _request_stats(self) -> bool:
+        """Request the resource usage of all the tab processes."""
+        if self._is_closing: return False
+
+        # Only ask again when the last request has been answered.
+        if not self._stats_pending and self._windows:
+            self._stats_pending = True
+            self._request('stats', True, self._show_stats)
+
+        return True
+
+    def _show_stats(self, stats: dict):
+        """Show the resource usage in the tab tooltips."""
+        self._stats_pending = False
+        for child in self._windows.values():
+            if child.pid not in stats: continue
+            sample = stats[child.pid]
+            child.stats = sample
+            child.stats_str = (
+                f'Memory: {format_size(memory_used(sample))} '
+                f'CPU: {sample["cpu-percent"]:.0f}% '
+                f'Threads: {sample["threads"]} '
+                f'Processes: {len(sample["pids"])}'
+            )
+            self._update_tooltip(child)
+
+        limit = self._profile.process_memory_limit * 1024 * 1024
+        if limit: self._rebalance(stats, limit)
+
+    def _hibernate_idle_tabs(self) -> bool:
+        """Hibernate background tabs that have not been used for a while.
+
+        If the system is low on memory also hibernate the least recently
+        used background tab.
+        """
+        if self._is_closing: return False
+
+        hibernate_after = self._profile.hibernate_after * 60
+        idle_list = sorted(
+            (child for child in self._windows.values()
+             if self._can_hibernate(child)),
+            key=lambda child: child.last_active
+        )
+
+        now = time.monotonic()
+        for child in idle_list:
+            if hibernate_after and now - child.last_active > hibernate_after:
+                self._hibernate_tab(child)
+
+        idle_list = [child for child in idle_list if not child.hibernated]
+        available, total = memory_info()
+        if idle_list and available < total * 0.1:
+            logging.info(f'LOW MEMORY: {available} of {total} available')
+            self._hibernate_tab(idle_list[0])
+
+        return True
+
+    def _can_hibernate(self, child: dict) -> bool:
+        """Return True if child is a background tab that can be hibernated."""
+        return not (
+            child.focus or child.hibernated or child.closing or
+            not child.plug_added or not child.pid or
+            child.playing_icon.get_visible()
+        )
+
+    def _hibernate_tab(self, child: dict):
+        """Close the process of child, but keep its tab.
+
+        The tab is restored from the session its process sends back when it
+        is switched to.
+        """
+        logging.info(f'HIBERNATING: {child.pid} {child.uri}')
+        child.hibernated = True
+        try:
+            child.channel.send(child.tab_id, 'close', True)
+        except (BrokenPipeError, OSError) as err:
+            # Finish hibernating when the process exit is reported.
+            logging.error(f'Broken Pipe: {err}')
+        self._update_title(child)
+
+    def _tab_hibernated(self, child: dict, session: dict, is_last: bool):
+        """Store the session of the hibernated child and stop watching it."""
+        child.hibernated_session = session
+        if is_last: self._send('terminate', child.pid)
+        if child.exit_source_id:
+            GLib.Source.remove(child.exit_source_id)
+            child.exit_source_id = 0
+
+        self._unwatch_child(child)
+
+        child.pid = 0
+        child.stats_str = ''
+        self._update_title(child)
+
+        # The tab was switched to before it finished hibernating, or it
+        # is moving to another process.
+        if child.crashed:
+            self._schedule_restart(child)
+        elif child.focus or child.migrating:
+            self._wake_tab(child, child.migrate_host)
+
+    def _hibernate_exited(self, child: dict):
+        """Finish hibernating child after its process exited.
+
+        Use the session if the process sent it before exiting, otherwise
+        just keep the uri.
+        """
+        # Handle what is left in the channel, this finishes hibernating
+        # child if the process sent its session.
+        child.channel.dispatch()
+        if not child.channel: return
+
+        session = child.hibernated_session or {
+            'session-data': b'', 'title': child.title, 'uri': child.uri
+        }
+        self._tab_hibernated(child, session, False)
+
+    def _wake_tab(self, child: dict, host: dict = None):
+        """Restore the hibernated child in the process of host.
+
+        Start a new process for it if there is no host or it is gone.
+        """
+        # Wait for the process to send its session.
+        if child.channel: return
+
+        logging.info(f'WAKING: {child.uri}')
+        child.hibernated = False
+        child.migrating = False
+        child.migrate_host = None
+        child.crashed = False
+        child.exitcode = None
+        if child.restart_source_id:
+            GLib.Source.remove(child.restart_source_id)
+            child.restart_source_id = 0
+
+        session = child.hibernated_session
+        child.hibernated_session = {}
+        if host and self._can_host(host, child):
+            # The host process makes a plug for the socket and restores the
+            # session in it.
+            self._watch_child(child, host.channel, child.socket_id)
+            host.send('adopt-tab', {
+                'socket-id': child.socket_id,
+                'uri': child.uri,
+                'session-data': session['session-data'],
+            })
+            child.pid = host.pid
+            self._update_title(child)
+            return
+
+        uri = 'about:blank' if session['session-data'] else child.uri
+        channel, child_pipe = self._new_channel()
+        self._watch_child(child, channel, child.socket_id)
+        self._new_proc(
+            self._make_init_dict(uri, child.private, child_pipe,
+                                 child.socket_id),
+            child
+        )
+        if session['session-data']: child.send('restore-session', session)
+
+    def _tab_crashed(self, child: dict):
+        """Restart the crashed process of child in the same tab.
+
+        Keep the tab like a hibernated one, and restart it after the
+        process exits with the last session it sent.
+        """
+        logging.warning(f'TAB CRASHED: {child.pid} {child.uri}')
+        child.crashed = True
+        child.hibernated = True
+        child.plug_added = False
+        if child.session_dict.get('session-data'):
+            child.hibernated_session = dict(child.session_dict)
+        self._update_title(child)
+
+        if child.exitcode is None:
+            # Finish when the exit is reported, or give up on the process
+            # if it never is.
+            self._send('terminate', child.pid)
+            if child.channel and not child.exit_source_id:
+                child.exit_source_id = GLib.timeout_add_seconds(
+                    EXIT_REPORT_TIMEOUT, self._exit_not_reported, child)
+        elif child.channel:
+            self._hibernate_exited(child)
+
+    def _exit_not_reported(self, child: dict) -> bool:
+        """Hibernate the crashed child without waiting for its exit.
+
+        Its channel is closed, and it is restarted with the last session
+        it sent.
+        """
+        child.exit_source_id = 0
+        if child.socket_id not in self._windows: return False
+        if not (child.crashed and child.channel): return False
+
+        logging.warning(f'EXIT NOT REPORTED: {child.pid} {child.uri}')
+        session = child.hibernated_session or {
+            'session-data': b'', 'title': child.title, 'uri': child.uri
+        }
+        self._tab_hibernated(child, session, False)
+
+        return False
+
+    def _schedule_restart(self, child: dict):
+        """Restart the crashed child after a delay.
+
+        The delay grows with every crash, and after too many crashes the
+        tab is only restarted when it is clicked.
+        """
+        delay = child.restart_tracker.crashed()
+        if delay is not None:
+            logging.info(f'RESTARTING IN {delay}s: {child.uri}')
+            child.restart_source_id = GLib.timeout_add(
+                int(delay * 1000), self._restart_crashed, child)
+
+        self._update_title(child)
+
+    def _restart_crashed(self, child: dict) -> bool:
+        """Start a new process for the crashed child."""
+        child.restart_source_id = 0
+        if child.socket_id in self._windows and child.crashed:
+            self._wake_tab(child)
+
+        return False
+
+    def _migrate_tab(self, child: dict, host: dict = None):
+        """Move child to the process of host, or to a new process.
+
+        The session of child is sent by its current process when it closes,
+        and restored in the new process in the same tab and socket.
+        """
+        if child.hibernated or child.closing or not child.pid: return
+
+        logging.info(f'MIGRATING: {child.uri} FROM {child.pid} TO '
+                     f'{host.pid if host else "new process"}')
+        child.migrating = True
+        child.migrate_host = host
+        self._hibernate_tab(child)
+
+    def _can_host(self, host: dict, child: dict) -> bool:
+        """Return True if the process of host can take the tab child."""
+        return (
+            host.socket_id in self._windows and bool(host.pid) and
+            host.private == child.private and
+            not (host.hibernated or host.closing)
+        )
+
+    def _rebalance(self, stats: dict, limit: int):
+        """Move tabs out of processes that use more than limit bytes.
+
+        One tab, the least recently used, is moved from each process every
+        time stats are recieved, until the process is below limit or only
+        has one tab left.
+        """
+        for pid, sample in stats.items():
+            if memory_used(sample) < limit: continue
+
+            tab_list = [
+                child for child in self._windows.values()
+                if child.pid == pid and not (child.hibernated or child.closing)
+            ]
+            if len(tab_list) < 2: continue
+
+            child = min(tab_list, key=lambda child: child.last_active)
+            logging.info(f'PROCESS {pid} OVER MEMORY LIMIT: {sample}')
+            self._migrate_tab(child, self._migration_host(child, stats, limit))
+
+    def _migration_host(self, child: dict, stats: dict, limit: int) -> dict:
+        """Return a tab in the least loaded process that can take child.
+
+        Return None to start a new process if there are less than
+        'max-tab-processes' processes.
+        """
+        max_procs = self._profile.max_tab_processes
+        if not max_procs or self._process_count() < max_procs: return None
+
+        host_list = [
+            host for host in self._windows.values()
+            if host.pid != child.pid and self._can_host(host, child) and
+            memory_used(stats.get(host.pid, {})) < limit
+        ]
+        if not host_list: return None
+
+        tab_counts = {}
+        for host in host_list:
+            tab_counts[host.pid] = tab_counts.get(host.pid, 0) + 1
+
+        return min(host_list, key=lambda host: tab_counts[host.pid])
+
+    def _process_count(self) -> int:
+        """Return the number of tab processes.
+
+        Tabs that are still waiting for their process count as one process
+        each.
+        """
+        return len({
+            child.pid or ('starting', child.socket_id)
+            for child in self._windows.values()
+            if not (child.hibernated or child.closing)
+        })
+
+    def _child_send(self, child: dict, signal: str, data: object):
+        """Send signal and data to the process of child.
+
+        Nothing is sent while child is hibernated.
+        """
+        if child.hibernated: return
+        child.channel.send(child.tab_id, signal, data)
+
     def _send(self, signal: str, data: object):
         """Send signal and data using the main pipe."""
         self._pipe.send((signal, data))
 
+    def _request(self, signal: str, data: object, callback: object):
+        """Send a request to the main process.
+
+        Call callback with the result when the reply is recieved.
+        """
+        request_id = next(self._request_ids)
+        self._requests[request_id] = callback
+        self._pipe.send((signal, data, request_id))
+
     def _send_all(self, signal: str, data: object):
         """Send a signal to all child processes."""
         for child in self._windows.values():
@@ -890,10 +1614,13 @@ class MainWindow(Gtk.Application):
             except Exception as err:
                 logging.error(err)
 
-    def _add_tab(self, com_pipe: object, child_pipe: object,
-                 focus: bool = False, uri: str = 'about:blank',
-                 index: int = -1, private: bool = True):
-        """Add Tab."""
+    def _add_tab(self, channel: object, focus: bool = False,
+                 uri: str = 'about:blank', index: int = -1,
+                 private: bool = True, tab_id: int = 0):
+        """Add a tab that talks to its process over channel.
+
+        The socket id is used as the tab id if tab_id is 0.
+        """
         child = ChildDict()
 
         find_entry = Gtk.Entry()
@@ -1073,10 +1800,10 @@ class MainWindow(Gtk.Application):
 
         child.update({
             'close': lambda: self._close_child(child),
-            'com-pipe': com_pipe,
-            'child-pipe': child_pipe,
-            'send': lambda signal, data: com_pipe.send((signal, data)),
-            'recv': com_pipe.recv,
+            'channel': None,
+            'tab-id': 0,
+            'send': lambda signal, data: self._child_send(child, signal,
+                                                          data),
             'is-loading': False,
             'pid': 0,
             'uri': uri,
@@ -1086,9 +1813,7 @@ class MainWindow(Gtk.Application):
             'private': private,
             'private-str': 'Private' if private else '',
             'cert-data': (False, False, {}, 0),
-            'back-list': [],
-            'current-dict': {},
-            'forward-list': [],
+            'history': History(),
             'icon-stack': icon_stack,
             'address-bar': address_bar,
             'back-button': back_button,
@@ -1120,6 +1845,16 @@ class MainWindow(Gtk.Application):
             'order': 0,
             'closing': False,
             'plug-added': False,
+            'hibernated': False,
+            'hibernated-session': {},
+            'migrating': False,
+            'migrate-host': None,
+            'crashed': False,
+            'restart-tracker': RestartTracker(),
+            'restart-source-id': 0,
+            'exit-source-id': 0,
+            'exitcode': None,
+            'last-active': time.monotonic(),
         })
 
         child['title-str'] = f'{child.title} (pid: {child.pid}) {child.private_str}'
@@ -1165,9 +1900,7 @@ class MainWindow(Gtk.Application):
             if widget not in [tab_close_btn]:
                 child.sig_ids.append((widget, sig_id))
 
-        child['event-source-id'] = GLib.io_add_watch(com_pipe.fileno(),
-                                                     GLib.IO_IN,
-                                                     self._callback, child)
+        self._watch_child(child, channel, tab_id or socket_id)
 
         if focus:
             self._tabs.set_current_page(index)
@@ -1190,6 +1923,12 @@ class MainWindow(Gtk.Application):
             clipboard = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
             clipboard.set_text(child.hover_uri, -1)
 
+    def _log_debug_info(self, accels: object, window: object, keyval: object,
+                        flags: object):
+        """Log the processes and how long handling each signal took."""
+        self._send('refresh', True)
+        logging.info(self._dispatcher.summary())
+
     def _mouse_move(self, window: object, event: object):
         """Hide/unhide address-bar."""
         if self._profile.hide_address_bar:
@@ -1344,7 +2083,9 @@ class MainWindow(Gtk.Application):
 
     def _hist_button_do(self, event: object, child: dict, index: int):
         """Handles going forward or backward in the history if child."""
-        hist_list = child.forward_list if index == 1 else child.back_list
+        history = child.history
+        hist_list = (history.forward_list() if index == 1
+                     else history.back_list())
 
         if event.button == 3:
             menu = self._make_history_menu(hist_list, bool(index  - 1), child)
@@ -1397,7 +2138,9 @@ class MainWindow(Gtk.Application):
 
     def _history_go(self, event: object, child: dict, index: int):
         """Go to index in child's history."""
-        hist_list = child.forward_list if index > 0 else child.back_list
+        history = child.history
+        hist_list = (history.forward_list() if index > 0
+                     else history.back_list())
 
         if event.button == 2 or (event.button == 1 and \
                 event.state & Gdk.ModifierType.CONTROL_MASK):
@@ -1446,12 +2189,64 @@ class MainWindow(Gtk.Application):
         if not flags & Gdk.ModifierType.SHIFT_MASK:
             if flags & Gdk.ModifierType.MOD1_MASK:
                 settings['private'] = False
-            pid = self._new_proc(*self._make_tab(**settings))
+            self._open_tab(settings, child)
         else:
             settings['index'] = self._tabs.get_current_page() + 1
             settings['order'] = child.order + 1
             child.send('new-tab', settings)
 
+    def _open_tab(self, settings: dict, opener: dict = None):
+        """Open a new tab in the process chosen by _place_tab."""
+        host = self._place_tab(settings.get('uri', 'about:blank'),
+                               settings.get('private', True), opener)
+        if not host:
+            self._new_proc(*self._make_tab(**settings))
+            return
+
+        logging.info(f'PLACING {settings} IN PROCESS: {host.pid}')
+        settings = dict(settings)
+        settings.setdefault('index', self._tabs.get_current_page() + 1)
+        settings['order'] = (opener or host).order + 1
+        host.send('new-tab', settings)
+
+    def _place_tab(self, uri: str, private: bool,
+                   opener: dict = None) -> dict:
+        """Return the tab whose process should open uri.
+
+        Return None if a new process should be started.  The
+        'process-placement' profile setting is 'opener' to use the process
+        of the tab that opened uri, 'site' to use a process that already
+        has a tab from the same site as uri, or anything else to always
+        start a new process.  Once there are 'max-tab-processes' processes
+        (0 for no limit) use the one with the fewest tabs.
+        """
+        # Only tabs of the same privacy can share a process.
+        tab_list = [
+            child for child in self._windows.values()
+            if child.pid and child.private == private and
+            not (child.hibernated or child.closing)
+        ]
+
+        placement = self._profile.process_placement
+        if placement == 'opener' and opener:
+            for child in tab_list:
+                if child is opener: return child
+
+        site = site_for_uri(uri)
+        if placement == 'site' and site:
+            for child in tab_list:
+                if site_for_uri(child.uri) == site: return child
+
+        max_procs = self._profile.max_tab_processes
+        if not max_procs or self._process_count() < max_procs: return None
+        if not tab_list: return None
+
+        tab_counts = {}
+        for child in tab_list:
+            tab_counts[child.pid] = tab_counts.get(child.pid, 0) + 1
+
+        return min(tab_list, key=lambda child: tab_counts[child.pid])
+
     @button_release
     def _new_tab_released(self, button: object, event: object):
         """Call _open_new_tab.
@@ -1483,9 +2278,13 @@ class MainWindow(Gtk.Application):
         prev_child = self._get_child_dict()
         # Set the previous tabs focus to false.
         prev_child.focus = False
+        prev_child.last_active = time.monotonic()
 
         child_dict = self._get_child_dict(tab_grid)
         child_dict.focus = True
+        child_dict.last_active = time.monotonic()
+        if child_dict.hibernated and not child_dict.crashed:
+            self._wake_tab(child_dict)
         self._window.set_title(f'{child_dict.title_str} - {self._name}')
         # Set the order to one greater than the last tab, so when this
         # tab is closed the last one will be selected.
@@ -1535,6 +2334,11 @@ class MainWindow(Gtk.Application):
                 widget == child.close_button:
             return self._close_tab(event.state, child)
 
+        # Reload a tab that crashed too many times when it is clicked.
+        if event.button == 1 and child.crashed:
+            child.restart_tracker.reset()
+            self._wake_tab(child)
+
     def _close_tab(self, flags: object, child: dict):
         """Close child's tab."""
         # Switch to the last focused tab before closing the current tab.
@@ -1599,25 +2403,42 @@ class MainWindow(Gtk.Application):
         child.address_bar.show_all()
         child.address_entry.grab_focus()
 
-    def _new_proc(self, settings: dict, child: dict) -> int:
-        """Start a new process using settings and return the pid."""
-        self._send('new-proc', settings)
-        signal, data = self._recv()
-        if signal != 'proc-pid': return 0
-        child.pid = data
+    def _new_proc(self, settings: dict, child: dict):
+        """Start a new process for child using settings."""
+        self._request('new-proc', settings,
+                      lambda pid: self._proc_started(child, pid))
+
+        # Sending the pipe duplicated it for the process, so close this
+        # end, otherwise the channel never sees the end of the pipe when
+        # the process dies.
+        settings['com-pipe'].close()
+
+    def _proc_started(self, child: dict, pid: int):
+        """Set the pid of child when its process has started."""
+        logging.info(f'PROCESS STARTED: {pid} {child.uri}')
+        if child.socket_id not in self._windows:
+            # The tab was removed before the process started.
+            self._send('terminate', pid)
+            return
+
+        child.pid = pid
         self._update_title(child)
 
-        return data
-
     def _plug_removed(self, socket: object, child: dict):
         """Re-open removed plug."""
         logging.info(f"PLUG REMOVED: {child.uri}")
-        self._send('terminate', child['pid'])
+        if child.hibernated:
+            # Keep the socket for the plug of the woken up tab.
+            child.plug_added = False
+            return True
 
-        # Do not restore the session if the plug was removed due to
-        # closing the tab.
-        if not child.closing: self._restore_session(child.session_dict)
+        # The plug was removed without closing the tab, so its process
+        # crashed.
+        if not child.closing:
+            self._tab_crashed(child)
+            return True
 
+        self._send('terminate', child['pid'])
         child.remove_tab()
 
         return True
@@ -1650,7 +2471,7 @@ class MainWindow(Gtk.Application):
     def _bookmark_open_folder(self, menu: object, uri_list: list):
         """Open the uri_list as tabs."""
         for uri in uri_list:
-            pid = self._new_proc(*self._make_tab(uri=uri, focus=True))
+            self._open_tab({'uri': uri, 'focus': True})
 
     def _bookmark_new(self, menu: object):
         """Return the current tab."""
@@ -1673,6 +2494,6 @@ class MainWindow(Gtk.Application):
 
         if signal == 'new-tab':
             for uri in data:
-                pid = self._new_proc(*self._make_tab(uri=uri))
+                self._open_tab({'uri': uri})
 
         return True
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:sts=4:fdm=indent:fdl=0:
+# -*- coding: UTF8 -*-
+#
+# Content filter whitelist
+# Copyright (C) 2016 Josiah Gordon <josiahg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Find if a uri is in the content filter whitelist.
+
+Entries are a host, like example.com, or a host and a path, like
+example.com/forum.  An entry matches the uris on its host and on all of
+its subdomains, and if it has a path, only the uris with that path or
+paths under it.  Entries are indexed by host, so a lookup only looks at
+the suffixes of the host of the uri.
+"""
+
+import logging
+import urllib.parse
+
+
+def split_entry(entry: str) -> tuple:
+    """Return the host and path prefix of the whitelist entry."""
+    entry = entry.strip()
+    if '://' not in entry: entry = f'//{entry}'
+
+    try:
+        parts = urllib.parse.urlsplit(entry)
+    except ValueError:
+        return '', ''
+
+    host = (parts.hostname or '').lstrip('*.').rstrip('.')
+
+    return host, parts.path.rstrip('/')
+
+
+class WhitelistIndex(object):
+    """Find which whitelist entry a uri is on.
+
+    entries maps the name of each entry to the entry, a host and an
+    optional path.
+    """
+
+    def __init__(self, entries: dict = {}):
+        """Index entries."""
+        # Map each host to the path prefixes on it, and each path prefix to
+        # the names of the entries with it.
+        self._hosts = {}
+
+        # Map each name to its host and path prefix.
+        self._entries = {}
+
+        for name, entry in entries.items(): self.add(name, entry)
+
+    def __len__(self) -> int:
+        """Return the number of entries."""
+        return len(self._entries)
+
+    def add(self, name: str, entry: str):
+        """Add or replace the entry name."""
+        self.remove(name)
+
+        host, path = split_entry(entry)
+        if not host:
+            logging.error(f'Bad whitelist entry {name}: {entry}')
+            return
+
+        self._entries[name] = (host, path)
+        paths = self._hosts.setdefault(host, {})
+        paths.setdefault(path, set()).add(name)
+
+    def remove(self, name: str):
+        """Remove the entry name if there is one."""
+        if name not in self._entries: return
+
+        host, path = self._entries.pop(name)
+        paths = self._hosts[host]
+        paths[path].discard(name)
+        if not paths[path]: del paths[path]
+        if not paths: del self._hosts[host]
+
+    def match(self, uri: str) -> str:
+        """Return the name of an entry uri is on, or '' if there is none."""
+        try:
+            parts = urllib.parse.urlsplit(uri)
+        except ValueError:
+            return ''
+
+        host = parts.hostname
+        if not host: return ''
+
+        # Look at the host, then at each domain it is under.
+        labels = host.rstrip('.').split('.')
+        for index in range(len(labels)):
+            paths = self._hosts.get('.'.join(labels[index:]))
+            if not paths: continue
+            for path, names in paths.items():
+                # Match whole path segments, so /forum isn't on /forums.
+                if (not path or parts.path == path or
+                        parts.path.startswith(f'{path}/')):
+                    return next(iter(names))
+
+        return ''
+
+
+if __name__ == '__main__':
+    # Compare the substring test the plug process used to do with the
+    # index on a 10k entry whitelist.
+    import time
+    import random
+
+    random.seed(0)
+
+    whitelist = {
+        f'site {number}': (f'site{number}.example.com' if number % 10 else
+                           f'site{number}.example.org/forum')
+        for number in range(10000)
+    }
+
+    uri_list = []
+    for _ in range(20000):
+        number = random.randrange(20000)
+        host = random.choice((f'site{number}.example.com',
+                              f'www.site{number}.example.org',
+                              f'cdn.other{number}.net'))
+        path = random.choice(('/', '/forum/thread', '/news/today'))
+        uri_list.append(f'https://{host}{path}')
+
+    def search_all(uri: str) -> str:
+        """Return the name of the first entry that is in uri."""
+        for name, entry in whitelist.items():
+            if entry in uri: return name
+        return ''
+
+    start = time.perf_counter()
+    index = WhitelistIndex(whitelist)
+    print(f'{len(index)} entries indexed in '
+          f'{(time.perf_counter() - start) * 1000:.1f} ms')
+
+    for name, match, count in (('substring', search_all, 500),
+                               ('index', index.match, len(uri_list))):
+        start = time.perf_counter()
+        matched = sum(bool(match(uri)) for uri in uri_list[:count])
+        elapsed = time.perf_counter() - start
+        print(f'{name:>9}: {elapsed / count * 1e6:9.1f} us/uri, '
+              f'{matched} of {count} whitelisted')
+
+    # The substring test also matches hosts in the query string.
+    uri = 'https://ads.example.net/?ref=site1.example.com'
+    print(f'{uri}: substring {search_all(uri)!r}, index {index.match(uri)!r}')
+    assert not index.match(uri)
+    assert index.match('https://a.site1.example.com/page')
+    assert index.match('https://site10.example.org/forum/thread')
+    assert not index.match('https://site10.example.org/news')
+    assert index.match('https://site10.example.org/forum')
+    assert not index.match('https://site10.example.org/forums')
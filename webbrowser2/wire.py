@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# vim: sw=4:ts=4:sts=4:fdm=indent:fdl=0:
+# -*- coding: UTF8 -*-
+#
+# Tab message wire format
+# Copyright (C) 2016 Josiah Gordon <josiahg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Binary encoding of the messages between the tabs and the main window.
+
+Every message starts with a header of the format version, the encoding
+used, and the id of the signal.  The frequent messages have a fixed
+layout, everything else is pickled the same way Connection.send does it,
+so pipes can still be sent to other processes.
+"""
+
+import struct
+import pickle
+from multiprocessing.reduction import ForkingPickler
+
+VERSION = 3
+
+# Only add to the end of this tuple, and bump VERSION if a signal is
+# removed or the order or the layout of a signal changes.
+SIGNALS = (
+    'estimated-load-progress', 'load-status', 'hover-link', 'is-loading',
+    'is-playing-audio', 'mouse-motion', 'title', 'uri', 'uri-changed',
+    'icon-bytes', 'is-secure', 'session-data', 'closed', 'crashed',
+    'tab-info', 'create-tab', 'download', 'find-failed', 'insecure-content',
+    'load-error', 'notification-clicked', 'tls-error', 'close',
+    'grab-focus', 'open-uri', 'new-tab', 'socket-id', 'stop', 'refresh',
+    'refresh-bypass', 'history-go-to', 'find', 'find-next', 'find-prev',
+    'find-finish', 'restore-session', 'get-session', 'web-view-settings',
+    'default-search', 'adblock', 'media-filter', 'content-filter',
+    'content-filter-whitelist', 'enable-user-stylesheet', 'adopt-tab',
+    'back-forward-ops', 'adblock-filter',
+)
+SIGNAL_IDS = {signal: signal_id for signal_id, signal in enumerate(SIGNALS)}
+
+# The id used for signals not in SIGNALS.  The name is pickled with the
+# data.
+UNKNOWN_ID = 0xFFFF
+
+# The encodings of the data.
+PICKLE, FIXED = 0, 1
+
+_header = struct.Struct('!BBH')
+_bool = struct.Struct('!?')
+_byte = struct.Struct('!B')
+_double = struct.Struct('!d')
+_str_len = struct.Struct('!i')
+_tab_id = struct.Struct('!i')
+
+
+def _pack_str(text: str) -> bytes:
+    """Pack text with its length, -1 for None."""
+    if text is None: return _str_len.pack(-1)
+    data = text.encode('utf-8', 'surrogatepass')
+
+    return _str_len.pack(len(data)) + data
+
+
+def _unpack_str(data: memoryview, offset: int = 0) -> tuple:
+    """Return the string packed at offset in data and the next offset."""
+    length, = _str_len.unpack_from(data, offset)
+    offset += _str_len.size
+    if length < 0: return None, offset
+
+    text = bytes(data[offset:offset + length]).decode('utf-8', 'surrogatepass')
+
+    return text, offset + length
+
+
+def _pack_link(link: dict) -> bytes:
+    """Pack the hover-link dict."""
+    return _pack_str(link['uri']) + _pack_str(link['title'])
+
+
+def _unpack_link(data: memoryview) -> dict:
+    """Unpack the hover-link dict."""
+    uri, offset = _unpack_str(data)
+    title, _ = _unpack_str(data, offset)
+
+    return {'uri': uri, 'title': title}
+
+
+def _check_str(text: str) -> bool:
+    """Return True if text can be packed as a string."""
+    return text is None or type(text) is str
+
+
+_bool_layout = (
+    lambda value: type(value) is bool,
+    _bool.pack,
+    lambda data: _bool.unpack(data)[0],
+)
+_str_layout = (_check_str, _pack_str, lambda data: _unpack_str(data)[0])
+
+# The check, pack and unpack functions of the signals with a fixed layout.
+# Data that does not pass the check is pickled instead.
+LAYOUTS = {
+    'estimated-load-progress': (
+        lambda value: type(value) is float,
+        _double.pack,
+        lambda data: _double.unpack(data)[0],
+    ),
+    'load-status': (
+        lambda value: type(value) is int and 0 <= value < 256,
+        _byte.pack,
+        lambda data: _byte.unpack(data)[0],
+    ),
+    'hover-link': (
+        lambda link: (type(link) is dict and link.keys() == {'uri', 'title'}
+                      and _check_str(link['uri'])
+                      and _check_str(link['title'])),
+        _pack_link,
+        _unpack_link,
+    ),
+    'is-loading': _bool_layout,
+    'is-playing-audio': _bool_layout,
+    'mouse-motion': _bool_layout,
+    'title': _str_layout,
+    'uri': _str_layout,
+    'uri-changed': _str_layout,
+    'icon-bytes': (lambda value: type(value) is bytes, bytes, bytes),
+    'session-data': (lambda value: type(value) is bytes, bytes, bytes),
+    'crashed': (lambda value: type(value) is bytes, bytes, bytes),
+}
+
+
+def encode(signal: str, data: object) -> bytes:
+    """Return the message of signal and data as bytes."""
+    signal_id = SIGNAL_IDS.get(signal, UNKNOWN_ID)
+    layout = LAYOUTS.get(signal)
+    if layout and layout[0](data):
+        return _header.pack(VERSION, FIXED, signal_id) + layout[1](data)
+
+    payload = data if signal_id != UNKNOWN_ID else (signal, data)
+
+    return (_header.pack(VERSION, PICKLE, signal_id) +
+            bytes(ForkingPickler.dumps(payload)))
+
+
+def decode(message: bytes) -> tuple:
+    """Return the signal and data in message.
+
+    Raise ValueError if message is not from this version of the format.
+    """
+    version, encoding, signal_id = _header.unpack_from(message)
+    if version != VERSION:
+        raise ValueError(f'Unknown message version: {version}')
+
+    data = memoryview(message)[_header.size:]
+    if encoding == FIXED:
+        signal = SIGNALS[signal_id]
+        return signal, LAYOUTS[signal][2](data)
+
+    if signal_id == UNKNOWN_ID: return pickle.loads(data)
+
+    return SIGNALS[signal_id], pickle.loads(data)
+
+
+def encode_tab(tab_id: int, signal: str, data: object) -> bytes:
+    """Return the message of signal and data for the tab tab_id as bytes.
+
+    This is used when the tabs of a process share one pipe.
+    """
+    return _tab_id.pack(tab_id) + encode(signal, data)
+
+
+def decode_tab(message: bytes) -> tuple:
+    """Return the tab id, signal and data in message."""
+    tab_id, = _tab_id.unpack_from(message)
+
+    return (tab_id, *decode(memoryview(message)[_tab_id.size:]))
+
+
+def send_message(com_pipe: object, signal: str, data: object):
+    """Send signal and data over the Connection com_pipe."""
+    com_pipe.send_bytes(encode(signal, data))
+
+
+def recv_message(com_pipe: object) -> tuple:
+    """Return the next signal and data recieved on com_pipe."""
+    return decode(com_pipe.recv_bytes())
+
+
+if __name__ == '__main__':
+    # Compare sending the frequent messages with Connection.send and with
+    # this format.
+    import time
+    import threading
+    from multiprocessing import Pipe
+
+    messages = [
+        ('estimated-load-progress', 0.4375),
+        ('load-status', 2),
+        ('hover-link', {'uri': 'https://www.example.com/some/page.html',
+                        'title': 'A link'}),
+        ('uri-changed', 'https://www.example.com/some/page.html'),
+        ('back-forward-ops', [
+            ('push', [('https://www.example.com/some/page.html', 'A page',
+                       'https://www.example.com/some/page.html')]),
+            ('current', 3),
+        ]),
+        ('is-loading', True),
+        ('mouse-motion', True),
+        ('title', 'Example Domain'),
+    ] * 12500
+
+    def run(name: str, send: object, recv: object):
+        """Send all the messages through a pipe and print the rate."""
+        recv_pipe, send_pipe = Pipe(duplex=False)
+
+        def reader():
+            for _ in messages: recv(recv_pipe)
+
+        thread = threading.Thread(target=reader)
+        start = time.perf_counter()
+        thread.start()
+        for signal, data in messages: send(send_pipe, signal, data)
+        thread.join()
+        elapsed = time.perf_counter() - start
+
+        print(f'{name:>7}: {len(messages) / elapsed:10.0f} messages/s')
+
+    pickle_sizes = [
+        len(ForkingPickler.dumps(message)) for message in messages[:8]
+    ]
+    wire_sizes = [len(encode(*message)) for message in messages[:8]]
+    for (signal, _), pickle_size, wire_size in zip(messages, pickle_sizes,
+                                                   wire_sizes):
+        print(f'{signal:>24}: pickle {pickle_size:3} bytes, '
+              f'wire {wire_size:3} bytes')
+    print(f'{"mean":>24}: pickle {sum(pickle_sizes) / 8:5.1f} bytes, '
+          f'wire {sum(wire_sizes) / 8:5.1f} bytes')
+
+    for message in messages[:8]:
+        assert decode(encode(*message)) == message
+        assert decode_tab(encode_tab(-7, *message)) == (-7, *message)
+
+    run('pickle', lambda pipe, signal, data: pipe.send((signal, data)),
+        lambda pipe: pipe.recv())
+    run('wire', send_message, recv_message)